@@ -0,0 +1,169 @@
+"""Post build hook to reconcile AWS ALB listener rules (declaratively)."""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from stacker.lookups.handlers.output import handler as output_handler
+from stacker_utils import profiler
+from stacker_utils.clients import get_client
+from stacker_utils.listener_rules import diff_rules, get_listener_rules
+from stacker_utils.profiler import profiled
+
+LOGGER = logging.getLogger(__name__)
+MAX_WORKERS = 8
+
+
+def listener_name(listener_arn):
+    """Return the (short) name of a listener for log messages."""
+    return listener_arn.split('/', 1)[-1]
+
+
+def plan_listener(client, listener_arn, desired_rules, prune):
+    """Return the changes needed for the rules of a listener."""
+    existing_rules = get_listener_rules(client, listener_arn)
+    changes = diff_rules(desired_rules, existing_rules, prune)
+    LOGGER.info('%s: %s creates, %s modifies, %s priority changes,'
+                ' %s deletes', listener_name(listener_arn),
+                len(changes['creates']), len(changes['modifies']),
+                len(changes['priorities']), len(changes['deletes']))
+    return changes
+
+
+def delete_rules(client, listener_arn, changes):
+    """Delete the rules of a listener that aren't desired.
+
+    Every applied change is logged (a record of a partial reconciliation).
+    """
+    for rule_arn in changes['deletes']:
+        client.delete_rule(RuleArn=rule_arn)
+        LOGGER.info('%s: deleted rule %s', listener_name(listener_arn),
+                    rule_arn)
+
+
+def apply_rules(client, listener_arn, changes):
+    """Modify and create the rules of a listener.
+
+    Every applied change is logged (a record of a partial reconciliation).
+    """
+    for rule_arn, rule in changes['modifies']:
+        client.modify_rule(RuleArn=rule_arn,
+                           Conditions=rule['Conditions'],
+                           Actions=rule['Actions'])
+        LOGGER.info('%s: modified rule %s', listener_name(listener_arn),
+                    rule_arn)
+    for rule in changes['creates']:
+        kwargs = dict((k, v) for k, v in rule.items()
+                      if k in ('Conditions', 'Actions', 'Tags'))
+        client.create_rule(ListenerArn=listener_arn,
+                           Priority=int(rule['Priority']), **kwargs)
+        LOGGER.info('%s: created rule with priority %s',
+                    listener_name(listener_arn), rule['Priority'])
+
+
+def run_concurrently(func, args_list):
+    """Run a function concurrently (once per args) and return the results.
+
+    Stops at the first failure: the work that hasn't started yet is
+    skipped (the running work is finished) and the exception is raised.
+    """
+    if not args_list:
+        return []
+    failed = threading.Event()
+
+    def run(*args):
+        """Run the function (unless some work already failed)."""
+        if failed.is_set():
+            return None
+        try:
+            return func(*args)
+        except Exception:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(args_list))) as executor:
+        futures = [executor.submit(profiler.bind(run), *args)
+                   for args in args_list]
+    return [future.result() for future in futures]
+
+
+@profiled
+def reconcile_listener_rules(provider, context, **kwargs):
+    """Reconcile the rules of ALB listeners with the desired rules.
+
+    Fetches the existing rules of all the listeners, diffs them in memory
+    and only applies the changes needed (concurrently across listeners):
+    deletes (if Prune), priority changes (in one set_rule_priorities
+    call), modifies and creates. Rules are matched by their conditions, so
+    a rerun is a no-op. Rules without a Priority get the lowest free one
+    (or keep their current one) and priority collisions fail before any
+    change is made. The first failing change stops the reconciliation (the
+    listeners not started yet are left alone) and every change applied is
+    logged.
+
+    For example:
+
+      post_build:
+        - path: hooks.alb-listener-rules.reconcile_listener_rules
+          args:
+            Prune: false  # delete the rules that aren't listed
+            Listeners:
+              - ListenerArn: alb-stack::HttpListenerArn  # or an ARN
+                Rules:
+                  - Priority: 10  # optional
+                    Conditions:
+                      - Field: path-pattern
+                        Values: ['/api/*']
+                    Actions:
+                      - Type: forward
+                        TargetGroupArn: arn:aws:elasticloadbalancing:...
+    """
+    client = get_client('elbv2', provider.region)
+
+    if not kwargs.get('Listeners'):
+        LOGGER.warn('Missing required arguement: Listeners')
+        return False
+    prune = kwargs.get('Prune', False)
+
+    listeners = []
+    for listener in kwargs['Listeners']:
+        listener_arn = listener.get('ListenerArn')
+        if not listener_arn:
+            LOGGER.warn('Missing required arguement: ListenerArn')
+            return False
+        if not listener_arn.startswith('arn:'):
+            listener_arn = output_handler(listener_arn, provider=provider,
+                                          context=context)
+        rules = listener.get('Rules') or []
+        for rule in rules:
+            for arg in ('Conditions', 'Actions'):
+                if not rule.get(arg):
+                    LOGGER.warn('Missing required rule arguement: %s', arg)
+                    return False
+        listeners.append((listener_arn, rules))
+
+    try:
+        plans = run_concurrently(
+            lambda arn, rules: (arn, plan_listener(client, arn, rules, prune)),
+            listeners)
+        run_concurrently(
+            lambda arn, changes: delete_rules(client, arn, changes),
+            [(arn, changes) for arn, changes in plans if changes['deletes']])
+        priorities = [{'RuleArn': rule_arn, 'Priority': priority}
+                      for _, changes in plans
+                      for rule_arn, priority in changes['priorities']]
+        if priorities:
+            client.set_rule_priorities(RulePriorities=priorities)
+            LOGGER.info('set the priorities of %s rules', len(priorities))
+        run_concurrently(
+            lambda arn, changes: apply_rules(client, arn, changes),
+            [(arn, changes) for arn, changes in plans
+             if changes['modifies'] or changes['creates']])
+    except Exception as e:
+        LOGGER.info('%s', e)
+        LOGGER.warn('Load balancer listener rules reconciliation failed'
+                    ' (the changes applied are logged above).')
+        return False
+
+    LOGGER.info('Load balancer listener rules reconciliation succeeded.')
+    return True
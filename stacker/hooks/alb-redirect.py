@@ -1,18 +1,23 @@
 """Post build hook to add a HTTP to HTTPS redirect on an AWS ALB."""
 import logging
-import boto3
 
-# from stacker.session_cache import get_session
 from stacker.lookups.handlers.output import handler as output_handler
+from stacker_utils.clients import get_client
+from stacker_utils.listener_rules import (get_listener_rules, rule_key,
+                                          PriorityAllocator)
+from stacker_utils.profiler import profiled
 
 LOGGER = logging.getLogger(__name__)
 
 
+@profiled
 def add_http_redirect(provider, context, **kwargs):
-    """Add HTTP to HTTPS redirect rule to the ALB listener."""
-    # session = get_session(provider.region)
-    # client = session.client('elbv2')
-    client = boto3.client(service_name='elbv2', region_name=provider.region)
+    """Add HTTP to HTTPS redirect rule to the ALB listener.
+
+    Uses the given Priority (if it's free) or else the lowest free one.
+    Does nothing if the listener already has a rule with the condition.
+    """
+    client = get_client('elbv2', provider.region)
 
     if kwargs.get('ListenerArn'):
         listener_arn = output_handler(
@@ -70,14 +75,25 @@ def add_http_redirect(provider, context, **kwargs):
         LOGGER.warn('Missing required argument: StatusCode')
         return False
 
+    conditions = [{
+        'Field': condition_type,
+        'Values': [condition_valu]
+    }]
     try:
+        rules = get_listener_rules(client, listener_arn)
+        if rule_key({'Conditions': conditions}) in set(map(rule_key, rules)):
+            LOGGER.info('Load balancer redirect rule already exists.')
+            return True
+        allocator = PriorityAllocator.from_rules(rules)
+        if kwargs.get('Priority'):
+            priority = int(kwargs.get('Priority'))
+            allocator.reserve(priority)
+        else:
+            priority = allocator.allocate()[0]
         output = client.create_rule(
             ListenerArn=listener_arn,
-            Priority=1,
-            Conditions=[{
-                'Field': condition_type,
-                'Values': [condition_valu]
-            }],
+            Priority=priority,
+            Conditions=conditions,
             Actions=[{
                 'Type': 'redirect',
                 'RedirectConfig': {
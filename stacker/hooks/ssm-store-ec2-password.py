@@ -2,28 +2,117 @@
 import base64
 import os
 import logging
-import boto3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import rsa
 
-# from stacker.session_cache import get_session
 from stacker.lookups.handlers.output import handler as output_handler
+from stacker_utils import profiler
+from stacker_utils.clients import get_client
+from stacker_utils.profiler import profiled
+from stacker_utils.waiter import wait_for, wait_for_all
 
 LOGGER = logging.getLogger(__name__)
 HOME = os.environ['HOME']
 PRIVATE_KEY_FILE = '{}/.ssh/onica-ext-migration.pem'.format(HOME)
+# windows passwords are available several minutes after launch
+# (poll with exponential backoff: 15s, 30s, 60s, 60s, ...)
+POLL_DELAY = 15
+POLL_MAX_DELAY = 60
+TIMEOUT = 1500
+MAX_DECRYPT_WORKERS = 4
+# SSM PutParameter has a low rate limit
+MAX_PUT_WORKERS = 4
 
+PRIVATE_KEYS = {}
+PRIVATE_KEYS_LOCK = threading.Lock()
 
+
+def load_private_key(private_key_file=PRIVATE_KEY_FILE):
+    """Return the (parsed) private key of a key file (only read once)."""
+    with PRIVATE_KEYS_LOCK:
+        if private_key_file not in PRIVATE_KEYS:
+            with open(private_key_file, 'r') as privkeyfile:
+                PRIVATE_KEYS[private_key_file] = rsa.PrivateKey.load_pkcs1(
+                    privkeyfile.read())
+        return PRIVATE_KEYS[private_key_file]
+
+
+def decrypt_password(password_data, privatekey):
+    """Return the decrypted windows password of an instance's password data."""
+    decryptedpw = rsa.decrypt(base64.b64decode(password_data), privatekey)
+    if not isinstance(decryptedpw, str):
+        decryptedpw = decryptedpw.decode('utf-8')
+    return decryptedpw
+
+
+def get_password_data(ec2client, instanceid):
+    """Return an instance's (encrypted) password data ('' if not ready)."""
+    getpwdataoutput = ec2client.get_password_data(InstanceId=instanceid)
+    return getpwdataoutput['PasswordData'].strip()
+
+
+def put_password(ssmclient, ssmparamkey, decryptedpw):
+    """Save a windows password to the SSM parameter store."""
+    return ssmclient.put_parameter(
+        Description='Windows Administrator password',
+        Name=ssmparamkey,
+        Overwrite=True,
+        Type='SecureString',
+        Value=decryptedpw)
+
+
+def resolve_instance_id(value, provider, context):
+    """Return the instance ID of an instance ID or a stack output.
+
+    e.g. i-0123456789abcdef0 or web-tier::WebServer1Id
+    """
+    if value.startswith('i-'):
+        return value
+    return output_handler(value, provider=provider, context=context)
+
+
+def copy_outcome(source, target):
+    """Set the result (or exception) of a done future on another one."""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def chain(future, executor, func):
+    """Return a future of func(result of the future) run in the executor.
+
+    func is only submitted once the future succeeded (the chained future
+    gets its exception otherwise), so it never holds a worker while waiting.
+    """
+    chained = Future()
+
+    def submit(done):
+        """Submit func with the result of the done future."""
+        if done.exception() is not None:
+            chained.set_exception(done.exception())
+            return
+        executor.submit(func, done.result()).add_done_callback(
+            lambda submitted: copy_outcome(submitted, chained))
+
+    future.add_done_callback(submit)
+    return chained
+
+
+@profiled
 def add_win_admin_pw_to_ssm(provider, context, **kwargs):
-    """Add Windows Admin passowrd to SSM parameter store."""
-    ec2client = boto3.client(service_name='ec2', region_name=provider.region)
-    ssmclient = boto3.client(service_name='ssm', region_name=provider.region)
+    """Add Windows Admin passowrd to SSM parameter store.
+
+    Waits (up to Timeout seconds, default 1500) for the password to be
+    available.
+    """
+    ec2client = get_client('ec2', provider.region)
+    ssmclient = get_client('ssm', provider.region)
 
     if kwargs.get('InstanceId'):
-        instanceid = output_handler(
-            kwargs.get('InstanceId'),
-            provider=provider,
-            context=context
-        )
+        instanceid = resolve_instance_id(kwargs.get('InstanceId'), provider,
+                                         context)
     else:
         LOGGER.warn('Missing required arguement: InstanceId')
         return False
@@ -36,24 +125,20 @@ def add_win_admin_pw_to_ssm(provider, context, **kwargs):
 
     LOGGER.info('Attempting to save admin password for {} to SSM {}'.format(instanceid, ssmparamkey))
 
-    getpwdataoutput = ec2client.get_password_data(InstanceId=instanceid)
-    encryptedpw = base64.b64decode(getpwdataoutput['PasswordData'].strip())
+    password_data = wait_for(
+        lambda: get_password_data(ec2client, instanceid),
+        float(kwargs.get('Timeout', TIMEOUT)),
+        delay=POLL_DELAY, max_delay=POLL_MAX_DELAY,
+        name='password of {}'.format(instanceid))
 
-    if encryptedpw:
-        with open(PRIVATE_KEY_FILE, 'r') as privkeyfile:
-            privatekey = rsa.PrivateKey.load_pkcs1(privkeyfile.read())
-        decryptedpw = rsa.decrypt(encryptedpw, privatekey)
+    if password_data:
+        decryptedpw = decrypt_password(password_data, load_private_key())
     else:
         LOGGER.warn('admin password not available.')
         return False
 
     try:
-        putparamresponse = ssmclient.put_parameter(
-            Description='Windows Administrator password',
-            Name=ssmparamkey,
-            Overwrite=True,
-            Type='SecureString',
-            Value=decryptedpw)
+        putparamresponse = put_password(ssmclient, ssmparamkey, decryptedpw)
         LOGGER.debug('%s', putparamresponse)
         LOGGER.info('SSM put parameter succeeded.')
     except Exception as e:
@@ -62,3 +147,93 @@ def add_win_admin_pw_to_ssm(provider, context, **kwargs):
         return False
 
     return True
+
+
+@profiled
+def add_win_admin_pws_to_ssm(provider, context, **kwargs):
+    """Add the Windows Admin passwords of many instances to SSM parameter store.
+
+    Parses the private key once, polls the instances' password data in
+    one waiter loop (until it's ready or Timeout seconds), decrypts the
+    passwords in a worker pool (as soon as each is ready) and saves them
+    (once decrypted) with bounded concurrency. Duplicate InstanceIds are
+    rejected.
+
+    For example:
+
+      post_build:
+        - path: hooks.ssm-store-ec2-password.add_win_admin_pws_to_ssm
+          args:
+            Timeout: 1500  # optional
+            Instances:
+              - InstanceId: web-tier::WebServer1Id  # or an instance ID
+                SsmParamKey: /web/server1/admin-password
+              - InstanceId: web-tier::WebServer2Id
+                SsmParamKey: /web/server2/admin-password
+    """
+    ec2client = get_client('ec2', provider.region)
+    ssmclient = get_client('ssm', provider.region)
+
+    if not kwargs.get('Instances'):
+        LOGGER.warn('Missing required arguement: Instances')
+        return False
+
+    instances = []
+    for instance in kwargs['Instances']:
+        if not instance.get('InstanceId'):
+            LOGGER.warn('Missing required arguement: InstanceId')
+            return False
+        if not instance.get('SsmParamKey'):
+            LOGGER.warn('Missing required arguement: SsmParamKey')
+            return False
+        instanceid = resolve_instance_id(instance['InstanceId'], provider,
+                                         context)
+        if instanceid in [i for i, _ in instances]:
+            LOGGER.warn('Duplicate InstanceId: %s', instanceid)
+            return False
+        instances.append((instanceid, instance['SsmParamKey']))
+
+    privatekey = load_private_key()
+    ssmparamkeys = dict(instances)
+    LOGGER.info('Attempting to save admin passwords of %s instances to SSM',
+                len(instances))
+
+    with ThreadPoolExecutor(max_workers=MAX_DECRYPT_WORKERS) as decrypt_pool, \
+            ThreadPoolExecutor(max_workers=MAX_PUT_WORKERS) as put_pool:
+        saves = {}
+
+        def save_password(instanceid, password_data):
+            """Decrypt and then save the password of an instance (in the
+            pools)."""
+            decryptedpw = decrypt_pool.submit(
+                decrypt_password, password_data, privatekey)
+            saves[instanceid] = chain(decryptedpw, put_pool, profiler.bind(
+                lambda password: put_password(
+                    ssmclient, ssmparamkeys[instanceid], password)))
+
+        wait_for_all(
+            list(ssmparamkeys),
+            lambda instanceid: get_password_data(ec2client, instanceid),
+            float(kwargs.get('Timeout', TIMEOUT)),
+            delay=POLL_DELAY, max_delay=POLL_MAX_DELAY,
+            on_ready=save_password)
+
+        results = []
+        for instanceid in ssmparamkeys:
+            if instanceid not in saves:
+                LOGGER.warn('admin password of %s not available.',
+                            instanceid)
+                results.append(False)
+                continue
+            try:
+                putparamresponse = saves[instanceid].result()
+                LOGGER.debug('%s', putparamresponse)
+            except Exception as e:
+                LOGGER.info('%s', e)
+                LOGGER.warn('SSM put parameter for %s failed.', instanceid)
+                results.append(False)
+                continue
+            LOGGER.info('SSM put parameter for %s succeeded.', instanceid)
+            results.append(True)
+
+    return all(results)
@@ -33,20 +33,156 @@
         4. AWS Lambda uses the "lambda_handler" function as the entry point
            to this script providing "event" which contains the "message"
 
+        Prepared failover plan (fast mode):
+
+        When the PA_FAILOVER_PLAN_PARAMETER environment variable is set to
+        the name of an SSM parameter, an event with "mode": "prepare"
+        (e.g. a CloudWatch Events schedule with that constant input)
+        invokes the lambda to discover the topology, build the failover
+        plan and store it (along with a fingerprint of the topology) in the
+        SSM parameter. On a failure the stored plan is loaded and, if the
+        fingerprint still matches the topology (a describe call of the
+        network interfaces and one of the planned route tables), executed
+        right away.
+        Otherwise the failover falls back to the full discovery.
+
+        Failback and multiple pairs:
+
+        A failover tags the failed instance FailbackPending:true. A
+        failback (an event with "mode": "failback", e.g. on a schedule, or
+        --failback when run directly) finds the recovered instances, checks
+        they are healthy (state, status checks and network interfaces) and,
+        if $PA_FAILOVER_MAINTENANCE_WINDOW is set (UTC, weekly:
+        "sun:02:00-sun:04:00" or daily: "02:00-04:00"), that it is within
+        the window. It then moves the traffic back using the same planner
+        and clears the tag.
+
+        The Role:Firewall instances are grouped into pairs by their
+        $PA_FAILOVER_PAIR_TAG tag (default: FirewallPair), or else by
+        their VPC. All the pairs are discovered with a single call, the
+        standby of a failed instance is looked up within its pair and the
+        pairs are probed and failed back concurrently.
+
+        Probe mode (proactive failover):
+
+        Instead of waiting for the CloudWatch alarm periods, a long running
+        invocation (a scheduled event with "mode": "probe", or --probe when
+        run directly) probes the Palo Alto pair every
+        $PA_FAILOVER_PROBE_INTERVAL seconds (default: 10): the state and
+        status checks of both instances and the attachment state of their
+        network interfaces (two calls per probe). Once the primary fails
+        $PA_FAILOVER_PROBE_THRESHOLD consecutive probes (default: 3) while
+        the standby is healthy, the failover is performed right away. A
+        Lambda invocation probes until $PA_FAILOVER_PROBE_RESERVE seconds
+        (default: 60) before its timeout, kept to perform the failover, so
+        the function timeout must be longer than the reserve plus 2 seconds
+        (e.g. 900 seconds, the maximum, to probe for about 14 minutes). A
+        shorter timeout is logged as an error and only probes once.
+
+        Failover journal (resumable failover):
+
+        When the PA_FAILOVER_JOURNAL_TABLE environment variable is set to
+        the name of a DynamoDB table (partition key "failover_id" of type
+        string), the plan of the failover and every step completed are
+        journaled in it. If the lambda times out or fails part way, the
+        retry resumes the journaled plan from the first incomplete step
+        (even if the Primary tags were already swapped) instead of
+        discovering a half swapped state. Incomplete failovers older than
+        $PA_FAILOVER_JOURNAL_MAX_AGE seconds (default: 3600) are not
+        resumed. Set PA_FAILOVER_DYNAMODB_ENDPOINT to use DynamoDB Local.
+        Without a journal a retry still skips the EIPs, routes and tags
+        that are already moved.
+
+        Duplicate events:
+
+        CloudWatch and SNS may deliver several notifications of the same
+        failure. When the PA_FAILOVER_LOCK_TABLE environment variable is
+        set to the name of a DynamoDB table (partition key "lock_id" of
+        type string), a lock of the failed instance is acquired with a
+        single conditional write before anything else and any other event
+        of the same instance within $PA_FAILOVER_LOCK_WINDOW seconds
+        (default: 300) is short-circuited. Retries of the same Lambda
+        request and failovers that did not complete are not locked out.
+        PA_FAILOVER_LOCK_DIR (a local directory) can be used instead for
+        testing.
+
+        Retries:
+
+        Throttled (e.g. RequestLimitExceeded) and transient (e.g.
+        InternalError, connection timeouts) AWS API errors are retried
+        with decorrelated jitter backoff until the deadline: the remaining
+        time of the Lambda invocation less a margin (or the --timeout when
+        run directly). Any other error is fatal and reported right away.
+
+        Metrics:
+
+        The duration of the invocation (cold/warm start), of each phase
+        (discover, plan, confirm_enis, move_eips, replace_routes, swap_tags,
+        verify), the time to convergence of each EIP, route and failover
+        and of each AWS API call (and its number of attempts) are emitted as
+        CloudWatch Embedded Metric Format log lines (namespace: $PA_FAILOVER_METRIC_NAMESPACE or
+        PaFailover), i.e. without any extra API calls. When run directly
+        with -v the same timings are printed as a flame-style summary.
+
         Directly:
         --------
 
-        pa_failover.py [-h] -f FAILED_PA_INSTANCE_ID [-v] [-d] [--dry-run]
+        pa_failover.py [-h] [-f FAILED_PA_INSTANCE_ID] [-p PLAN_PARAMETER]
+                       [--prepare] [--failback]
+                       [--maintenance-window MAINTENANCE_WINDOW]
+                       [--probe] [--probe-interval INTERVAL]
+                       [--probe-threshold THRESHOLD]
+                       [--probe-duration DURATION] [-j JOURNAL_TABLE]
+                       [--lock-table LOCK_TABLE] [--lock-dir LOCK_DIR]
+                       [-t TIMEOUT] [-v] [-d] [--dry-run]
 
         fail over Palo Alto instance from primary to standby
 
-        required arguments:
+        arguments:
           -f FAILED_PA_INSTANCE_ID,
           --failed-pa-instance-id FAILED_PA_INSTANCE_ID
                               EC2 Instance ID of failed Palo Alto server
+                              (required unless preparing, failing back or
+                              probing)
 
         optional arguments:
           -h, --help          show this help message and exit
+          -p PLAN_PARAMETER, --plan-parameter PLAN_PARAMETER
+                              SSM parameter to store/load the prepared
+                              failover plan
+                              (default: $PA_FAILOVER_PLAN_PARAMETER)
+          --prepare           prepare the failover plan and store it in the
+                              SSM parameter
+          --failback          fail back to the recovered (FailbackPending)
+                              instances
+          --maintenance-window MAINTENANCE_WINDOW
+                              UTC window to fail back in:
+                              ddd:hh:mm-ddd:hh:mm or hh:mm-hh:mm
+                              (default: $PA_FAILOVER_MAINTENANCE_WINDOW)
+          --probe             probe the health of the Palo Alto pair and
+                              fail over when the primary fails
+          --probe-interval INTERVAL
+                              seconds between probes
+                              (default: $PA_FAILOVER_PROBE_INTERVAL or 10)
+          --probe-threshold THRESHOLD
+                              consecutive failed probes triggering a
+                              failover
+                              (default: $PA_FAILOVER_PROBE_THRESHOLD or 3)
+          --probe-duration DURATION
+                              seconds to probe for (default: forever)
+          -j JOURNAL_TABLE, --journal-table JOURNAL_TABLE
+                              DynamoDB table to journal the failover
+                              progress in
+                              (default: $PA_FAILOVER_JOURNAL_TABLE)
+          --lock-table LOCK_TABLE
+                              DynamoDB table to lock the failover in
+                              (default: $PA_FAILOVER_LOCK_TABLE)
+          --lock-dir LOCK_DIR local directory to lock the failover in
+                              (for testing)
+                              (default: $PA_FAILOVER_LOCK_DIR)
+          -t TIMEOUT, --timeout TIMEOUT
+                              seconds to keep retrying throttled or failed
+                              AWS API calls (default: 60)
           -v, --verbose       turn on verbose output
           -d, --debug         turn on debug output
           --dry-run           do not execute the commands - perform a dry-run
@@ -59,23 +195,53 @@
         In particular, the following services and actions are needed:
 
             ec2:AssociateAddress
+            ec2:DescribeAddresses
             ec2:CreateTags
             ec2:DescribeInstances
+            ec2:DescribeInstanceStatus (probe and failback modes only)
             ec2:DescribeNetworkInterfaces
             ec2:DescribeRouteTables
             ec2:ReplaceRoute
+            ssm:GetParameter (prepared failover plan only)
+            ssm:PutParameter (prepared failover plan only)
+            dynamodb:GetItem (failover journal only)
+            dynamodb:PutItem (failover journal only)
+            dynamodb:UpdateItem (failover journal only)
+            dynamodb:PutItem (failover lock only)
+            dynamodb:DeleteItem (failover lock only)
 
     Overview (Steps performed by script):
-        1. Get the failed instance description via instance id (provided by
-           the "event" (Lambda) or by the argument given (directly)
+        1. Get the failed and the standby instance descriptions in a single
+           call (tag Role: Firewall) using the failed instance id (provided
+           by the "event" (Lambda) or by the argument given (directly)
         2. Determine if failed instance is the primary PA (Primary tag = true)
-        3. If the failed instance is the primary, get the standby instance
-           description via tags (Role: Firewall, Primary: false)
-        4. Acquire the EIP allocation IDs attached to the primary network
-           interfaces
-        5. Connect the EIPs to the network interfaces of the standby instance
-        6. Update the Primary tags for both instances (true <-> false)
-        7. Update the route tables to use the network interfaces of the standby
+        3. If the failed instance is the primary, plan the failover:
+           a. get the network interfaces of both instances in a single call
+              and acquire the EIP allocation IDs attached to the primary
+              network interfaces
+           b. get all the route tables of the VPC (a single call per page
+              of route tables) and find every route (of any destination,
+              e.g. those of the DMZ and Internal subnets) targeting the
+              network interfaces of the primary
+           c. build the failover plan: the EIP moves, the Primary tag swaps
+              and the route replacements (skipping those already done)
+        4. Execute the plan (independent steps run concurrently):
+           a. connect the EIPs to the network interfaces of the standby
+           b. confirm the network interfaces of the standby are attached
+              and then update the route tables to use them
+           c. once all the EIPs and routes are moved, update the Primary
+              tags for both instances (true <-> false)
+           d. gather the results of every step into a single report
+        5. Verify the changes converged: poll the EIPs and the route tables
+           (concurrently, at exponential intervals, for up to
+           $PA_FAILOVER_VERIFY_TIMEOUT seconds (default: 30)) until every
+           EIP is associated with and every route targets the standby, and
+           report the time to convergence (a route still targeting the
+           failed network interface is reported as a failure)
+
+        The number of AWS API calls made before the first change does not
+        depend on the number of network interfaces or subnets (only on the
+        number of pages of route tables in the VPC).
 
     Example of an event (dict) passed to the lambda handler:
         (note: "Message" is in JSON format)
@@ -139,14 +305,172 @@
 
 from __future__ import print_function
 import argparse
+import hashlib
 import json
+import os
+import random
 import sys
+import threading
+import time
+import uuid
+import contextlib
+import concurrent.futures
+# time this module was imported (Lambda container initialization), taken
+# before the (heavy) boto3/botocore imports so that they are accounted for
+IMPORT_TIME = time.time()
 import boto3
+import botocore.config
 import botocore.exceptions
 
+# network interfaces of the DMZ and Internal subnets (routed via the primary)
+ROUTED_NETWORK_INTERFACES = ('eth2', 'eth3')
+# route destination keys (of 'describe_route_tables' and 'replace_route')
+ROUTE_DESTINATION_KEYS = (
+    'DestinationCidrBlock', 'DestinationIpv6CidrBlock',
+    'DestinationPrefixListId')
+# maximum number of concurrent AWS API calls when executing a failover plan
+MAX_WORKERS = 8
+# SSM parameter to store the prepared failover plan in (fast mode if set)
+PLAN_PARAMETER = os.environ.get('PA_FAILOVER_PLAN_PARAMETER')
+# DynamoDB table to journal the progress of the failovers in (resumable if
+# set) and how long (seconds) an incomplete failover can still be resumed
+JOURNAL_TABLE = os.environ.get('PA_FAILOVER_JOURNAL_TABLE')
+JOURNAL_MAX_AGE = int(os.environ.get('PA_FAILOVER_JOURNAL_MAX_AGE', 3600))
+# DynamoDB table (or local directory, e.g. for testing) to lock the
+# failover of an instance in so that duplicate events (e.g. ALARM
+# re-notifications) within the window (seconds) do not fail it over again
+LOCK_TABLE = os.environ.get('PA_FAILOVER_LOCK_TABLE')
+LOCK_DIR = os.environ.get('PA_FAILOVER_LOCK_DIR')
+LOCK_WINDOW = int(os.environ.get('PA_FAILOVER_LOCK_WINDOW', 300))
+# probe mode: seconds between health probes of the Palo Alto pair, number
+# of consecutive failed probes of the primary triggering a failover and
+# seconds of a Lambda invocation kept in reserve to perform the failover
+PROBE_INTERVAL = float(os.environ.get('PA_FAILOVER_PROBE_INTERVAL', 10))
+PROBE_THRESHOLD = int(os.environ.get('PA_FAILOVER_PROBE_THRESHOLD', 3))
+PROBE_RESERVE = float(os.environ.get('PA_FAILOVER_PROBE_RESERVE', 60))
+# tag grouping the Palo Alto instances into pairs (default: their VPC ID),
+# tag marking a failed instance to fail back to once it has recovered and
+# weekly ('ddd:hh:mm-ddd:hh:mm') or daily ('hh:mm-hh:mm') maintenance window
+# (UTC) to fail back in (any time if not set)
+PAIR_TAG = os.environ.get('PA_FAILOVER_PAIR_TAG', 'FirewallPair')
+FAILBACK_TAG = 'FailbackPending'
+MAINTENANCE_WINDOW = os.environ.get('PA_FAILOVER_MAINTENANCE_WINDOW')
+# states of the instances that are going (or gone) away: still described
+# (so that a departed primary is failed over) but never a standby
+DEPARTED_STATES = ('shutting-down', 'terminated')
+# seconds to wait for the EIP associations and the routes to converge
+# after a failover and seconds between the first polls (doubling, capped)
+VERIFY_TIMEOUT = float(os.environ.get('PA_FAILOVER_VERIFY_TIMEOUT', 30))
+VERIFY_INTERVAL = 0.1
+VERIFY_MAX_INTERVAL = 2.0
+# CloudWatch namespace of the metrics emitted (Embedded Metric Format)
+METRIC_NAMESPACE = os.environ.get('PA_FAILOVER_METRIC_NAMESPACE', 'PaFailover')
+# AWS API error codes of throttled or transient (retryable) errors
+RETRYABLE_ERROR_CODES = (
+    'InternalError',
+    'InternalFailure',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'ServiceUnavailable',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'Unavailable')
+# connection errors worth retrying (hung or unreachable endpoint)
+RETRYABLE_EXCEPTIONS = (
+    botocore.exceptions.ConnectionClosedError,
+    botocore.exceptions.ConnectTimeoutError,
+    botocore.exceptions.EndpointConnectionError,
+    botocore.exceptions.ReadTimeoutError)
+# base and maximum delay (seconds) between attempts of an AWS API call
+# (decorrelated jitter) and maximum attempts when there is no deadline
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 2.0
+RETRY_MAX_ATTEMPTS = 10
+# time (seconds) kept in reserve before the Lambda timeout (to report)
+DEADLINE_MARGIN = 2.0
+# time by which the AWS API calls must stop retrying (see 'set_deadline')
+deadline = None
+# configuration of the AWS service clients: fail fast on a hung endpoint,
+# back off (client side rate limiting) when throttled and keep enough
+# connections alive for all the concurrent workers. The retries are made
+# by 'aws_call' (within the deadline) instead of by botocore: a single
+# attempt in total ('max_attempts': 1 would still allow one retry).
+BOTO_CONFIG = botocore.config.Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={'mode': 'adaptive', 'total_max_attempts': 1},
+    max_pool_connections=MAX_WORKERS * 2,
+    tcp_keepalive=True)
+# AWS service endpoints to use instead of the default ones (e.g. DynamoDB
+# Local to test the failover journal)
+BOTO_ENDPOINT_URLS = {
+    'dynamodb': os.environ.get('PA_FAILOVER_DYNAMODB_ENDPOINT')}
+# AWS service clients (created once and reused by warm Lambda invocations)
+BOTO_SERVICE_CLIENTS = {}
+# whether the next Lambda invocation is the first one of this container
+cold_start = True
+# timing spans of the current invocation (see 'timed_span')
+SPANS = []
+SPANS_LOCK = threading.Lock()
+SPAN_CONTEXT = threading.local()
+# metrics recorded by the current invocation (see 'record_metrics')
+METRICS = []
+
+
+def print_info(*args):
+    """Print verbose output (as a single write so that the output of
+       concurrent steps does not interleave)."""
+    print(' '.join(str(a) for a in ('info:',) + args) + '\n', end='')
+
+
+def print_debug(*args):
+    """Print debug output (as a single write, see 'print_info')."""
+    print(' '.join(str(a) for a in ('debug:',) + args) + '\n', end='')
+
+
+def print_nothing(*args):
+    """Do nothing function (verbose/debug output turned off)."""
+
+
+verbose_print = print_info
+debug_print = print_debug
+
 
 def lambda_handler(event, context):
-    """Handler used by AWS Lambda as an entry point to run this script."""
+    """Handler used by AWS Lambda as an entry point to run this script.
+       Emits the duration of the invocation (and of the container
+       initialization on a cold start) as metrics."""
+    global cold_start
+    start_type = 'cold' if cold_start else 'warm'
+    cold_start = False
+    start_time = time.time()
+    # forget the metrics and spans of the previous (warm) invocation
+    del METRICS[:]
+    reset_spans()
+    # stop retrying AWS API calls in time to report before timing out
+    set_deadline(
+        context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN)
+    try:
+        return handle_event(event, context)
+    finally:
+        metrics = [(
+            'InvocationDuration', (time.time() - start_time) * 1000,
+            'Milliseconds')]
+        if start_type == 'cold':
+            metrics.append((
+                'InitDuration', (INIT_TIME - IMPORT_TIME) * 1000,
+                'Milliseconds'))
+        emit_metrics(metrics, {'StartType': start_type})
+        emit_span_metrics()
+        emit_recorded_metrics()
+
+
+def handle_event(event, context):
+    """Handle the event passed to the lambda (see 'lambda_handler')."""
     print('debug: Script name:', __name__)
     print('debug: Event:', event)
     print('debug: Function name:', context.function_name)
@@ -156,6 +480,48 @@ def lambda_handler(event, context):
     print('debug: Log group name:', context.log_group_name)
     print('debug: AWS Request ID:', context.aws_request_id)
     print('debug: Memory limits(MB):', context.memory_limit_in_mb)
+    # the mode must be given explicitly (e.g. as the constant input of a
+    # CloudWatch Events schedule), any other event is an SNS alarm
+    mode = event.get('mode')
+    # (scheduled) invocations preparing the failover plan
+    if mode == 'prepare':
+        if PLAN_PARAMETER:
+            result = prepare(PLAN_PARAMETER)
+        else:
+            result = (
+                'failed: cannot prepare failover plan:'
+                ' PA_FAILOVER_PLAN_PARAMETER is not set')
+        print('debug: Time remaining (MS):',
+              context.get_remaining_time_in_millis())
+        print(result)
+        return result
+    # fail back to the recovered instances (e.g. on a schedule)
+    if mode == 'failback':
+        result = failback()
+        print('debug: Time remaining (MS):',
+              context.get_remaining_time_in_millis())
+        print(result)
+        return result
+    # long running (scheduled) invocations probe the Palo Alto pairs
+    if mode == 'probe':
+        duration = (
+            context.get_remaining_time_in_millis() / 1000.0 -
+            DEADLINE_MARGIN - PROBE_RESERVE)
+        if duration <= 0:
+            print(
+                'error: the function timeout is too short to probe (it'
+                ' must be longer than {0:g} seconds): probing once'.format(
+                    DEADLINE_MARGIN + PROBE_RESERVE))
+            duration = 0
+        result = probe(
+            duration=duration,
+            plan_parameter=PLAN_PARAMETER, journal_table=JOURNAL_TABLE,
+            lock_table=LOCK_TABLE, lock_dir=LOCK_DIR,
+            lock_owner=context.aws_request_id)
+        print('debug: Time remaining (MS):',
+              context.get_remaining_time_in_millis())
+        print(result)
+        return result
     # get the SNS json message from event
     action = 'get SNS message from event'
     try:
@@ -180,6 +546,7 @@ def lambda_handler(event, context):
         print('debug: able to {action}'.format(**locals()))
     # get the state of the AWS CloudWatch alarm
     new_state = message.get('NewStateValue')
+    failed_inst_id = None
     # only process ALARMs
     action = 'get instance ID from SNS message'
     if new_state == 'ALARM':
@@ -196,7 +563,11 @@ def lambda_handler(event, context):
         else:
             print('debug: able to {action}'.format(**locals()))
     if failed_inst_id:
-        result = main(failed_inst_id)
+        # use the prepared failover plan (fast mode) if there is one
+        result = main(
+            failed_inst_id, plan_parameter=PLAN_PARAMETER,
+            journal_table=JOURNAL_TABLE, lock_table=LOCK_TABLE,
+            lock_dir=LOCK_DIR, lock_owner=context.aws_request_id)
     else:
         result = 'failed: cannot get failed instance ID from event details'
     print('debug: Time remaining (MS):', context.get_remaining_time_in_millis())
@@ -302,7 +673,9 @@ def create_boto_service_client(service):
     action = 'create boto service client ({service})'.format(**locals())
     verbose_print('attempting to {action}...'.format(**locals()))
     try:
-        client = boto3.client(service_name=service)
+        client = boto3.client(
+            service_name=service, config=BOTO_CONFIG,
+            endpoint_url=BOTO_ENDPOINT_URLS.get(service))
     except botocore.exceptions.NoRegionError as e:
         debug_print(
             'exception (NoRegionError):'
@@ -317,45 +690,307 @@ def create_boto_service_client(service):
     return client
 
 
-def get_eip_allocation_ids(net_int_id):
-    """Return any EIP allocation IDs attached to an ENI (as a list)."""
+def get_boto_service_client(service):
+    """Get AWS service connection - returns the client created at import
+       time (reused by warm Lambda invocations) or creates it."""
+    client = BOTO_SERVICE_CLIENTS.get(service)
+    if client is None:
+        client = create_boto_service_client(service)
+        BOTO_SERVICE_CLIENTS[service] = client
+    else:
+        debug_print('reusing boto service client ({service})'.format(
+            **locals()))
+    return client
+
+
+def emit_metrics(metrics, dimensions=None):
+    """Emit metrics in CloudWatch Embedded Metric Format (EMF), i.e. print
+       them as a JSON log line (no API call). The metrics are a list of
+       (name, value, unit) tuples - the value may be a list of values."""
+    dimensions = dimensions or {}
+    emf_record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRIC_NAMESPACE,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [
+                    {'Name': name, 'Unit': unit}
+                    for name, _, unit in metrics]}]}}
+    emf_record.update(dimensions)
+    for name, value, _ in metrics:
+        emf_record[name] = value
+    print(json.dumps(emf_record, sort_keys=True))
+
+
+def record_metrics(metrics, dimensions=None):
+    """Record metrics (see 'emit_metrics') to be emitted at the end of the
+       Lambda invocation (see 'emit_recorded_metrics')."""
+    METRICS.append((metrics, dimensions))
+
+
+def emit_recorded_metrics():
+    """Emit (and forget) the metrics recorded by the current invocation."""
+    while METRICS:
+        emit_metrics(*METRICS.pop(0))
+
+
+def reset_spans():
+    """Forget all the timing spans (e.g. of a previous invocation)."""
+    with SPANS_LOCK:
+        del SPANS[:]
+
+
+def start_span(name, kind, parent=None):
+    """Start a timing span (dict: id, name, kind, parent, start, end) as a
+       child of the given span ID (default: the current span of the
+       thread). Kinds are: phase, step or api (AWS API call)."""
+    if parent is None:
+        parent = current_span_id()
+    span = {
+        'name': name, 'kind': kind, 'parent': parent,
+        'start': time.time(), 'end': None}
+    with SPANS_LOCK:
+        span['id'] = len(SPANS)
+        SPANS.append(span)
+    return span
+
+
+def current_span_id():
+    """Return the ID of the current span of the thread (or None)."""
+    stack = getattr(SPAN_CONTEXT, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def timed_span(name, kind='phase', parent=None):
+    """Time a block of code as a span (see 'start_span'). Spans started
+       within the block (in the same thread) are its children."""
+    span = start_span(name, kind, parent)
+    if not hasattr(SPAN_CONTEXT, 'stack'):
+        SPAN_CONTEXT.stack = []
+    SPAN_CONTEXT.stack.append(span['id'])
+    try:
+        yield span
+    finally:
+        SPAN_CONTEXT.stack.pop()
+        span['end'] = time.time()
+
+
+def span_duration(span):
+    """Return the duration of a span in milliseconds."""
+    return ((span['end'] or time.time()) - span['start']) * 1000
+
+
+def set_deadline(seconds):
+    """Set the deadline of the AWS API call retries to the given number of
+       seconds from now (None: no deadline, see RETRY_MAX_ATTEMPTS)."""
+    global deadline
+    deadline = None if seconds is None else time.time() + seconds
+
+
+def is_retryable(exception):
+    """Return whether an AWS API call exception is worth retrying
+       (throttling or a transient error) or fatal."""
+    if isinstance(exception, botocore.exceptions.ClientError):
+        error_code = exception.response.get('Error', {}).get('Code')
+        return error_code in RETRYABLE_ERROR_CODES
+    return isinstance(exception, RETRYABLE_EXCEPTIONS)
+
+
+def aws_call(aws_svc_action, func, **kwargs):
+    """Call an AWS API (client method) timed as a span. Throttled and
+       transient errors (see 'is_retryable') are retried with decorrelated
+       jitter backoff as long as the next attempt starts before the
+       deadline (see 'set_deadline'). The number of attempts is recorded in
+       the span. Fatal errors (or the last retryable one) are raised."""
+    with timed_span(aws_svc_action, kind='api') as span:
+        delay = RETRY_BASE_DELAY
+        attempt = 0
+        while True:
+            attempt += 1
+            span['attempts'] = attempt
+            try:
+                return func(**kwargs)
+            except (botocore.exceptions.ClientError,
+                    botocore.exceptions.BotoCoreError) as e:
+                if not is_retryable(e):
+                    raise
+                delay = min(
+                    RETRY_MAX_DELAY,
+                    random.uniform(RETRY_BASE_DELAY, delay * 3))
+                if deadline is None:
+                    if attempt >= RETRY_MAX_ATTEMPTS:
+                        raise
+                elif time.time() + delay > deadline:
+                    raise
+                debug_print(
+                    'retrying {aws_svc_action} in {0:.0f} ms'
+                    ' (attempt {attempt} failed: {e})'.format(
+                        delay * 1000, **locals()))
+                time.sleep(delay)
+
+
+def emit_span_metrics():
+    """Emit the durations of the phases and AWS API calls of the current
+       invocation as metrics (one EMF record per phase/API call, each with
+       all of its durations) to build per-phase latency histograms."""
+    phase_durations = {}
+    api_durations = {}
+    api_attempts = {}
+    for span in SPANS:
+        if span['kind'] == 'phase':
+            phase_durations.setdefault(
+                span['name'], []).append(span_duration(span))
+        elif span['kind'] == 'api':
+            api_durations.setdefault(
+                span['name'], []).append(span_duration(span))
+            api_attempts.setdefault(
+                span['name'], []).append(span.get('attempts', 1))
+    for phase, durations in sorted(phase_durations.items()):
+        emit_metrics(
+            [('PhaseDuration', durations, 'Milliseconds')], {'Phase': phase})
+    for operation, durations in sorted(api_durations.items()):
+        emit_metrics(
+            [('ApiCallDuration', durations, 'Milliseconds'),
+             ('ApiCallAttempts', api_attempts[operation], 'Count')],
+            {'Operation': operation})
+
+
+def print_span_summary(width=40):
+    """Print the spans of the current invocation as a flame-style summary:
+       a tree of spans with their durations and a bar showing when each
+       span ran relative to the whole invocation."""
+    spans = [span for span in SPANS if span['start'] is not None]
+    if not spans:
+        return
+    begin = min(span['start'] for span in spans)
+    end = max(span['end'] or time.time() for span in spans)
+    total = max(end - begin, 1e-9)
+    children = {}
+    for span in sorted(spans, key=lambda sp: (sp['start'], sp['id'])):
+        children.setdefault(span['parent'], []).append(span)
+    print('span summary (total {0:.1f} ms):'.format(total * 1000))
+
+    def print_spans(parent, depth):
+        """Print the child spans of a span (depth first)."""
+        for span in children.get(parent, []):
+            offset = int((span['start'] - begin) / total * width)
+            length = max(1, int(
+                ((span['end'] or end) - span['start']) / total * width))
+            bar = ' ' * offset + '#' * min(length, width - offset)
+            name = '  ' * depth + span['name']
+            if span.get('attempts', 1) > 1:
+                name += ' (x{0})'.format(span['attempts'])
+            print('{0:<50} {1:>9.1f} ms |{2:<{3}}|'.format(
+                name, span_duration(span), bar, width))
+            print_spans(span['id'], depth + 1)
+
+    print_spans(None, 0)
+
+
+def get_network_interfaces(net_int_ids):
+    """Return the descriptions of a list of ENIs (as a dict keyed by ENI ID)
+       using a single 'describe_network_interfaces' call."""
     action = (
-        'get any EIP allocation ID(s) of'
-        ' network interface ({net_int_id})'.format(**locals()))
+        'get network interface descriptions'
+        ' of network interfaces ({net_int_ids})'.format(**locals()))
     verbose_print('attempting to {action}...'.format(**locals()))
     try:
         describe_network_interfaces_output = (
-            ec2_client.describe_network_interfaces(
-                NetworkInterfaceIds=[net_int_id]))
+            aws_call(
+                'ec2:DescribeNetworkInterfaces',
+                ec2_client.describe_network_interfaces,
+                NetworkInterfaceIds=net_int_ids))
     except botocore.exceptions.NoCredentialsError as e:
         boto_no_credentials_error_exception_handler(action, e)
     except botocore.exceptions.ClientError as e:
         boto_client_error_exception_handler(
             action, e, 'ec2:DescribeNetworkInterfaces',
-            NetworkInterfaceId=net_int_id)
+            NetworkInterfaceId=net_int_ids)
     except Exception as e:
         catch_all_exception_handler(action, e)
     else:
         verbose_print('able to {action}'.format(**locals()))
         debug_print('ec2.describe_network_interfaces output:',
                     describe_network_interfaces_output)
-    eip_alloc_ids = []
-    network_interfaces = (
-        describe_network_interfaces_output.get('NetworkInterfaces'))
-    if network_interfaces:
-        private_ips = network_interfaces[0].get('PrivateIpAddresses')
-        if private_ips:
-            for pip in private_ips:
-                if 'Association' in pip:
-                    if 'AllocationId' in pip['Association']:
-                        eip_alloc_ids.append(
-                            pip['Association']['AllocationId'])
+    network_interfaces = dict(
+        (ni['NetworkInterfaceId'], ni) for ni in
+        describe_network_interfaces_output.get('NetworkInterfaces', []))
+    missing_net_int_ids = [
+        ei for ei in net_int_ids if ei not in network_interfaces]
+    if missing_net_int_ids:
+        debug_print(
+            'network interfaces not found:'
+            ' {missing_net_int_ids}'.format(**locals()))
+        sys.exit('exit: not able to {action}'.format(**locals()))
+    return network_interfaces
+
+
+def get_route_tables(route_table_ids):
+    """Return the descriptions of a list of route tables (as a dict keyed
+       by route table ID) using a single 'describe_route_tables' call (none
+       if the list is empty)."""
+    if not route_table_ids:
+        return {}
+    action = (
+        'get route table descriptions'
+        ' of route tables ({route_table_ids})'.format(**locals()))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    try:
+        describe_route_tables_output = aws_call(
+            'ec2:DescribeRouteTables', ec2_client.describe_route_tables,
+            RouteTableIds=route_table_ids)
+    except botocore.exceptions.NoCredentialsError as e:
+        boto_no_credentials_error_exception_handler(action, e)
+    except botocore.exceptions.ClientError as e:
+        boto_client_error_exception_handler(
+            action, e, 'ec2:DescribeRouteTables')
+    except Exception as e:
+        catch_all_exception_handler(action, e)
     else:
-        debug_print('no network interfaces found')
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print('ec2.describe_route_tables output:',
+                    describe_route_tables_output)
+    route_tables = dict(
+        (rt['RouteTableId'], rt) for rt in
+        describe_route_tables_output.get('RouteTables', []))
+    missing_route_table_ids = [
+        rt for rt in route_table_ids if rt not in route_tables]
+    if missing_route_table_ids:
+        debug_print(
+            'route tables not found:'
+            ' {missing_route_table_ids}'.format(**locals()))
         sys.exit('exit: not able to {action}'.format(**locals()))
+    return route_tables
+
+
+def get_eip_allocation_ids(network_interface):
+    """Return any EIP allocation IDs attached to an ENI (as a list)
+       using the ENI description (see 'get_network_interfaces')."""
+    eip_alloc_ids = []
+    private_ips = network_interface.get('PrivateIpAddresses')
+    if private_ips:
+        for pip in private_ips:
+            if 'Association' in pip:
+                if 'AllocationId' in pip['Association']:
+                    eip_alloc_ids.append(
+                        pip['Association']['AllocationId'])
     return eip_alloc_ids
 
 
+def get_eip_associations(network_interface):
+    """Return the EIP allocation IDs attached to an ENI keyed by the
+       private IP they are associated with (as a dict) using the ENI
+       description (see 'get_network_interfaces')."""
+    eip_associations = {}
+    for pip in network_interface.get('PrivateIpAddresses') or []:
+        if 'AllocationId' in pip.get('Association', {}):
+            eip_associations[pip['PrivateIpAddress']] = (
+                pip['Association']['AllocationId'])
+    return eip_associations
+
+
 def attach_eip(eip_alloc_id, net_int_id, priv_ip, dry_run):
     """Attach an EIP to a specific private IP on an network interface."""
     action = (
@@ -365,7 +1000,8 @@ def attach_eip(eip_alloc_id, net_int_id, priv_ip, dry_run):
     verbose_print('attempting to {action}...'.format(**locals()))
     try:
         associate_address_output = (
-            ec2_client.associate_address(
+            aws_call(
+                'ec2:AssociateAddress', ec2_client.associate_address,
                 AllocationId=eip_alloc_id,
                 DryRun=dry_run,
                 NetworkInterfaceId=net_int_id,
@@ -387,39 +1023,9 @@ def attach_eip(eip_alloc_id, net_int_id, priv_ip, dry_run):
             ' {associate_address_output}'.format(**locals()))
 
 
-def move_eips(from_inst, to_inst, dry_run):
-    """Moves EIPs from one instance to another."""
-    from_inst_id = from_inst.id
-    to_inst_id = to_inst.id
-    action = (
-        'move EIPs from instance ({from_inst_id})'
-        ' to instance ({to_inst_id})'.format(**locals()))
-    verbose_print('attempting to {action}...'.format(**locals()))
-    for ni in from_inst.network_interfaces:
-        if ni != 'eth0':
-            eip_allocation_ids = get_eip_allocation_ids(
-                from_inst.network_interfaces[ni]['eni_id'])
-            if eip_allocation_ids:
-                to_inst_eni = to_inst.network_interfaces[ni]['eni_id']
-                to_inst_pips = to_inst.network_interfaces[ni]['priv_ips']
-                if len(eip_allocation_ids) == len(to_inst_pips):
-                    eain = 0
-                    for eip_alloc_id in eip_allocation_ids:
-                        to_inst_pip = to_inst_pips[eain]
-                        attach_eip(eip_alloc_id, to_inst_eni, to_inst_pip, dry_run)
-                        eain += 1
-                else:
-                    verbose_print('not able to {action}'.format(**locals()))
-                    debug_print(
-                        'destination instance ({to_inst_id}) does not have'
-                        ' matching number of private IPs on'
-                        ' network interface ({to_inst_eni}):'.format(**locals()))
-                    sys.exit('exit: not able to {action}'.format(**locals()))
-
-
 class Ec2Instance(object):
     """Instantiate EC2 Instance objects of an existing EC2 instance
-       by either an instance ID or specific tag values. Sets up the following
+       by either an instance ID or its failover pair. Sets up the following
        attributes:
 
            id(string): the instance ID (string)
@@ -429,7 +1035,8 @@ class Ec2Instance(object):
            is_primary(bool): whether or not the instance is the primary
 
            from_instance_id(inst_id): instantiate object via instance ID
-           from_tags(): instantiate object via tags (Role and Primary)
+           from_failover_pair(inst_id): instantiate the failed and the
+               standby objects via a single call (Role tag)
            update_tag(tag, val): update the value of tag to val."""
 
     def __init__(self, description):
@@ -445,6 +1052,8 @@ class Ec2Instance(object):
             tag_values = [
                 t['Value'] for t in self.tags
                 if t['Key'] == tag]
+            # a missing tag means not the primary
+            primary_tag_val = None
             if len(tag_values) == 1:
                 primary_tag_val = tag_values[0]
                 verbose_print('found primary tag value for instance')
@@ -519,7 +1128,9 @@ class Ec2Instance(object):
         verbose_print('attempting to {action}...'.format(**locals()))
         try:
             describe_instances_output = (
-                ec2_client.describe_instances(InstanceIds=[instance_id]))
+                aws_call(
+                    'ec2:DescribeInstances', ec2_client.describe_instances,
+                    InstanceIds=[instance_id]))
         except botocore.exceptions.NoCredentialsError as e:
             boto_no_credentials_error_exception_handler(action, e)
         except botocore.exceptions.ClientError as e:
@@ -550,148 +1161,356 @@ class Ec2Instance(object):
         sys.exit('exit: not able to {action}'.format(**locals()))
 
     @classmethod
-    def from_tags(cls):
-        """Get EC2 Instance description using
-           Tags (Role:Firewall) and (Primary:false)."""
+    def from_failover_pair(cls, failed_instance_id, descriptions=None):
+        """Get the failed and the standby EC2 instance descriptions with a
+           single call using Tags (Role:Firewall) - unless the descriptions
+           are given (see 'get_firewall_descriptions'). The standby is the
+           other instance with Tag (Primary:false) of the same pair (see
+           'get_firewall_pairs'). Returns (failed, standby), standby is None
+           if the failed instance is not the primary."""
         action = (
-            'get instance description'
-            ' by Tags (Role:Firewall) and (Primary:false)'.format(**locals()))
+            'get failed ({failed_instance_id}) and standby instance'
+            ' descriptions by Tag (Role:Firewall)'.format(**locals()))
         verbose_print('attempting to {action}...'.format(**locals()))
-        try:
-            describe_instances_output = ec2_client.describe_instances(
-                Filters=[
-                    {'Name': 'tag:Role', 'Values':['Firewall']},
-                    {'Name': 'tag:Primary', 'Values':['false']}
-                ])
-        except botocore.exceptions.NoCredentialsError as e:
-            boto_no_credentials_error_exception_handler(action, e)
-        except botocore.exceptions.ClientError as e:
-            boto_client_error_exception_handler(
-                action, e, 'ec2:DescribeInstances')
-        except Exception as e:
-            catch_all_exception_handler(action, e)
+        if descriptions is None:
+            descriptions = get_firewall_descriptions()
+        failed_descriptions = [
+            d for d in descriptions
+            if d.get('InstanceId') == failed_instance_id]
+        if failed_descriptions:
+            failed_instance = cls(failed_descriptions[0])
         else:
-            verbose_print('able to {action}'.format(**locals()))
-            debug_print(
-                'ec2.describe_instances output:'
-                ' {describe_instances_output}'.format(**locals()))
-        reservations = describe_instances_output.get('Reservations')
-        if reservations:
-            no_of_instances_found = len(reservations)
-            debug_print(
-                'number of instances found:'
-                ' {no_of_instances_found}'.format(**locals()))
-            if no_of_instances_found == 1:
-                verbose_print('found just one matching instance')
-                reservation = reservations[0]
-                instances = reservation.get('Instances')
-                if instances:
-                    if len(instances) == 1:
-                        description = instances[0]
-                        debug_print(
-                            'instance description:'
-                            ' {description}'.format(**locals()))
-                        return cls(description)
-            elif no_of_instances_found > 1:
-                verbose_print('found multiple matching instances')
-                instance_ids = []
-                for r in reservations:
-                    instances = r.get('Instances')
-                    if instances:
-                        if len(instances) == 1:
-                            instance = instances[0]
-                            instance_id = instance.get('InstanceId')
-                            if instance_id:
-                                instance_ids.append(instance_id)
-                debug_print(
-                    'instances found: {instance_ids}'.format(**locals()))
+            # the failed instance may not carry the Role tag
+            verbose_print(
+                'did not find failed instance by Tag (Role:Firewall)')
+            failed_instance = cls.from_instance_id(failed_instance_id)
+        if not failed_instance.is_primary:
+            return failed_instance, None
+        pair_id = get_pair_id(failed_instance.description)
+        standby_descriptions = [
+            d for d in descriptions
+            if d.get('InstanceId') != failed_instance_id and
+            get_pair_id(d) == pair_id and not is_departed(d) and
+            {'Key': 'Primary', 'Value': 'false'} in d.get('Tags', [])]
+        standby_instance_ids = [d['InstanceId'] for d in standby_descriptions]
+        debug_print(
+            'standby instances found:'
+            ' {standby_instance_ids}'.format(**locals()))
+        if len(standby_descriptions) == 1:
+            verbose_print('found just one matching standby instance')
+            return failed_instance, cls(standby_descriptions[0])
+        elif standby_descriptions:
+            verbose_print('found multiple matching standby instances')
         else:
-            verbose_print('did not find any instances')
-            debug_print(
-                'no instances found'
-                ' with tag ({tag}) val ({val})'.format(**locals()))
+            verbose_print('did not find any standby instances')
         sys.exit('exit: not able to {action}'.format(**locals()))
 
     def update_tag(self, tag, val, dry_run):
         """update the value of tag to a new value."""
-        instance_id = self.id
-        action = (
-            'update tag ({tag}) to value ({val})'
-            ' for instance ({instance_id})'.format(**locals()))
-        verbose_print('attempting to {action}...'.format(**locals()))
+        update_tag(self.id, tag, val, dry_run)
+
+    def get_health_problems(self, instance_status):
+        """Return the health problems of the instance (list of strings,
+           empty if healthy) using its status (see 'get_instance_statuses')
+           and the attachment state of its network interfaces."""
+        problems = []
+        state = instance_status.get('InstanceState', {}).get('Name')
+        if state != 'running':
+            problems.append('instance state is {0}'.format(state))
+        for check in 'InstanceStatus', 'SystemStatus':
+            status = instance_status.get(check, {}).get('Status')
+            if status == 'impaired':
+                problems.append('{0} check is {1}'.format(check, status))
+        for ni in self.description.get('NetworkInterfaces', []):
+            attachment_status = ni.get('Attachment', {}).get('Status')
+            if attachment_status != 'attached':
+                problems.append(
+                    'network interface ({0}) is {1}'.format(
+                        ni.get('NetworkInterfaceId'), attachment_status))
+        return problems
+
+
+def get_firewall_descriptions():
+    """Get the EC2 instance descriptions of all the instances with Tag
+       (Role:Firewall) using a single call - including the departed ones
+       (see 'is_departed') so that a departed primary is failed over."""
+    action = 'get instance descriptions by Tag (Role:Firewall)'
+    verbose_print('attempting to {action}...'.format(**locals()))
+    try:
+        describe_instances_output = aws_call(
+            'ec2:DescribeInstances', ec2_client.describe_instances,
+            Filters=[
+                {'Name': 'tag:Role', 'Values': ['Firewall']},
+                {'Name': 'instance-state-name',
+                 'Values': ['pending', 'running', 'stopping', 'stopped'] +
+                 list(DEPARTED_STATES)}
+            ])
+    except botocore.exceptions.NoCredentialsError as e:
+        boto_no_credentials_error_exception_handler(action, e)
+    except botocore.exceptions.ClientError as e:
+        boto_client_error_exception_handler(
+            action, e, 'ec2:DescribeInstances')
+    except Exception as e:
+        catch_all_exception_handler(action, e)
+    else:
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print(
+            'ec2.describe_instances output:'
+            ' {describe_instances_output}'.format(**locals()))
+    return [
+        i for r in describe_instances_output.get('Reservations', [])
+        for i in r.get('Instances', [])]
+
+
+def is_departed(description):
+    """Return whether a Palo Alto instance description is of an instance
+       that is going (or gone) away (see 'DEPARTED_STATES')."""
+    return description.get('State', {}).get('Name') in DEPARTED_STATES
+
+
+def get_pair_id(description):
+    """Return the ID of the pair of a Palo Alto instance description: the
+       value of its PAIR_TAG tag or else its VPC ID."""
+    for tag in description.get('Tags', []):
+        if tag['Key'] == PAIR_TAG:
+            return tag['Value']
+    return description.get('VpcId')
+
+
+def get_firewall_pairs(descriptions):
+    """Group Palo Alto instance descriptions (see
+       'get_firewall_descriptions') into pairs. Returns a dict of pair ID
+       (see 'get_pair_id') to the list of descriptions of the pair. A
+       departed (see 'is_departed') instance is left out of its pair unless
+       it is the primary (which is to be failed over)."""
+    pairs = {}
+    for description in descriptions:
+        if (is_departed(description) and
+                {'Key': 'Primary', 'Value': 'true'} not in
+                description.get('Tags', [])):
+            continue
+        pairs.setdefault(get_pair_id(description), []).append(description)
+    return pairs
+
+
+def in_maintenance_window(maintenance_window, now=None):
+    """Return whether a time (default: now) is in a weekly maintenance
+       window given as 'ddd:hh:mm-ddd:hh:mm' (e.g. 'sun:02:00-sun:04:00',
+       as used by RDS) or in a daily one given as 'hh:mm-hh:mm' (UTC).
+       Raises ValueError if the maintenance window is not valid."""
+    days = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+    try:
+        start, end = maintenance_window.lower().split('-')
+    except ValueError:
+        raise ValueError(
+            'invalid maintenance window: {0}'.format(maintenance_window))
+    daily = start.count(':') == 1
+
+    def to_minutes(window_time):
+        """Return the minutes of a window time since the window period
+           (day or week) started."""
+        parts = window_time.split(':')
         try:
-            create_tags_output = (
-                ec2_client.create_tags(
-                    DryRun=dry_run,
-                    Resources=[self.id],
-                    Tags=[{'Key': tag, 'Value': val}]))
-        except botocore.exceptions.NoCredentialsError as e:
-            boto_no_credentials_error_exception_handler(action, e)
-        except botocore.exceptions.ClientError as e:
-            boto_client_error_exception_handler(
-                action, e, 'ec2:CreateTags', ResourceId=self.id)
-        except Exception as e:
-            catch_all_exception_handler(action, e)
-        else:
-            verbose_print('able to {action}'.format(**locals()))
-            debug_print(
-                'ec2.create_tags output:'
-                ' {create_tags_output}'.format(**locals()))
+            if len(parts) != (2 if daily else 3):
+                raise ValueError(window_time)
+            day = 0 if daily else days.index(parts.pop(0)) * 1440
+            return day + int(parts[0]) * 60 + int(parts[1])
+        except ValueError:
+            raise ValueError(
+                'invalid maintenance window: {0}'.format(maintenance_window))
 
+    start_minutes, end_minutes = to_minutes(start), to_minutes(end)
+    now = time.gmtime(now)
+    current_minutes = now.tm_hour * 60 + now.tm_min
+    if not daily:
+        current_minutes += now.tm_wday * 1440
+    if start_minutes <= end_minutes:
+        return start_minutes <= current_minutes < end_minutes
+    return current_minutes >= start_minutes or current_minutes < end_minutes
 
-def get_route_id(subnet_id):
-    """Get EC2 route table ID using subnet ID."""
+
+def get_instance_statuses(instance_ids):
+    """Get the status (state, instance and system status checks) of EC2
+       instances (even if not running) using a single call. Returns a dict
+       of instance ID to instance status."""
     action = (
-        'get route table ID associated'
-        ' with subnet ID ({subnet_id})'.format(**locals()))
+        'get instance statuses of instances ({instance_ids})'.format(
+            **locals()))
     verbose_print('attempting to {action}...'.format(**locals()))
     try:
-        describe_route_tables_output = ec2_client.describe_route_tables(
-            Filters=[{'Name': 'association.subnet-id', 'Values':[subnet_id]}])
+        describe_instance_status_output = aws_call(
+            'ec2:DescribeInstanceStatus', ec2_client.describe_instance_status,
+            InstanceIds=instance_ids,
+            IncludeAllInstances=True)
     except botocore.exceptions.NoCredentialsError as e:
         boto_no_credentials_error_exception_handler(action, e)
     except botocore.exceptions.ClientError as e:
         boto_client_error_exception_handler(
-            action, e, 'ec2:DescribeRouteTables')
+            action, e, 'ec2:DescribeInstanceStatus')
     except Exception as e:
         catch_all_exception_handler(action, e)
     else:
         verbose_print('able to {action}'.format(**locals()))
         debug_print(
-            'ec2.describe_route_tables output:'
-            ' {describe_route_tables_output}'.format(**locals()))
-    route_tables = describe_route_tables_output.get('RouteTables')
-    if route_tables:
-        route_table_id = route_tables[0].get('RouteTableId')
-        if route_table_id:
-            verbose_print(
-                'found route table ({route_table_id})'.format(**locals()))
-            debug_print(
-                'route table ({route_table_id})'
-                ' associated with subnet ({subnet_id})'.format(**locals()))
-            return route_table_id
-    verbose_print('did not find any route tables')
-    debug_print(
-        'no route tables found'
-        ' associated with subnet ({subnet_id})'.format(**locals()))
-    sys.exit('exit: not able to {action}'.format(**locals()))
+            'ec2.describe_instance_status output:'
+            ' {describe_instance_status_output}'.format(**locals()))
+    return dict(
+        (status['InstanceId'], status) for status in
+        describe_instance_status_output.get('InstanceStatuses', []))
 
 
-def replace_route(route_table_id, network_interface_id, dry_run):
-    """Route the default destination (0.0.0.0/0) to the specified
-       network interface ID."""
+def update_tag(instance_id, tag, val, dry_run):
+    """Update the value of an instance tag to a new value."""
     action = (
-        'route external destination (0.0.0.0/0) to'
+        'update tag ({tag}) to value ({val})'
+        ' for instance ({instance_id})'.format(**locals()))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    try:
+        create_tags_output = (
+            aws_call(
+                'ec2:CreateTags', ec2_client.create_tags,
+                DryRun=dry_run,
+                Resources=[instance_id],
+                Tags=[{'Key': tag, 'Value': val}]))
+    except botocore.exceptions.NoCredentialsError as e:
+        boto_no_credentials_error_exception_handler(action, e)
+    except botocore.exceptions.ClientError as e:
+        boto_client_error_exception_handler(
+            action, e, 'ec2:CreateTags', ResourceId=instance_id)
+    except Exception as e:
+        catch_all_exception_handler(action, e)
+    else:
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print(
+            'ec2.create_tags output:'
+            ' {create_tags_output}'.format(**locals()))
+
+
+class RouteTableIndex(object):
+    """Instantiate an in-memory index of all the route tables of a VPC
+       fetched with (paginated) 'describe_route_tables' calls. Sets up the
+       following attributes:
+
+           vpc_id(string): the VPC ID
+           route_tables(dict): route table descriptions by route table ID
+           subnet_route_table_ids(dict): route table ID by subnet ID (of
+               the subnets explicitly associated with a route table)
+           main_route_table_id(string): ID of the main route table (used by
+               the subnets not explicitly associated with a route table)
+
+           from_vpc_id(vpc_id): instantiate object via a VPC ID
+           route_table_id(subnet_id): ID of the route table of a subnet
+           routes(route_table_id): the routes of a route table
+           routes_targeting(net_int_ids): the routes (of any destination)
+               targeting network interfaces"""
+
+    def __init__(self, vpc_id, route_tables):
+        """Instantiates a RouteTableIndex object"""
+        self.vpc_id = vpc_id
+        self.route_tables = {}
+        self.subnet_route_table_ids = {}
+        self.main_route_table_id = None
+        for route_table in route_tables:
+            route_table_id = route_table['RouteTableId']
+            self.route_tables[route_table_id] = route_table
+            for association in route_table.get('Associations', []):
+                if association.get('Main'):
+                    self.main_route_table_id = route_table_id
+                elif association.get('SubnetId'):
+                    self.subnet_route_table_ids[association['SubnetId']] = (
+                        route_table_id)
+
+    @classmethod
+    def from_vpc_id(cls, vpc_id, page_size=100):
+        """Get all the route tables of a VPC (one call per page)."""
+        action = (
+            'get route tables of VPC ({vpc_id})'.format(**locals()))
+        verbose_print('attempting to {action}...'.format(**locals()))
+        route_tables = []
+        kwargs = {
+            'Filters': [{'Name': 'vpc-id', 'Values': [vpc_id]}],
+            'MaxResults': page_size}
+        while True:
+            try:
+                describe_route_tables_output = aws_call(
+                    'ec2:DescribeRouteTables',
+                    ec2_client.describe_route_tables, **kwargs)
+            except botocore.exceptions.NoCredentialsError as e:
+                boto_no_credentials_error_exception_handler(action, e)
+            except botocore.exceptions.ClientError as e:
+                boto_client_error_exception_handler(
+                    action, e, 'ec2:DescribeRouteTables')
+            except Exception as e:
+                catch_all_exception_handler(action, e)
+            else:
+                debug_print(
+                    'ec2.describe_route_tables output:'
+                    ' {describe_route_tables_output}'.format(**locals()))
+            route_tables.extend(
+                describe_route_tables_output.get('RouteTables', []))
+            next_token = describe_route_tables_output.get('NextToken')
+            if not next_token:
+                break
+            kwargs['NextToken'] = next_token
+        verbose_print('able to {action}'.format(**locals()))
+        verbose_print('found {0} route tables'.format(len(route_tables)))
+        return cls(vpc_id, route_tables)
+
+    def route_table_id(self, subnet_id):
+        """Return the ID of the route table of a subnet."""
+        return self.subnet_route_table_ids.get(
+            subnet_id, self.main_route_table_id)
+
+    def routes(self, route_table_id):
+        """Return the routes of a route table (list of route dicts)."""
+        return self.route_tables.get(route_table_id, {}).get('Routes', [])
+
+    def routes_targeting(self, net_int_ids):
+        """Return the routes targeting any of the network interfaces as a
+           list of dicts: route_table_id, destination (see
+           'get_route_destination') and net_int_id (the target)."""
+        targeting_routes = []
+        for route_table_id in sorted(self.route_tables):
+            for route in self.routes(route_table_id):
+                if route.get('NetworkInterfaceId') in net_int_ids:
+                    targeting_routes.append({
+                        'route_table_id': route_table_id,
+                        'destination': get_route_destination(route),
+                        'net_int_id': route['NetworkInterfaceId']})
+        return targeting_routes
+
+
+def get_route_destination(route):
+    """Return the destination of a route as a dict of the single
+       destination key (CIDR block, IPv6 CIDR block or prefix list ID) to
+       its value, e.g. {'DestinationCidrBlock': '0.0.0.0/0'}."""
+    for key in ROUTE_DESTINATION_KEYS:
+        if route.get(key):
+            return {key: route[key]}
+    return {}
+
+
+def replace_route(route_table_id, network_interface_id, dry_run,
+                  destination=None):
+    """Route a destination (see 'get_route_destination', default: the
+       external destination 0.0.0.0/0) to the specified network
+       interface ID."""
+    if not destination:
+        destination = {'DestinationCidrBlock': '0.0.0.0/0'}
+    destination_value = list(destination.values())[0]
+    action = (
+        'route destination ({destination_value}) to'
         ' network interface ({network_interface_id})'
         ' for route table ID ({route_table_id})'.format(**locals()))
     verbose_print('attempting to {action}...'.format(**locals()))
     try:
         replace_route_output = (
-            ec2_client.replace_route(
+            aws_call(
+                'ec2:ReplaceRoute', ec2_client.replace_route,
                 RouteTableId=route_table_id,
-                DestinationCidrBlock='0.0.0.0/0',
                 DryRun=dry_run,
-                NetworkInterfaceId=network_interface_id))
+                NetworkInterfaceId=network_interface_id,
+                **destination))
     except botocore.exceptions.NoCredentialsError as e:
         boto_no_credentials_error_exception_handler(action, e)
     except botocore.exceptions.ClientError as e:
@@ -707,70 +1526,1415 @@ def replace_route(route_table_id, network_interface_id, dry_run):
             ' {replace_route_output}'.format(**locals()))
 
 
-def main(failed_pa_instance_id, verbose=True, debug=True, dry_run=False):
-    """Main function to perform all steps highlighted in description.
-       Returns a result string describing actual action taken."""
+class FailoverPlan(object):
+    """Instantiate an in-memory plan of all the changes needed to fail over
+       from one EC2 instance to another. The plan is built from a single
+       snapshot of both instances, their network interfaces and the route
+       tables of their VPC. Sets up the following attributes:
+
+           from_instance_id(string): ID of the instance to move away from
+           to_instance_id(string): ID of the instance to move to
+           eip_moves(list): EIP moves (dicts: eip_alloc_id, net_int_id,
+               priv_ip)
+           tag_updates(list): tag swaps (dicts: instance_id, tag, val)
+           route_replacements(list): route replacements (dicts:
+               route_table_id, destination, net_int_id)
+           net_int_attachments(dict): attachment (instance ID and status)
+               of each network interface of the instance to move to
+           net_int_ids(list): network interface IDs of both instances
+           fingerprint(string): topology fingerprint of the network
+               interfaces and the planned route tables the plan was built
+               from
+           created(float): time (epoch) the plan was built
+
+           from_instances(from_inst, to_inst): build the plan from two
+               Ec2Instance objects
+           from_dict(plan_dict): instantiate a plan stored via 'to_dict'
+           to_dict(): the plan as a (JSON serializable) dict
+           verify(): whether the topology still matches the fingerprint
+           steps(dry_run): the plan as a list of steps (see 'run_steps')
+           execute(dry_run): perform the planned changes and return a
+               report (see 'run_steps')."""
+
+    def __init__(self, from_instance_id, to_instance_id,
+                 eip_moves=None, tag_updates=None, route_replacements=None,
+                 net_int_attachments=None, net_int_ids=None,
+                 fingerprint=None, created=None):
+        """Instantiates a FailoverPlan object"""
+        self.from_instance_id = from_instance_id
+        self.to_instance_id = to_instance_id
+        self.eip_moves = eip_moves or []
+        self.tag_updates = tag_updates or []
+        self.route_replacements = route_replacements or []
+        self.net_int_attachments = net_int_attachments or {}
+        self.net_int_ids = net_int_ids or []
+        self.fingerprint = fingerprint
+        self.created = created or time.time()
+
+    @classmethod
+    def from_instances(cls, from_inst, to_inst, failback=False):
+        """Build the failover plan to move the EIPs, the Primary tag and the
+           routes from one instance to another with a constant number of
+           AWS API calls (one per resource type). The instance moved away
+           from is tagged to be failed back to (see 'failback') unless the
+           plan is the failback itself, which clears that tag."""
+        from_inst_id = from_inst.id
+        to_inst_id = to_inst.id
+        action = (
+            'plan failover from instance ({from_inst_id})'
+            ' to instance ({to_inst_id})'.format(**locals()))
+        verbose_print('attempting to {action}...'.format(**locals()))
+        # snapshot the network interfaces of both instances (one call)
+        net_int_ids = sorted(
+            [ni['eni_id'] for ni in from_inst.network_interfaces.values()] +
+            [ni['eni_id'] for ni in to_inst.network_interfaces.values()])
+        network_interfaces = get_network_interfaces(net_int_ids)
+        # plan the EIP moves (skipping any EIPs already moved, e.g. by a
+        # partially failed or timed out failover)
+        eip_moves = []
+        for ni in sorted(from_inst.network_interfaces):
+            if ni == 'eth0':
+                continue
+            eip_allocation_ids = get_eip_allocation_ids(
+                network_interfaces[from_inst.network_interfaces[ni]['eni_id']])
+            if not eip_allocation_ids:
+                continue
+            if ni not in to_inst.network_interfaces:
+                debug_print(
+                    'destination instance ({to_inst_id}) does not have'
+                    ' network interface ({ni})'.format(**locals()))
+                sys.exit('exit: not able to {action}'.format(**locals()))
+            to_inst_eni = to_inst.network_interfaces[ni]['eni_id']
+            moved_eips = get_eip_associations(network_interfaces[to_inst_eni])
+            if moved_eips:
+                verbose_print(
+                    'EIPs ({0}) already attached to network interface'
+                    ' ({to_inst_eni}): skipping them'.format(
+                        sorted(moved_eips.values()), **locals()))
+            to_inst_pips = [
+                pip for pip in to_inst.network_interfaces[ni]['priv_ips']
+                if pip not in moved_eips]
+            if len(eip_allocation_ids) != len(to_inst_pips):
+                debug_print(
+                    'destination instance ({to_inst_id}) does not have'
+                    ' matching number of private IPs on'
+                    ' network interface ({to_inst_eni})'.format(**locals()))
+                sys.exit('exit: not able to {action}'.format(**locals()))
+            for eip_alloc_id, to_inst_pip in zip(
+                    eip_allocation_ids, to_inst_pips):
+                eip_moves.append({
+                    'eip_alloc_id': eip_alloc_id,
+                    'net_int_id': to_inst_eni,
+                    'priv_ip': to_inst_pip})
+        # plan the Primary (and failback) tag swaps (skipping any already
+        # swapped)
+        tag_values = [
+            (from_inst, 'Primary', 'false'), (to_inst, 'Primary', 'true')]
+        if failback:
+            tag_values.append((to_inst, FAILBACK_TAG, 'false'))
+        else:
+            tag_values.append((from_inst, FAILBACK_TAG, 'true'))
+        tag_updates = [
+            {'instance_id': inst.id, 'tag': tag, 'val': val}
+            for inst, tag, val in tag_values
+            if {'Key': tag, 'Value': val} not in inst.tags]
+        # plan the route replacements: every route (of any destination)
+        # of the VPC targeting a network interface of the instance to move
+        # away from is routed to the same network interface of the other
+        # (routes already moved no longer target it, so they are skipped)
+        vpc_id = from_inst.description.get('VpcId')
+        if not vpc_id:
+            debug_print(
+                'instance ({from_inst_id}) is not in a VPC'.format(**locals()))
+            sys.exit('exit: not able to {action}'.format(**locals()))
+        route_table_index = RouteTableIndex.from_vpc_id(vpc_id)
+        to_net_int_ids = {}
+        for ni, from_net_int in from_inst.network_interfaces.items():
+            if ni in to_inst.network_interfaces:
+                to_net_int_ids[from_net_int['eni_id']] = (
+                    to_inst.network_interfaces[ni]['eni_id'])
+        route_replacements = []
+        for route in route_table_index.routes_targeting([
+                ni['eni_id'] for ni in from_inst.network_interfaces.values()]):
+            from_inst_eni = route['net_int_id']
+            if from_inst_eni not in to_net_int_ids:
+                debug_print(
+                    'destination instance ({to_inst_id}) does not have'
+                    ' the network interface routed to by route table'
+                    ' ({0})'.format(route['route_table_id'], **locals()))
+                sys.exit('exit: not able to {action}'.format(**locals()))
+            route_replacements.append({
+                'route_table_id': route['route_table_id'],
+                'destination': route['destination'],
+                'net_int_id': to_net_int_ids[from_inst_eni]})
+        for ni in ROUTED_NETWORK_INTERFACES:
+            for inst in from_inst, to_inst:
+                if ni not in inst.network_interfaces:
+                    continue
+                subnet_id = inst.network_interfaces[ni]['subnet_id']
+                debug_print(
+                    'routed subnet ({subnet_id}) of ({0}) uses'
+                    ' route table ({1})'.format(
+                        inst.id, route_table_index.route_table_id(subnet_id),
+                        **locals()))
+        # the standby network interfaces must be attached before routing
+        net_int_attachments = {}
+        for ni in to_inst.network_interfaces.values():
+            attachment = network_interfaces[ni['eni_id']].get('Attachment', {})
+            net_int_attachments[ni['eni_id']] = {
+                'instance_id': attachment.get('InstanceId'),
+                'status': attachment.get('Status')}
+        plan = cls(
+            from_inst_id, to_inst_id,
+            eip_moves, tag_updates, route_replacements, net_int_attachments,
+            net_int_ids, get_topology_fingerprint(
+                network_interfaces,
+                dict((route_table_id, route_table_index.route_tables[
+                    route_table_id]) for route_table_id in set(
+                        r['route_table_id'] for r in route_replacements))))
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print(
+            'failover plan: eip moves {0}, tag updates {1},'
+            ' route replacements {2}'.format(
+                plan.eip_moves, plan.tag_updates, plan.route_replacements))
+        return plan
+
+    @classmethod
+    def from_dict(cls, plan_dict):
+        """Instantiate a failover plan from a dict (see 'to_dict')."""
+        return cls(**plan_dict)
+
+    def to_dict(self):
+        """Return the failover plan as a (JSON serializable) dict."""
+        return {
+            'from_instance_id': self.from_instance_id,
+            'to_instance_id': self.to_instance_id,
+            'eip_moves': self.eip_moves,
+            'tag_updates': self.tag_updates,
+            'route_replacements': self.route_replacements,
+            'net_int_attachments': self.net_int_attachments,
+            'net_int_ids': self.net_int_ids,
+            'fingerprint': self.fingerprint,
+            'created': self.created}
+
+    def verify(self):
+        """Verify the topology (network interfaces, their attachments and
+           EIP associations and the routes of the planned route tables
+           targeting them) still matches the one the plan was built from
+           using a 'describe_network_interfaces' and a
+           'describe_route_tables' call."""
+        action = 'verify the failover plan topology fingerprint'
+        verbose_print('attempting to {action}...'.format(**locals()))
+        try:
+            network_interfaces = get_network_interfaces(self.net_int_ids)
+            route_tables = get_route_tables(sorted(set(
+                r['route_table_id'] for r in self.route_replacements)))
+        except SystemExit as e:
+            verbose_print('not able to {action}'.format(**locals()))
+            debug_print('{e}'.format(**locals()))
+            return False
+        fingerprint = get_topology_fingerprint(
+            network_interfaces, route_tables)
+        debug_print(
+            'topology fingerprint: planned ({0}) current ({1})'.format(
+                self.fingerprint, fingerprint))
+        if fingerprint != self.fingerprint:
+            verbose_print('topology changed since the plan was built')
+            return False
+        verbose_print('able to {action}'.format(**locals()))
+        return True
+
+    def steps(self, dry_run):
+        """Return the planned changes as a list of steps with their ordering
+           constraints: the routes are only replaced once the standby network
+           interfaces are confirmed and the Primary tags are only swapped once
+           all the EIPs and routes are moved (so a failed failover can be
+           retried)."""
+        confirm_step = 'confirm network interfaces of ({0})'.format(
+            self.to_instance_id)
+        steps = [{
+            'name': confirm_step,
+            'func': confirm_net_int_attachments,
+            'args': (self.to_instance_id, self.net_int_attachments),
+            'phase': 'confirm_enis',
+            'depends_on': []}]
+        for eip_move in self.eip_moves:
+            steps.append({
+                'name': self.eip_move_step_name(eip_move),
+                'func': attach_eip,
+                'args': (eip_move['eip_alloc_id'], eip_move['net_int_id'],
+                         eip_move['priv_ip'], dry_run),
+                'phase': 'move_eips',
+                'depends_on': []})
+        for route_replacement in self.route_replacements:
+            steps.append({
+                'name': self.route_replacement_step_name(route_replacement),
+                'func': replace_route,
+                'args': (route_replacement['route_table_id'],
+                         route_replacement['net_int_id'], dry_run,
+                         route_replacement.get('destination')),
+                'phase': 'replace_routes',
+                'depends_on': [confirm_step]})
+        traffic_steps = [step['name'] for step in steps]
+        for tag_update in self.tag_updates:
+            steps.append({
+                'name': 'update tag ({tag}) of ({instance_id})'.format(
+                    **tag_update),
+                'func': update_tag,
+                'args': (tag_update['instance_id'], tag_update['tag'],
+                         tag_update['val'], dry_run),
+                'phase': 'swap_tags',
+                'depends_on': traffic_steps})
+        return steps
+
+    @staticmethod
+    def eip_move_step_name(eip_move):
+        """Return the name of the step of an EIP move."""
+        return 'move EIP ({eip_alloc_id})'.format(**eip_move)
+
+    @staticmethod
+    def route_replacement_step_name(route_replacement):
+        """Return the name of the step of a route replacement."""
+        destination = route_replacement.get('destination')
+        return 'replace route ({0}) of ({route_table_id})'.format(
+            list(destination.values())[0] if destination else '0.0.0.0/0',
+            **route_replacement)
+
+    def from_net_int_ids(self):
+        """Return the IDs of the network interfaces of the instance to move
+           away from."""
+        return sorted(
+            set(self.net_int_ids or []) - set(self.net_int_attachments))
+
+    def execute(self, dry_run, journal=None):
+        """Perform the planned changes (concurrently where possible) and
+           return the report of the results. If a journal is given (see
+           'FailoverJournal'), the steps it already completed are skipped
+           and every step completed is journaled."""
+        if journal is None:
+            return run_steps(self.steps(dry_run))
+        return run_steps(
+            self.steps(dry_run), completed=journal.completed_steps,
+            on_success=journal.complete_step)
+
+
+def get_topology_fingerprint(network_interfaces, route_tables=None):
+    """Return a fingerprint (sha256) of the failover topology: the network
+       interfaces (see 'get_network_interfaces'), their subnets, their
+       attachments and the EIPs associated with their private IPs and the
+       routes (destination and target) of the route tables (see
+       'get_route_tables') targeting any of the network interfaces (so a
+       planned route that was since moved, or a new route to move, changes
+       the fingerprint)."""
+    topology = []
+    for net_int_id in sorted(network_interfaces):
+        network_interface = network_interfaces[net_int_id]
+        attachment = network_interface.get('Attachment', {})
+        topology.append([
+            net_int_id,
+            network_interface.get('SubnetId'),
+            attachment.get('InstanceId'),
+            attachment.get('DeviceIndex'),
+            attachment.get('Status'),
+            [[pip.get('PrivateIpAddress'),
+              pip.get('Association', {}).get('AllocationId')]
+             for pip in network_interface.get('PrivateIpAddresses', [])]])
+    for route_table_id in sorted(route_tables or {}):
+        for route in route_tables[route_table_id].get('Routes', []):
+            if route.get('NetworkInterfaceId') in network_interfaces:
+                topology.append([
+                    route_table_id,
+                    sorted(get_route_destination(route).items()),
+                    route.get('NetworkInterfaceId'),
+                    route.get('InstanceId')])
+    return hashlib.sha256(
+        json.dumps(topology, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def store_failover_plan(plan, plan_parameter):
+    """Store a failover plan (as JSON) in an SSM parameter."""
+    action = (
+        'store failover plan in SSM parameter'
+        ' ({plan_parameter})'.format(**locals()))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    try:
+        put_parameter_output = aws_call(
+            'ssm:PutParameter', ssm_client.put_parameter,
+            Name=plan_parameter,
+            Description='Palo Alto failover plan (see pa_failover.py)',
+            Value=json.dumps(plan.to_dict(), sort_keys=True),
+            Type='String',
+            Tier='Intelligent-Tiering',
+            Overwrite=True)
+    except botocore.exceptions.NoCredentialsError as e:
+        boto_no_credentials_error_exception_handler(action, e)
+    except botocore.exceptions.ClientError as e:
+        boto_client_error_exception_handler(
+            action, e, 'ssm:PutParameter')
+    except Exception as e:
+        catch_all_exception_handler(action, e)
+    else:
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print(
+            'ssm.put_parameter output:'
+            ' {put_parameter_output}'.format(**locals()))
+
+
+def load_failover_plan(plan_parameter):
+    """Load a failover plan from an SSM parameter. Returns None if there
+       is no (valid) stored plan."""
+    action = (
+        'load failover plan from SSM parameter'
+        ' ({plan_parameter})'.format(**locals()))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    try:
+        get_parameter_output = aws_call(
+            'ssm:GetParameter', ssm_client.get_parameter,
+            Name=plan_parameter)
+        plan = FailoverPlan.from_dict(
+            json.loads(get_parameter_output['Parameter']['Value']))
+    except (botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError,
+            KeyError, TypeError, ValueError) as e:
+        verbose_print('not able to {action}'.format(**locals()))
+        debug_print('exception: {e}'.format(**locals()))
+        return None
+    verbose_print('able to {action}'.format(**locals()))
+    debug_print('failover plan: {0}'.format(plan.to_dict()))
+    return plan
+
+
+class FailoverJournal(object):
+    """Instantiate a journal of the progress of the failover of an instance
+       stored as an item in a DynamoDB table (partition key 'failover_id'
+       (string): the failed instance ID) so that a retried failover resumes
+       from the first incomplete step.
+
+       attributes:
+           table(string): name of the DynamoDB table
+           failover_id(string): ID of the failover (failed instance ID)
+           plan(FailoverPlan): plan of the failover being journaled (None
+               until loaded or started)
+           completed_steps(set): names of the steps completed
+
+       Writing to the journal is best effort: a failover is never stopped
+       because its progress can not be journaled."""
+
+    def __init__(self, table, failover_id):
+        self.table = table
+        self.failover_id = failover_id
+        self.plan = None
+        self.completed_steps = set()
+        self.lock = threading.Lock()
+
+    def key(self):
+        """Return the key of the journal item."""
+        return {'failover_id': {'S': self.failover_id}}
+
+    def load(self):
+        """Load the journal of an incomplete failover (one that is not
+           older than JOURNAL_MAX_AGE). Returns whether there is one to
+           resume."""
+        action = (
+            'load failover journal ({failover_id})'
+            ' from DynamoDB table ({table})'.format(**vars(self)))
+        verbose_print('attempting to {action}...'.format(**locals()))
+        try:
+            get_item_output = aws_call(
+                'dynamodb:GetItem', dynamodb_client.get_item,
+                TableName=self.table, Key=self.key(), ConsistentRead=True)
+            item = get_item_output.get('Item')
+            if item is None:
+                verbose_print('no failover journal found')
+                return False
+            status = item['status']['S']
+            updated = float(item['updated']['N'])
+            if status != 'in_progress':
+                verbose_print('failover journal is {status}'.format(
+                    **locals()))
+                return False
+            if time.time() - updated > JOURNAL_MAX_AGE:
+                verbose_print('failover journal is stale: ignoring it')
+                return False
+            self.plan = FailoverPlan.from_dict(json.loads(item['plan']['S']))
+            self.completed_steps = set(
+                item.get('completed_steps', {}).get('SS', []))
+        except (botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError,
+                KeyError, TypeError, ValueError) as e:
+            verbose_print('not able to {action}'.format(**locals()))
+            debug_print('exception: {e}'.format(**locals()))
+            return False
+        verbose_print('able to {action}'.format(**locals()))
+        debug_print('completed steps: {0}'.format(
+            sorted(self.completed_steps)))
+        return True
+
+    def write(self, action, aws_svc_action, func, **kwargs):
+        """Write to the journal (best effort). Returns whether it
+           succeeded."""
+        verbose_print('attempting to {action}...'.format(**locals()))
+        try:
+            aws_call(aws_svc_action, func, TableName=self.table, **kwargs)
+        except (botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError) as e:
+            verbose_print('not able to {action}'.format(**locals()))
+            debug_print('exception: {e}'.format(**locals()))
+            return False
+        verbose_print('able to {action}'.format(**locals()))
+        return True
+
+    def start(self, plan):
+        """Journal the start of a failover (its plan)."""
+        self.plan = plan
+        self.completed_steps = set()
+        return self.write(
+            'journal the start of failover ({0})'.format(self.failover_id),
+            'dynamodb:PutItem', dynamodb_client.put_item,
+            Item={
+                'failover_id': {'S': self.failover_id},
+                'plan': {'S': json.dumps(plan.to_dict(), sort_keys=True)},
+                'status': {'S': 'in_progress'},
+                'updated': {'N': str(time.time())}})
+
+    def complete_step(self, step_name):
+        """Journal the completion of a step of the failover."""
+        with self.lock:
+            self.completed_steps.add(step_name)
+        return self.write(
+            'journal the completion of step ({0})'.format(step_name),
+            'dynamodb:UpdateItem', dynamodb_client.update_item,
+            Key=self.key(),
+            UpdateExpression='ADD completed_steps :s SET updated = :t',
+            ExpressionAttributeValues={
+                ':s': {'SS': [step_name]},
+                ':t': {'N': str(time.time())}})
+
+    def finish(self):
+        """Journal the completion of the failover."""
+        return self.write(
+            'journal the completion of failover ({0})'.format(
+                self.failover_id),
+            'dynamodb:UpdateItem', dynamodb_client.update_item,
+            Key=self.key(),
+            UpdateExpression='SET #status = :c, updated = :t',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':c': {'S': 'complete'},
+                ':t': {'N': str(time.time())}})
+
+
+class DynamoDbLockStore(object):
+    """Instantiate a store of failover locks kept as items in a DynamoDB
+       table (partition key 'lock_id' (string)). A lock is acquired with a
+       single conditional write which only succeeds if the lock does not
+       exist, has expired or is already owned by the same owner (e.g. a
+       retry of the same Lambda request). Sets up the following attributes:
+
+           table(string): name of the DynamoDB table
+
+           acquire(lock_id, owner, window): acquire a lock for window
+               seconds - returns whether it was acquired
+           release(lock_id, owner): release a lock (if still owned)"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def acquire(self, lock_id, owner, window):
+        """Acquire a lock (see class description)."""
+        action = (
+            'acquire lock ({lock_id}) in DynamoDB table'
+            ' ({0})'.format(self.table, **locals()))
+        verbose_print('attempting to {action}...'.format(**locals()))
+        now = time.time()
+        try:
+            aws_call(
+                'dynamodb:PutItem', dynamodb_client.put_item,
+                TableName=self.table,
+                Item={
+                    'lock_id': {'S': lock_id},
+                    'owner': {'S': owner},
+                    'expires_at': {'N': str(now + window)}},
+                ConditionExpression=(
+                    'attribute_not_exists(lock_id) OR expires_at < :now'
+                    ' OR #owner = :owner'),
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)}, ':owner': {'S': owner}})
+        except botocore.exceptions.ClientError as e:
+            if (e.response['Error']['Code'] ==
+                    'ConditionalCheckFailedException'):
+                verbose_print('lock ({lock_id}) is held'.format(**locals()))
+                return False
+            raise
+        verbose_print('able to {action}'.format(**locals()))
+        return True
+
+    def release(self, lock_id, owner):
+        """Release a lock (see class description)."""
+        action = (
+            'release lock ({lock_id}) in DynamoDB table'
+            ' ({0})'.format(self.table, **locals()))
+        verbose_print('attempting to {action}...'.format(**locals()))
+        try:
+            aws_call(
+                'dynamodb:DeleteItem', dynamodb_client.delete_item,
+                TableName=self.table,
+                Key={'lock_id': {'S': lock_id}},
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={':owner': {'S': owner}})
+        except botocore.exceptions.ClientError as e:
+            verbose_print('not able to {action}'.format(**locals()))
+            debug_print('exception: {e}'.format(**locals()))
+            return
+        verbose_print('able to {action}'.format(**locals()))
+
+
+class FileLockStore(object):
+    """Instantiate a store of failover locks kept as files in a local
+       directory (a stand-in of 'DynamoDbLockStore' for testing). A lock
+       file is created exclusively and holds the owner and the expiry time
+       of the lock. Sets up the following attributes:
+
+           directory(string): path of the directory of the lock files
+
+           acquire(lock_id, owner, window): acquire a lock for window
+               seconds - returns whether it was acquired
+           release(lock_id, owner): release a lock (if still owned)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, lock_id):
+        """Return the path of the lock file of a lock."""
+        return os.path.join(self.directory, '{0}.lock'.format(lock_id))
+
+    def read(self, lock_id):
+        """Return the lock (dict: owner, expires_at) or None."""
+        try:
+            with open(self.path(lock_id)) as lock_file:
+                return json.load(lock_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def acquire(self, lock_id, owner, window):
+        """Acquire a lock (see class description)."""
+        verbose_print('attempting to acquire lock ({lock_id}) in directory'
+                      ' ({0})...'.format(self.directory, **locals()))
+        now = time.time()
+        lock = self.read(lock_id)
+        if lock and lock.get('owner') != owner:
+            if lock.get('expires_at', 0) >= now:
+                verbose_print('lock ({lock_id}) is held'.format(**locals()))
+                return False
+            # the lock expired: take it over (unless someone else does)
+            try:
+                os.remove(self.path(lock_id))
+            except OSError:
+                pass
+        elif lock:
+            os.remove(self.path(lock_id))
+        try:
+            lock_fd = os.open(
+                self.path(lock_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            verbose_print('lock ({lock_id}) is held'.format(**locals()))
+            return False
+        with os.fdopen(lock_fd, 'w') as lock_file:
+            json.dump({'owner': owner, 'expires_at': now + window}, lock_file)
+        verbose_print('able to acquire lock ({lock_id})'.format(**locals()))
+        return True
+
+    def release(self, lock_id, owner):
+        """Release a lock (see class description)."""
+        lock = self.read(lock_id)
+        if lock and lock.get('owner') == owner:
+            try:
+                os.remove(self.path(lock_id))
+            except OSError:
+                return
+            verbose_print('released lock ({lock_id})'.format(**locals()))
+
+
+def confirm_net_int_attachments(instance_id, net_int_attachments):
+    """Confirm that network interfaces are attached to an instance."""
+    action = (
+        'confirm network interfaces ({0}) are attached'
+        ' to instance ({instance_id})'.format(
+            sorted(net_int_attachments), **locals()))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    unattached_net_int_ids = [
+        ei for ei, attachment in sorted(net_int_attachments.items())
+        if attachment['instance_id'] != instance_id or
+        attachment['status'] != 'attached']
+    if unattached_net_int_ids:
+        debug_print(
+            'network interfaces not attached:'
+            ' {unattached_net_int_ids}'.format(**locals()))
+        sys.exit('exit: not able to {action}'.format(**locals()))
+    verbose_print('able to {action}'.format(**locals()))
+
+
+def run_step(step, parent=None, on_success=None):
+    """Run a single step (timed as a child span of the given span ID) and
+       return its result (dict: name, status, error). Any exit (see the
+       exception handlers) is captured and reported instead of ending the
+       whole failover. If the step succeeds, 'on_success' (if any) is
+       called with its name (e.g. to journal it)."""
+    with timed_span(step['name'], kind='step', parent=parent):
+        try:
+            step['func'](*step['args'])
+        except SystemExit as e:
+            return {'name': step['name'], 'status': 'failed', 'error': str(e)}
+        except Exception as e:
+            return {
+                'name': step['name'], 'status': 'failed', 'error': repr(e)}
+    if on_success:
+        on_success(step['name'])
+    return {
+        'name': step['name'], 'status': 'succeeded', 'error': None,
+        'finished': time.time()}
+
+
+def run_steps(steps, max_workers=MAX_WORKERS, completed=(), on_success=None):
+    """Run steps concurrently in a bounded thread pool honoring their
+       ordering constraints. Each step is a dict containing:
+
+           name(string): unique name of the step
+           func(function): function performing the step
+           args(tuple): arguments to call the function with
+           depends_on(list): names of the steps that must succeed first
+           phase(string): name of the phase the step is timed under
+
+       A step is skipped if any of the steps it depends on do not succeed.
+       Steps already completed (names in 'completed', e.g. journaled by an
+       earlier attempt) are not run again and reported as succeeded. The
+       name of every step that succeeds is passed to 'on_success' (if any).
+       Returns a report (dict) of the 'succeeded', 'failed' and 'skipped'
+       steps (lists of step results)."""
+    action = 'run {0} failover steps'.format(len(steps))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    report = {'succeeded': [], 'failed': [], 'skipped': []}
+    statuses = {}
+    pending = []
+    for step in steps:
+        if step['name'] in completed:
+            verbose_print(
+                'step ({0}) already completed: skipping it'.format(
+                    step['name']))
+            statuses[step['name']] = 'succeeded'
+            report['succeeded'].append({
+                'name': step['name'], 'status': 'succeeded', 'error': None})
+        else:
+            pending.append(step)
+    running = {}
+    # a phase span covers all of its (concurrent) step spans
+    phase_spans = {}
+    for step in steps:
+        phase = step.get('phase', 'steps')
+        if phase not in phase_spans:
+            phase_spans[phase] = start_span(phase, 'phase')
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers) as executor:
+        while pending or running:
+            for step in list(pending):
+                dependency_statuses = [
+                    statuses.get(d) for d in step['depends_on']]
+                if any(ds in ('failed', 'skipped')
+                       for ds in dependency_statuses):
+                    pending.remove(step)
+                    statuses[step['name']] = 'skipped'
+                    report['skipped'].append({
+                        'name': step['name'], 'status': 'skipped',
+                        'error': 'a step it depends on did not succeed'})
+                elif all(ds == 'succeeded' for ds in dependency_statuses):
+                    pending.remove(step)
+                    phase_span = phase_spans[step.get('phase', 'steps')]
+                    running[executor.submit(
+                        run_step, step, phase_span['id'],
+                        on_success)] = step
+            if not running:
+                # nothing left can become ready (unknown dependencies)
+                for step in pending:
+                    statuses[step['name']] = 'skipped'
+                    report['skipped'].append({
+                        'name': step['name'], 'status': 'skipped',
+                        'error': 'a step it depends on does not exist'})
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                result = future.result()
+                statuses[result['name']] = result['status']
+                report[result['status']].append(result)
+    for phase_span in phase_spans.values():
+        step_spans = [
+            span for span in SPANS if span['parent'] == phase_span['id']]
+        if step_spans:
+            phase_span['start'] = min(span['start'] for span in step_spans)
+            phase_span['end'] = max(span['end'] for span in step_spans)
+        else:
+            phase_span['end'] = phase_span['start']
+    verbose_print('able to {action}'.format(**locals()))
+    debug_print(
+        'failover report: {0} succeeded, {1} failed, {2} skipped'.format(
+            *[len(report[r]) for r in ('succeeded', 'failed', 'skipped')]))
+    return report
+
+
+def verify_convergence(plan, report, start_time, timeout=VERIFY_TIMEOUT):
+    """Poll the EIPs and the route tables changed by the succeeded steps of
+       an executed failover plan (concurrently, at exponential intervals)
+       until they have converged or the timeout (or the deadline) is
+       reached. Emits the time to convergence of each EIP and route (since
+       its step finished) and of the whole failover (since the start time)
+       as metrics. Returns a dict: time_to_convergence (ms, None if nothing
+       to verify) and not_converged (list of the changes not converged)."""
+    succeeded = dict((r['name'], r) for r in report['succeeded'])
+    eip_moves = [
+        m for m in plan.eip_moves
+        if FailoverPlan.eip_move_step_name(m) in succeeded]
+    route_replacements = [
+        r for r in plan.route_replacements
+        if FailoverPlan.route_replacement_step_name(r) in succeeded]
+    if not (eip_moves or route_replacements):
+        return {'time_to_convergence': None, 'not_converged': []}
+    action = (
+        'verify convergence of {0} EIP(s) and {1} route(s)'.format(
+            len(eip_moves), len(route_replacements)))
+    verbose_print('attempting to {action}...'.format(**locals()))
+    stop_time = time.time() + timeout
+    if deadline is not None:
+        stop_time = min(stop_time, deadline)
+    parent = current_span_id()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        eip_future = executor.submit(
+            poll_convergence, 'poll EIPs', get_eip_convergence, eip_moves,
+            stop_time, parent)
+        route_future = executor.submit(
+            poll_convergence, 'poll routes', get_route_convergence,
+            route_replacements, stop_time, parent, plan.from_net_int_ids())
+        eips_converged, eips_not_converged = eip_future.result()
+        routes_converged, routes_not_converged = route_future.result()
+    # time to convergence of every change since its step finished
+    metrics = []
+    for name, changes, converged, get_step_name in (
+            ('EipConvergenceDuration', eip_moves, eips_converged,
+             FailoverPlan.eip_move_step_name),
+            ('RouteConvergenceDuration', route_replacements,
+             routes_converged, FailoverPlan.route_replacement_step_name)):
+        durations = []
+        for index, converged_time in sorted(converged.items()):
+            step_name = get_step_name(changes[index])
+            finished = succeeded[step_name].get('finished', start_time)
+            durations.append(max(0, converged_time - finished) * 1000)
+            debug_print(
+                '{step_name}: converged in {0:.0f} ms'.format(
+                    durations[-1], **locals()))
+        if durations:
+            metrics.append((name, durations, 'Milliseconds'))
+    not_converged = eips_not_converged + routes_not_converged
+    time_to_convergence = None
+    if not not_converged:
+        time_to_convergence = (
+            max(list(eips_converged.values()) +
+                list(routes_converged.values())) - start_time) * 1000
+        metrics.append((
+            'TimeToConvergence', time_to_convergence, 'Milliseconds'))
+        verbose_print('able to {action}'.format(**locals()))
+    else:
+        verbose_print('not able to {action}'.format(**locals()))
+        debug_print('not converged: {not_converged}'.format(**locals()))
+    record_metrics(metrics)
+    return {
+        'time_to_convergence': time_to_convergence,
+        'not_converged': not_converged}
+
+
+def poll_convergence(name, get_convergence, changes, stop_time, parent,
+                     *args):
+    """Poll changes (timed as a span) with a function returning which of
+       them have converged (see 'get_eip_convergence') at exponential
+       intervals until they all have or the stop time is reached. Returns
+       (dict of change index to time converged, list of the changes not
+       converged (strings))."""
+    converged = {}
+    problems = {}
+    interval = VERIFY_INTERVAL
+    with timed_span(name, parent=parent):
+        while True:
+            pending = dict(
+                (i, c) for i, c in enumerate(changes) if i not in converged)
+            if not pending:
+                break
+            poll_time = time.time()
+            converged_indexes, problems = get_convergence(pending, *args)
+            for index in converged_indexes:
+                converged[index] = poll_time
+            if len(converged) == len(changes):
+                break
+            if time.time() + interval > stop_time:
+                break
+            time.sleep(interval)
+            interval = min(interval * 2, VERIFY_MAX_INTERVAL)
+    return converged, [
+        problem for index, problem in sorted(problems.items())
+        if index not in converged]
+
+
+def get_eip_convergence(eip_moves):
+    """Return which EIP moves (dict of index to EIP move) have converged
+       (using a single 'describe_addresses' call) as (list of indexes,
+       dict of index to problem of those not converged)."""
+    action = 'describe EIPs ({0})'.format(
+        sorted(m['eip_alloc_id'] for m in eip_moves.values()))
+    try:
+        describe_addresses_output = aws_call(
+            'ec2:DescribeAddresses', ec2_client.describe_addresses,
+            AllocationIds=sorted(
+                set(m['eip_alloc_id'] for m in eip_moves.values())))
+    except (botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError) as e:
+        verbose_print('not able to {action}'.format(**locals()))
+        debug_print('exception: {e}'.format(**locals()))
+        return [], dict(
+            (i, 'EIP ({0}): {1}'.format(m['eip_alloc_id'], e))
+            for i, m in eip_moves.items())
+    addresses = dict(
+        (a.get('AllocationId'), a)
+        for a in describe_addresses_output.get('Addresses', []))
+    converged = []
+    problems = {}
+    for index, eip_move in eip_moves.items():
+        address = addresses.get(eip_move['eip_alloc_id'], {})
+        if (address.get('NetworkInterfaceId') == eip_move['net_int_id'] and
+                address.get('PrivateIpAddress') == eip_move['priv_ip']):
+            converged.append(index)
+        else:
+            problems[index] = (
+                'EIP ({0}) is associated with ({1}) ({2})'.format(
+                    eip_move['eip_alloc_id'],
+                    address.get('NetworkInterfaceId'),
+                    address.get('PrivateIpAddress')))
+    return converged, problems
+
+
+def get_route_convergence(route_replacements, from_net_int_ids):
+    """Return which route replacements (dict of index to route replacement)
+       have converged (using a single 'describe_route_tables' call) as
+       (list of indexes, dict of index to problem of those not converged).
+       A route still targeting a network interface of the instance moved
+       away from is reported as such."""
+    route_table_ids = sorted(
+        set(r['route_table_id'] for r in route_replacements.values()))
+    action = 'describe route tables ({route_table_ids})'.format(**locals())
+    try:
+        describe_route_tables_output = aws_call(
+            'ec2:DescribeRouteTables', ec2_client.describe_route_tables,
+            RouteTableIds=route_table_ids)
+    except (botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError) as e:
+        verbose_print('not able to {action}'.format(**locals()))
+        debug_print('exception: {e}'.format(**locals()))
+        return [], dict(
+            (i, 'route table ({0}): {1}'.format(r['route_table_id'], e))
+            for i, r in route_replacements.items())
+    routes = {}
+    for route_table in describe_route_tables_output.get('RouteTables', []):
+        for route in route_table.get('Routes', []):
+            routes[(
+                route_table['RouteTableId'],
+                tuple(sorted(get_route_destination(route).items())))] = route
+    converged = []
+    problems = {}
+    for index, route_replacement in route_replacements.items():
+        destination = (
+            route_replacement.get('destination') or
+            {'DestinationCidrBlock': '0.0.0.0/0'})
+        route = routes.get((
+            route_replacement['route_table_id'],
+            tuple(sorted(destination.items()))), {})
+        target = route.get('NetworkInterfaceId')
+        if target == route_replacement['net_int_id']:
+            converged.append(index)
+        else:
+            problems[index] = (
+                'route ({0}) of ({1}) {2} ({3})'.format(
+                    list(destination.values())[0],
+                    route_replacement['route_table_id'],
+                    'still targets the failed network interface'
+                    if target in from_net_int_ids else 'targets', target))
+    return converged, problems
+
+
+def set_up(verbose, debug, dry_run, services=('ec2',)):
+    """Set up verbose/debug printing and the AWS service clients."""
     global ec2_client
+    global ssm_client
+    global dynamodb_client
     global verbose_print
     global debug_print
     # set up verbose printing
-    if verbose:
-        def verbose_print(*args):
-            print('info:', *args)
-        verbose_print('verbosity turned on')
-    else:
-        verbose_print = lambda *a: None    # do nothing function
+    verbose_print = print_info if verbose else print_nothing
+    verbose_print('verbosity turned on')
     # set up debug printing
-    if debug:
-        def debug_print(*args):
-            print('debug:', *args)
-        debug_print('debug turned on')
-    else:
-        debug_print = lambda *a: None    # do nothing function
+    debug_print = print_debug if debug else print_nothing
+    debug_print('debug turned on')
     if dry_run:
         verbose_print('performing dry-run')
-    # connect to the AWS EC2 service
-    ec2_client = create_boto_service_client('ec2')
-    # get the failed instance description (using instance id)
-    failed_instance = Ec2Instance.from_instance_id(failed_pa_instance_id)
+    # connect to the AWS services
+    if 'ec2' in services:
+        ec2_client = get_boto_service_client('ec2')
+    if 'ssm' in services:
+        ssm_client = get_boto_service_client('ssm')
+    if 'dynamodb' in services:
+        dynamodb_client = get_boto_service_client('dynamodb')
+
+
+def execute_failover(plan, dry_run, journal=None):
+    """Execute a failover plan (journaling its progress if a journal is
+       given, see 'FailoverJournal'). Returns a result string describing
+       actual action taken."""
+    if journal and journal.plan is None:
+        journal.start(plan)
+    start_time = time.time()
+    with timed_span('execute'):
+        report = plan.execute(dry_run, journal)
+    if journal and not (report['failed'] or report['skipped']):
+        journal.finish()
+    convergence = None
+    if not dry_run:
+        with timed_span('verify'):
+            convergence = verify_convergence(plan, report, start_time)
+    if convergence and convergence['not_converged']:
+        return (
+            'partially failed over primary Palo Alto'
+            ' from ({0}) to ({1}): {2} change(s) did not converge: {3}'.format(
+                plan.from_instance_id, plan.to_instance_id,
+                len(convergence['not_converged']),
+                '; '.join(convergence['not_converged'])))
+    if report['failed'] or report['skipped']:
+        return (
+            'partially failed over primary Palo Alto'
+            ' from ({0}) to ({1}): {2} step(s) failed: {3}'.format(
+                plan.from_instance_id, plan.to_instance_id,
+                len(report['failed']) + len(report['skipped']),
+                '; '.join(
+                    '{name}: {error}'.format(**r) for r in
+                    report['failed'] + report['skipped'])))
+    elif dry_run:
+        return (
+            'dry-run: did not failover primary Palo Alto'
+            ' from ({0}) to ({1})'.format(
+                plan.from_instance_id, plan.to_instance_id))
+    elif convergence and convergence['time_to_convergence'] is not None:
+        return (
+            'failed over primary Palo Alto'
+            ' from ({0}) to ({1}) (converged in {2:.0f} ms)'.format(
+                plan.from_instance_id, plan.to_instance_id,
+                convergence['time_to_convergence']))
+    else:
+        return (
+            'failed over primary Palo Alto'
+            ' from ({0}) to ({1})'.format(
+                plan.from_instance_id, plan.to_instance_id))
+
+
+def prepare(plan_parameter, verbose=True, debug=True):
+    """Prepare the failover plan of the current primary Palo Alto and store
+       it in an SSM parameter (to be run on a schedule). Returns a result
+       string describing actual action taken."""
+    set_up(verbose, debug, False, services=('ec2', 'ssm'))
+    with timed_span('prepare'):
+        return prepare_failover_plan(plan_parameter)
+
+
+def prepare_failover_plan(plan_parameter):
+    """Prepare and store the failover plan (see 'prepare')."""
+    with timed_span('discover'):
+        # get all the Palo Alto instance descriptions (single call)
+        descriptions = get_firewall_descriptions()
+        primary_instance_ids = [
+            d['InstanceId'] for d in descriptions
+            if {'Key': 'Primary', 'Value': 'true'} in d.get('Tags', [])]
+        if len(primary_instance_ids) != 1:
+            return (
+                'can not prepare failover plan: found {0}'
+                ' primary instances'.format(len(primary_instance_ids)))
+        primary_instance, standby_instance = Ec2Instance.from_failover_pair(
+            primary_instance_ids[0], descriptions)
+    with timed_span('plan'):
+        plan = FailoverPlan.from_instances(primary_instance, standby_instance)
+    with timed_span('store'):
+        store_failover_plan(plan, plan_parameter)
+    return (
+        'prepared failover plan of primary Palo Alto'
+        ' from ({0}) to ({1}) in SSM parameter ({2})'.format(
+            plan.from_instance_id, plan.to_instance_id, plan_parameter))
+
+
+def main(failed_pa_instance_id, verbose=True, debug=True, dry_run=False,
+         plan_parameter=None, journal_table=None, lock_table=None,
+         lock_dir=None, lock_owner=None):
+    """Main function to perform all steps highlighted in description.
+       If an SSM parameter is given and the failover plan prepared in it
+       (see 'prepare') still matches the topology, the plan is executed
+       without any discovery (fast mode).
+       If a DynamoDB table is given, the progress of the failover is
+       journaled in it and an incomplete failover of the same instance is
+       resumed (see 'FailoverJournal').
+       If a DynamoDB table (or a local directory) is given, the failover
+       of the instance is locked in it (for LOCK_WINDOW seconds) so that
+       duplicate events of the same failure are short-circuited, unless
+       they come from the same owner (e.g. a retried Lambda request).
+       Returns a result string describing actual action taken."""
+    set_up(
+        verbose, debug, dry_run,
+        services=get_failover_services(
+            dry_run, plan_parameter, journal_table, lock_table))
+    with timed_span('failover'):
+        return locked_failover(
+            failed_pa_instance_id, dry_run, plan_parameter, journal_table,
+            get_lock_store(dry_run, lock_table, lock_dir), lock_owner)
+
+
+def get_failover_services(dry_run, plan_parameter=None, journal_table=None,
+                          lock_table=None):
+    """Return the AWS services used by a failover (see 'main')."""
+    services = ['ec2']
+    if plan_parameter:
+        services.append('ssm')
+    if not dry_run and (journal_table or lock_table):
+        services.append('dynamodb')
+    return services
+
+
+def get_lock_store(dry_run, lock_table=None, lock_dir=None):
+    """Return the store of the failover locks (see 'main') or None."""
+    if dry_run:
+        return None
+    if lock_table:
+        return DynamoDbLockStore(lock_table)
+    if lock_dir:
+        return FileLockStore(lock_dir)
+    return None
+
+
+def locked_failover(failed_pa_instance_id, dry_run, plan_parameter=None,
+                    journal_table=None, lock_store=None, lock_owner=None):
+    """Fail over (see 'failover') holding the failover lock of the failed
+       instance if a lock store is given (see 'main'). Returns a result
+       string describing actual action taken."""
+    if lock_store:
+        lock_owner = lock_owner or uuid.uuid4().hex
+        with timed_span('deduplicate'):
+            try:
+                locked = lock_store.acquire(
+                    failed_pa_instance_id, lock_owner, LOCK_WINDOW)
+            except (botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError) as e:
+                # fail open: a duplicate failover beats no failover
+                verbose_print('not able to acquire the failover lock')
+                debug_print('exception: {e}'.format(**locals()))
+                lock_store = None
+                locked = True
+        if not locked:
+            record_metrics([('DuplicateEvents', 1, 'Count')])
+            return (
+                'not failing over: failover of instance ({0}) already'
+                ' in progress or done (duplicate event)'.format(
+                    failed_pa_instance_id))
+    result = None
+    try:
+        result = failover(
+            failed_pa_instance_id, dry_run, plan_parameter, journal_table)
+        return result
+    finally:
+        # keep the lock only if the failover is done (or not needed)
+        # so that a retry of a failed failover is not short-circuited
+        if lock_store and not (result and result.startswith(
+                ('failed over', 'not failing over'))):
+            lock_store.release(failed_pa_instance_id, lock_owner)
+
+
+def probe(verbose=True, debug=True, dry_run=False, interval=PROBE_INTERVAL,
+          threshold=PROBE_THRESHOLD, duration=None, plan_parameter=None,
+          journal_table=None, lock_table=None, lock_dir=None,
+          lock_owner=None):
+    """Probe the health of the Palo Alto pairs (status checks and network
+       interface attachments) every interval seconds for duration seconds
+       (forever if None, at least once) and fail over (see 'main') the pairs whose primary
+       fails threshold consecutive probes while their standby is healthy
+       (concurrently). Returns a result string describing actual action
+       taken."""
+    set_up(
+        verbose, debug, dry_run,
+        services=get_failover_services(
+            dry_run, plan_parameter, journal_table, lock_table))
+    lock_store = get_lock_store(dry_run, lock_table, lock_dir)
+    stop_time = None if duration is None else time.time() + duration
+    probes = 0
+    failed_probes = 0
+    failures = {}
+    first_failure_times = {}
+    while True:
+        probe_time = time.time()
+        probes += 1
+        # keep the spans of the current probe only (long running loop)
+        reset_spans()
+        try:
+            pairs_health = probe_pairs_health()
+        except SystemExit as e:
+            # not being able to probe is not a failure of the primaries
+            verbose_print('not able to probe: {e}'.format(**locals()))
+            pairs_health = []
+        failed_over_ids = []
+        for primary_id, primary_problems, standby_problems in pairs_health:
+            if not primary_problems:
+                failures.pop(primary_id, None)
+                first_failure_times.pop(primary_id, None)
+                continue
+            failed_probes += 1
+            failures[primary_id] = failures.get(primary_id, 0) + 1
+            first_failure_times.setdefault(primary_id, probe_time)
+            verbose_print(
+                'primary ({primary_id}) failed probe ({0}/{threshold}):'
+                ' {1}'.format(
+                    failures[primary_id], '; '.join(primary_problems),
+                    **locals()))
+            if failures[primary_id] < threshold:
+                continue
+            if standby_problems:
+                verbose_print(
+                    'not failing over ({primary_id}): standby is not'
+                    ' healthy: {0}'.format(
+                        '; '.join(standby_problems), **locals()))
+                continue
+            record_metrics([(
+                'ProbeDetectionDuration',
+                (time.time() - first_failure_times[primary_id]) * 1000,
+                'Milliseconds')])
+            failed_over_ids.append(primary_id)
+        if failed_over_ids:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(failed_over_ids)) as executor:
+                results = list(executor.map(
+                    lambda primary_id: locked_failover(
+                        primary_id, dry_run, plan_parameter, journal_table,
+                        lock_store, lock_owner),
+                    failed_over_ids))
+            return '; '.join(results)
+        if stop_time is not None and time.time() >= stop_time:
+            break
+        sleep_time = probe_time + interval - time.time()
+        if stop_time is not None:
+            sleep_time = min(sleep_time, stop_time - time.time())
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+    return (
+        'not failing over: {0} of {1} probes of the primaries failed'.format(
+            failed_probes, probes))
+
+
+def failback(verbose=True, debug=True, dry_run=False,
+             maintenance_window=MAINTENANCE_WINDOW):
+    """Fail back (concurrently) the Palo Alto pairs with a recovered
+       instance (tag FailbackPending:true) - once it is healthy and, if a
+       maintenance window is given, within it - using the same planner as
+       the failover. Returns a result string describing actual action
+       taken."""
+    set_up(verbose, debug, dry_run)
+    if maintenance_window:
+        try:
+            in_window = in_maintenance_window(maintenance_window)
+        except ValueError as e:
+            return 'failed: cannot fail back: {e}'.format(**locals())
+        if not in_window:
+            return (
+                'not failing back: outside of the maintenance window'
+                ' ({maintenance_window})'.format(**locals()))
+    with timed_span('failback') as failback_span:
+        with timed_span('discover'):
+            pairs, results = get_failback_pairs()
+        if pairs:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(len(pairs), MAX_WORKERS)) as executor:
+                results.extend(executor.map(
+                    lambda pair: fail_back_pair(
+                        pair[0], pair[1], dry_run, failback_span['id']),
+                    pairs))
+    if not results:
+        return 'not failing back: no instance pending failback'
+    return '; '.join(results)
+
+
+def get_failback_pairs():
+    """Get the Palo Alto pairs to fail back with two calls (instance
+       descriptions and statuses). Returns the list of (primary, recovered)
+       Ec2Instances of the pairs to fail back and the list of result
+       strings of the pairs not to fail back (yet)."""
+    pairs = []
+    results = []
+    for pair_id, descriptions in sorted(
+            get_firewall_pairs(get_firewall_descriptions()).items()):
+        try:
+            instances = [Ec2Instance(d) for d in descriptions]
+        except SystemExit as e:
+            # e.g. a terminated instance (without network interfaces)
+            results.append(
+                'can not fail back pair ({pair_id}): {e}'.format(**locals()))
+            continue
+        recovered = [
+            i for i in instances if not i.is_primary and
+            {'Key': FAILBACK_TAG, 'Value': 'true'} in i.tags]
+        if not recovered:
+            continue
+        primaries = [i for i in instances if i.is_primary]
+        if len(primaries) != 1 or len(recovered) != 1:
+            results.append(
+                'can not fail back pair ({pair_id}): found {0} primary and'
+                ' {1} recovered instances'.format(
+                    len(primaries), len(recovered), **locals()))
+            continue
+        pairs.append((primaries[0], recovered[0]))
+    if not pairs:
+        return pairs, results
+    instance_statuses = get_instance_statuses([r.id for _, r in pairs])
+    healthy_pairs = []
+    for primary, recovered in pairs:
+        problems = recovered.get_health_problems(
+            instance_statuses.get(recovered.id, {}))
+        if problems:
+            results.append(
+                'not failing back to ({0}): not healthy: {1}'.format(
+                    recovered.id, '; '.join(problems)))
+        else:
+            healthy_pairs.append((primary, recovered))
+    return healthy_pairs, results
+
+
+def fail_back_pair(primary, recovered, dry_run, parent=None):
+    """Fail back from the primary to the recovered instance of a pair (see
+       'failback'). Returns a result string describing actual action
+       taken."""
+    try:
+        with timed_span('plan', parent=parent):
+            plan = FailoverPlan.from_instances(
+                primary, recovered, failback=True)
+        return 'failback: {0}'.format(execute_failover(plan, dry_run))
+    except SystemExit as e:
+        return 'failed: cannot fail back to ({0}): {e}'.format(
+            recovered.id, **locals())
+
+
+def probe_pairs_health():
+    """Probe the health of the Palo Alto pairs (see 'get_firewall_pairs')
+       with two calls (instance descriptions and statuses). Returns a list
+       of (primary ID, primary problems, standby problems) - see
+       'Ec2Instance.get_health_problems' - of the pairs with a single
+       primary and standby."""
+    pairs = []
+    for pair_id, descriptions in sorted(
+            get_firewall_pairs(get_firewall_descriptions()).items()):
+        try:
+            instances = [Ec2Instance(d) for d in descriptions]
+        except SystemExit as e:
+            # e.g. a terminated instance (without network interfaces)
+            verbose_print(
+                'not probing pair ({pair_id}): {e}'.format(**locals()))
+            continue
+        primaries = [i for i in instances if i.is_primary]
+        standbys = [i for i in instances if not i.is_primary]
+        if len(primaries) != 1 or len(standbys) != 1:
+            verbose_print(
+                'not probing pair ({pair_id}): found {0} primary and {1}'
+                ' standby instances'.format(
+                    len(primaries), len(standbys), **locals()))
+            continue
+        pairs.append((primaries[0], standbys[0]))
+    if not pairs:
+        return []
+    instance_statuses = get_instance_statuses(
+        [i.id for pair in pairs for i in pair])
+    return [(
+        primary.id,
+        primary.get_health_problems(instance_statuses.get(primary.id, {})),
+        standby.get_health_problems(instance_statuses.get(standby.id, {})))
+        for primary, standby in pairs]
+
+
+def failover(failed_pa_instance_id, dry_run, plan_parameter=None,
+             journal_table=None):
+    """Fail over from the failed instance (if it is the primary) to the
+       standby (see 'main'). Returns a result string describing actual
+       action taken."""
+    journal = None
+    if journal_table and not dry_run:
+        journal = FailoverJournal(journal_table, failed_pa_instance_id)
+        with timed_span('discover'):
+            resuming = journal.load()
+        if resuming:
+            # the Primary tags may already be swapped: follow the journal
+            verbose_print(
+                'failing over: resuming the incomplete failover'
+                ' of the failed instance')
+            return execute_failover(journal.plan, dry_run, journal)
+    if plan_parameter:
+        with timed_span('discover'):
+            # use the prepared failover plan if it is still valid
+            plan = load_failover_plan(plan_parameter)
+            plan_is_valid = bool(
+                plan and plan.from_instance_id == failed_pa_instance_id and
+                plan.verify())
+        if plan_is_valid:
+            verbose_print(
+                'failing over: failed instance is the primary'
+                ' & the prepared failover plan is valid')
+            return execute_failover(plan, dry_run, journal)
+        verbose_print('not using the prepared failover plan')
+    with timed_span('discover'):
+        # get the failed and the standby instance descriptions (single call)
+        failed_instance, standby_instance = (
+            Ec2Instance.from_failover_pair(failed_pa_instance_id))
     if failed_instance.is_primary:
-        # get the standby instance information (using Primary tag == false)
-        standby_instance = Ec2Instance.from_tags()
         if standby_instance:
             verbose_print(
                 'failing over:'
                 ' failed instance is the primary & found the standby')
-            # move eips over
-            move_eips(failed_instance, standby_instance, dry_run)
-            # swap Primary tags
-            failed_instance.update_tag('Primary', 'false', dry_run)
-            standby_instance.update_tag('Primary', 'true', dry_run)
-            # update the route tables
-            for ni in 'eth2', 'eth3':
-                for subnet_id in (
-                        failed_instance.network_interfaces[ni]['subnet_id'],
-                        standby_instance.network_interfaces[ni]['subnet_id']):
-                    route_table_id = get_route_id(subnet_id)
-                    replace_route(
-                        route_table_id,
-                        standby_instance.network_interfaces[ni]['eni_id'],
-                        dry_run)
-            if dry_run:
-                return (
-                    'dry-run: did not failover primary Palo Alto'
-                    ' from ({0}) to ({1})'.format(
-                        failed_instance.id, standby_instance.id))
-            else:
-                return (
-                    'failed over primary Palo Alto'
-                    ' from ({0}) to ({1})'.format(
-                        failed_instance.id, standby_instance.id))
+            with timed_span('plan'):
+                # plan the eip moves, Primary tag swaps and route replacements
+                plan = FailoverPlan.from_instances(
+                    failed_instance, standby_instance)
+            # perform the planned changes
+            return execute_failover(plan, dry_run, journal)
         else:
             return 'can not fail over: unknown state'
     else:
         return 'not failing over: failed instance is not the primary'
 
 
+def create_boto_service_clients(services):
+    """Create the AWS service clients once per Lambda container (at import
+       time) so that warm invocations skip the client creation and endpoint
+       resolution. A client that can not be created yet is created (or
+       reported) when first used instead (see 'get_boto_service_client')."""
+    for service in services:
+        try:
+            BOTO_SERVICE_CLIENTS[service] = boto3.client(
+                service_name=service, config=BOTO_CONFIG,
+                endpoint_url=BOTO_ENDPOINT_URLS.get(service))
+        except botocore.exceptions.BotoCoreError:
+            pass
+
+
+create_boto_service_clients(get_failover_services(
+    False, PLAN_PARAMETER, JOURNAL_TABLE, LOCK_TABLE))
+# time the Lambda container initialization completed
+INIT_TIME = time.time()
+
+
 if __name__ == '__main__':
     """Checks if this script has be run directly (e.g. via command line),
        if so verifies usage and calls main()"""
@@ -780,8 +2944,66 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=parser_description)
     parser.add_argument(
         '-f', '--failed-pa-instance-id',
-        required=True,
         help='EC2 Instance ID of the failed Palo Alto server')
+    parser.add_argument(
+        '-p', '--plan-parameter',
+        default=PLAN_PARAMETER,
+        help='SSM parameter to store/load the prepared failover plan'
+             ' (default: $PA_FAILOVER_PLAN_PARAMETER)')
+    parser.add_argument(
+        '--prepare',
+        action='store_true',
+        default=False,
+        help='prepare the failover plan and store it in the SSM parameter')
+    parser.add_argument(
+        '--failback',
+        action='store_true',
+        default=False,
+        help='fail back to the recovered (FailbackPending) instances')
+    parser.add_argument(
+        '--maintenance-window',
+        default=MAINTENANCE_WINDOW,
+        help='UTC window to fail back in: ddd:hh:mm-ddd:hh:mm or'
+             ' hh:mm-hh:mm (default: $PA_FAILOVER_MAINTENANCE_WINDOW)')
+    parser.add_argument(
+        '--probe',
+        action='store_true',
+        default=False,
+        help='probe the health of the Palo Alto pair and fail over when'
+             ' the primary fails')
+    parser.add_argument(
+        '--probe-interval',
+        type=float, default=PROBE_INTERVAL,
+        help='seconds between probes (default: $PA_FAILOVER_PROBE_INTERVAL'
+             ' or 10)')
+    parser.add_argument(
+        '--probe-threshold',
+        type=int, default=PROBE_THRESHOLD,
+        help='consecutive failed probes triggering a failover'
+             ' (default: $PA_FAILOVER_PROBE_THRESHOLD or 3)')
+    parser.add_argument(
+        '--probe-duration',
+        type=float,
+        help='seconds to probe for (default: forever)')
+    parser.add_argument(
+        '-j', '--journal-table',
+        default=JOURNAL_TABLE,
+        help='DynamoDB table to journal the failover progress in'
+             ' (default: $PA_FAILOVER_JOURNAL_TABLE)')
+    parser.add_argument(
+        '--lock-table',
+        default=LOCK_TABLE,
+        help='DynamoDB table to lock the failover in'
+             ' (default: $PA_FAILOVER_LOCK_TABLE)')
+    parser.add_argument(
+        '--lock-dir',
+        default=LOCK_DIR,
+        help='local directory to lock the failover in (for testing)'
+             ' (default: $PA_FAILOVER_LOCK_DIR)')
+    parser.add_argument(
+        '-t', '--timeout',
+        type=float, default=60,
+        help='seconds to keep retrying throttled or failed AWS API calls')
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -796,11 +3018,45 @@ if __name__ == '__main__':
         default=False,
         help='do not execute the commands - perform a dry-run')
     args = parser.parse_args()
+    if args.prepare and not args.plan_parameter:
+        parser.error('--prepare requires -p/--plan-parameter')
+    if args.prepare + args.probe + args.failback > 1:
+        parser.error(
+            '--prepare, --probe and --failback are mutually exclusive')
+    if args.maintenance_window:
+        try:
+            in_maintenance_window(args.maintenance_window)
+        except ValueError as e:
+            parser.error(str(e))
+    if (not (args.prepare or args.probe or args.failback) and
+            not args.failed_pa_instance_id):
+        parser.error('-f/--failed-pa-instance-id is required')
     # set up vars
     failed_inst_id = args.failed_pa_instance_id
+    plan_parameter = args.plan_parameter
+    journal_table = args.journal_table
+    lock_table = args.lock_table
+    lock_dir = args.lock_dir
     verbose = args.verbose
     debug = args.debug
     dry_run = args.dry_run
-    # call main() and grab/print the result
-    result = main(failed_inst_id, verbose, debug, dry_run)
+    set_deadline(args.timeout)
+    # call prepare(), failback(), probe() or main() and grab/print the result
+    if args.prepare:
+        result = prepare(plan_parameter, verbose, debug)
+    elif args.failback:
+        result = failback(verbose, debug, dry_run, args.maintenance_window)
+    elif args.probe:
+        result = probe(
+            verbose, debug, dry_run, args.probe_interval,
+            args.probe_threshold, args.probe_duration,
+            plan_parameter=plan_parameter, journal_table=journal_table,
+            lock_table=lock_table, lock_dir=lock_dir)
+    else:
+        result = main(
+            failed_inst_id, verbose, debug, dry_run, plan_parameter,
+            journal_table, lock_table, lock_dir)
+    # show where the time went
+    if verbose:
+        print_span_summary()
     print(result)
@@ -0,0 +1,692 @@
+#!/usr/bin/env python
+"""
+    Description:
+        Offline benchmark and simulation harness for pa_failover.py.
+
+        Runs the full failover (pa_failover.main) against an in-process
+        stand-in of the AWS EC2 (and SSM) API - no AWS account or Palo Alto
+        instances needed. The stand-in keeps the state of a generated
+        topology (a primary and a standby Palo Alto instance, their network
+        interfaces, EIPs and route tables) and applies the changes made by
+        the failover, so every run starts from a fresh topology.
+
+        Every stand-in API call can be given a latency (with jitter) and a
+        probability of being throttled (RequestLimitExceeded) or of failing
+        (InternalError) to see how the failover behaves under API pressure.
+
+        For each topology (network interfaces per instance and extra
+        subnets routed via the primary) the benchmark reports:
+            - the total failover time (p50, p95, p99 and max)
+            - the number of calls per AWS API (per run)
+            - the number of calls made before the first change
+            - the number of successful runs
+            - the number of attempts per run (see --retries and --journal)
+
+        With --check-probe it instead checks that the probe (see
+        pa_failover.probe) fails over in the edge cases of the tagging and
+        of the instance states (e.g. an instance without the Primary tag or
+        a primary shutting down) and exits non-zero if it does not.
+
+    Usage:
+        pa_failover_benchmark.py [-h] [-e ENIS [ENIS ...]]
+                                 [-s SUBNETS [SUBNETS ...]] [-n RUNS]
+                                 [-l LATENCY_MS] [-j JITTER_MS]
+                                 [-t THROTTLE_RATE] [-r ERROR_RATE]
+                                 [--retries RETRIES] [--journal]
+                                 [--seed SEED] [--json] [--check-probe]
+
+        benchmark pa_failover.py against a stand-in EC2 backend
+
+        optional arguments:
+          -h, --help          show this help message and exit
+          -e ENIS [ENIS ...], --enis ENIS [ENIS ...]
+                              network interfaces per instance to benchmark
+                              (at least 4: eth2/eth3 are routed)
+                              (default: 4 8 16)
+          -s SUBNETS [SUBNETS ...], --subnets SUBNETS [SUBNETS ...]
+                              extra subnets routed via the primary to
+                              benchmark (default: 0 16 64)
+          -n RUNS, --runs RUNS
+                              failover runs per topology (default: 20)
+          -l LATENCY_MS, --latency-ms LATENCY_MS
+                              latency of each API call (default: 20)
+          -j JITTER_MS, --jitter-ms JITTER_MS
+                              maximum random extra latency (default: 10)
+          -t THROTTLE_RATE, --throttle-rate THROTTLE_RATE
+                              probability of an API call being throttled
+                              (default: 0.0)
+          -r ERROR_RATE, --error-rate ERROR_RATE
+                              probability of an API call failing
+                              (default: 0.0)
+          --retries RETRIES   retries of a run that does not fail over
+                              completely (default: 0)
+          --journal           journal the failover progress (resume on
+                              retry)
+          --seed SEED         random seed (default: 0)
+          --json              output the results as JSON
+          --check-probe       check the probe edge cases instead
+"""
+
+from __future__ import print_function
+import argparse
+import collections
+import copy
+import json
+import math
+import random
+import sys
+import threading
+import time
+import botocore.exceptions
+import pa_failover
+
+# AWS API calls which change the topology
+MUTATING_OPERATIONS = ('AssociateAddress', 'CreateTags', 'ReplaceRoute')
+
+
+class StandInAwsBackend(object):
+    """Instantiate an in-process stand-in of the AWS EC2, SSM and DynamoDB
+       APIs used by pa_failover.py holding a generated topology. Sets up the
+       following attributes:
+
+           instances(dict): instance descriptions by instance ID
+           network_interfaces(dict): ENI descriptions by ENI ID
+           route_tables(dict): route table descriptions by route table ID
+           parameters(dict): SSM parameter values by name
+           items(dict): DynamoDB items (failover journals) by key
+           impaired(set): IDs of the instances failing their status checks
+           calls(list): (operation, time) of every API call made
+
+           from_topology(enis, subnets): generate a primary/standby pair
+           count_calls(): number of calls per operation
+           calls_before_first_change(): number of calls before the first
+               mutating call."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, throttle_rate=0.0,
+                 error_rate=0.0, rng=None):
+        """Instantiates a StandInAwsBackend object"""
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.rng = rng or random.Random()
+        self.instances = {}
+        self.network_interfaces = {}
+        self.route_tables = {}
+        self.parameters = {}
+        self.items = {}
+        self.impaired = set()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_topology(cls, enis, subnets, **kwargs):
+        """Generate a primary (i-primary) and standby (i-standby) Palo Alto
+           pair with the given number of network interfaces each (each in
+           its own subnet, with an EIP on every private IP of the primary
+           but eth0) and extra subnets routed via the primary's eth2/eth3."""
+        backend = cls(**kwargs)
+        for inst_no, (instance_id, primary) in enumerate(
+                (('i-primary', 'true'), ('i-standby', 'false'))):
+            instance_nis = []
+            for device_index in range(enis):
+                net_int_id = 'eni-{0}-{1}'.format(instance_id, device_index)
+                subnet_id = 'subnet-{0}-{1}'.format(instance_id, device_index)
+                private_ips = []
+                for pip_no in range(2):
+                    private_ip = {
+                        'Primary': pip_no == 0,
+                        'PrivateIpAddress': '10.{0}.{1}.{2}'.format(
+                            device_index, inst_no, pip_no + 10)}
+                    if primary == 'true' and device_index != 0:
+                        private_ip['Association'] = {
+                            'AllocationId': 'eipalloc-{0}-{1}'.format(
+                                device_index, pip_no),
+                            'PublicIp': '198.51.{0}.{1}'.format(
+                                device_index, pip_no)}
+                    private_ips.append(private_ip)
+                network_interface = {
+                    'Attachment': {
+                        'DeviceIndex': device_index,
+                        'InstanceId': instance_id,
+                        'Status': 'attached'},
+                    'NetworkInterfaceId': net_int_id,
+                    'PrivateIpAddresses': private_ips,
+                    'Status': 'in-use',
+                    'SubnetId': subnet_id,
+                    'VpcId': 'vpc-benchmark'}
+                backend.network_interfaces[net_int_id] = network_interface
+                instance_nis.append(network_interface)
+                backend.add_route_table(
+                    subnet_id, 'eni-i-primary-{0}'.format(device_index))
+            backend.instances[instance_id] = {
+                'InstanceId': instance_id,
+                'NetworkInterfaces': instance_nis,
+                'State': {'Name': 'running'},
+                'Tags': [
+                    {'Key': 'Name', 'Value': 'pa-{0}'.format(inst_no + 1)},
+                    {'Key': 'Primary', 'Value': primary},
+                    {'Key': 'Role', 'Value': 'Firewall'}],
+                'VpcId': 'vpc-benchmark'}
+        for subnet_no in range(subnets):
+            backend.add_route_table(
+                'subnet-app-{0}'.format(subnet_no),
+                'eni-i-primary-{0}'.format(2 + subnet_no % 2))
+        return backend
+
+    def add_route_table(self, subnet_id, net_int_id):
+        """Add a route table for a subnet with the default route to an ENI."""
+        route_table_id = 'rtb-{0}'.format(subnet_id[len('subnet-'):])
+        self.route_tables[route_table_id] = {
+            'Associations': [{
+                'Main': False,
+                'RouteTableId': route_table_id,
+                'SubnetId': subnet_id}],
+            'RouteTableId': route_table_id,
+            'Routes': [
+                {'DestinationCidrBlock': '10.0.0.0/8',
+                 'GatewayId': 'local', 'State': 'active'},
+                {'DestinationCidrBlock': '0.0.0.0/0',
+                 'NetworkInterfaceId': net_int_id, 'State': 'active'}],
+            'VpcId': 'vpc-benchmark'}
+
+    def call(self, operation):
+        """Record an API call and simulate its latency, throttling and
+           errors."""
+        with self.lock:
+            self.calls.append((operation, time.time()))
+            throttled = self.rng.random() < self.throttle_rate
+            failed = self.rng.random() < self.error_rate
+            latency_ms = (
+                self.latency_ms + self.rng.random() * self.jitter_ms)
+        time.sleep(latency_ms / 1000.0)
+        if throttled:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'RequestLimitExceeded',
+                           'Message': 'Request limit exceeded.'}},
+                operation)
+        if failed:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InternalError',
+                           'Message': 'An internal error has occurred.'}},
+                operation)
+
+    def count_calls(self):
+        """Return the number of calls per operation (dict)."""
+        return dict(collections.Counter(op for op, _ in self.calls))
+
+    def calls_before_first_change(self):
+        """Return the number of calls made before the first mutating call."""
+        for call_no, (operation, _) in enumerate(self.calls):
+            if operation in MUTATING_OPERATIONS:
+                return call_no
+        return len(self.calls)
+
+    @staticmethod
+    def dry_run_check(kwargs, operation):
+        """Raise DryRunOperation for dry-run calls (as EC2 does)."""
+        if kwargs.get('DryRun'):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'DryRunOperation',
+                           'Message': 'Request would have succeeded.'}},
+                operation)
+
+    @staticmethod
+    def filtered(items, filters, matchers):
+        """Return the items matching all the (supported) filters."""
+        for f in filters or []:
+            matcher = matchers.get(f['Name'])
+            if matcher is None and f['Name'].startswith('tag:'):
+                tag = f['Name'][len('tag:'):]
+                items = [
+                    i for i in items
+                    if any(t['Key'] == tag and t['Value'] in f['Values']
+                           for t in i.get('Tags', []))]
+            elif matcher is not None:
+                items = [i for i in items if matcher(i, f['Values'])]
+        return items
+
+    @staticmethod
+    def paginated(items, key, kwargs):
+        """Return a page of items (MaxResults/NextToken)."""
+        start = int(kwargs.get('NextToken') or 0)
+        max_results = kwargs.get('MaxResults') or len(items) or 1
+        output = {key: copy.deepcopy(items[start:start + max_results])}
+        if start + max_results < len(items):
+            output['NextToken'] = str(start + max_results)
+        return output
+
+    # EC2 API
+
+    def describe_instances(self, **kwargs):
+        """Stand-in of ec2.describe_instances."""
+        self.call('DescribeInstances')
+        instances = [
+            i for i in self.instances.values()
+            if not kwargs.get('InstanceIds') or
+            i['InstanceId'] in kwargs['InstanceIds']]
+        instances = self.filtered(instances, kwargs.get('Filters'), {
+            'instance-state-name':
+                lambda i, v: i['State']['Name'] in v,
+            'vpc-id':
+                lambda i, v: i['VpcId'] in v})
+        return {'Reservations': [
+            {'Instances': [copy.deepcopy(i)]} for i in instances]}
+
+    def describe_addresses(self, **kwargs):
+        """Stand-in of ec2.describe_addresses (by AllocationIds)."""
+        self.call('DescribeAddresses')
+        addresses = []
+        with self.lock:
+            for ni in self.network_interfaces.values():
+                for pip in ni['PrivateIpAddresses']:
+                    association = pip.get('Association', {})
+                    if association.get('AllocationId') in kwargs.get(
+                            'AllocationIds', []):
+                        addresses.append({
+                            'AllocationId': association['AllocationId'],
+                            'NetworkInterfaceId': ni['NetworkInterfaceId'],
+                            'PrivateIpAddress': pip['PrivateIpAddress'],
+                            'PublicIp': association.get('PublicIp')})
+        return {'Addresses': addresses}
+
+    def describe_instance_status(self, **kwargs):
+        """Stand-in of ec2.describe_instance_status (IncludeAllInstances)."""
+        self.call('DescribeInstanceStatus')
+        statuses = []
+        for instance_id in kwargs['InstanceIds']:
+            status = (
+                'impaired' if instance_id in self.impaired else 'ok')
+            statuses.append({
+                'InstanceId': instance_id,
+                'InstanceState': copy.deepcopy(
+                    self.instances[instance_id]['State']),
+                'InstanceStatus': {'Status': status},
+                'SystemStatus': {'Status': 'ok'}})
+        return {'InstanceStatuses': statuses}
+
+    def describe_network_interfaces(self, **kwargs):
+        """Stand-in of ec2.describe_network_interfaces."""
+        self.call('DescribeNetworkInterfaces')
+        missing = [
+            ei for ei in kwargs.get('NetworkInterfaceIds', [])
+            if ei not in self.network_interfaces]
+        if missing:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidNetworkInterfaceID.NotFound',
+                           'Message': str(missing)}},
+                'DescribeNetworkInterfaces')
+        return {'NetworkInterfaces': [
+            copy.deepcopy(self.network_interfaces[ei])
+            for ei in kwargs.get('NetworkInterfaceIds', [])]}
+
+    def describe_route_tables(self, **kwargs):
+        """Stand-in of ec2.describe_route_tables."""
+        self.call('DescribeRouteTables')
+        route_tables = [
+            rt for rt in self.route_tables.values()
+            if not kwargs.get('RouteTableIds') or
+            rt['RouteTableId'] in kwargs['RouteTableIds']]
+        route_tables = self.filtered(route_tables, kwargs.get('Filters'), {
+            'association.subnet-id':
+                lambda rt, v: any(
+                    a.get('SubnetId') in v for a in rt['Associations']),
+            'route.network-interface-id':
+                lambda rt, v: any(
+                    r.get('NetworkInterfaceId') in v for r in rt['Routes']),
+            'vpc-id':
+                lambda rt, v: rt['VpcId'] in v})
+        return self.paginated(route_tables, 'RouteTables', kwargs)
+
+    def associate_address(self, **kwargs):
+        """Stand-in of ec2.associate_address (moves the EIP)."""
+        self.call('AssociateAddress')
+        self.dry_run_check(kwargs, 'AssociateAddress')
+        with self.lock:
+            association = None
+            for ni in self.network_interfaces.values():
+                for pip in ni['PrivateIpAddresses']:
+                    if (pip.get('Association', {}).get('AllocationId') ==
+                            kwargs['AllocationId']):
+                        association = pip.pop('Association')
+            if association is None:
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'InvalidAllocationID.NotFound',
+                               'Message': kwargs['AllocationId']}},
+                    'AssociateAddress')
+            ni = self.network_interfaces[kwargs['NetworkInterfaceId']]
+            for pip in ni['PrivateIpAddresses']:
+                if pip['PrivateIpAddress'] == kwargs['PrivateIpAddress']:
+                    pip['Association'] = association
+        return {'AssociationId': 'eipassoc-{0}'.format(len(self.calls))}
+
+    def create_tags(self, **kwargs):
+        """Stand-in of ec2.create_tags."""
+        self.call('CreateTags')
+        self.dry_run_check(kwargs, 'CreateTags')
+        with self.lock:
+            for resource_id in kwargs['Resources']:
+                tags = self.instances[resource_id]['Tags']
+                for tag in kwargs['Tags']:
+                    tags[:] = [
+                        t for t in tags if t['Key'] != tag['Key']] + [tag]
+        return {}
+
+    def replace_route(self, **kwargs):
+        """Stand-in of ec2.replace_route."""
+        self.call('ReplaceRoute')
+        self.dry_run_check(kwargs, 'ReplaceRoute')
+        with self.lock:
+            route_table = self.route_tables[kwargs['RouteTableId']]
+            for route in route_table['Routes']:
+                if (route.get('DestinationCidrBlock') ==
+                        kwargs.get('DestinationCidrBlock')):
+                    route.pop('GatewayId', None)
+                    route['NetworkInterfaceId'] = (
+                        kwargs['NetworkInterfaceId'])
+        return {}
+
+    # SSM API
+
+    def get_parameter(self, **kwargs):
+        """Stand-in of ssm.get_parameter."""
+        self.call('GetParameter')
+        if kwargs['Name'] not in self.parameters:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ParameterNotFound',
+                           'Message': kwargs['Name']}},
+                'GetParameter')
+        return {'Parameter': {
+            'Name': kwargs['Name'], 'Value': self.parameters[kwargs['Name']]}}
+
+    def put_parameter(self, **kwargs):
+        """Stand-in of ssm.put_parameter."""
+        self.call('PutParameter')
+        self.parameters[kwargs['Name']] = kwargs['Value']
+        return {'Version': 1}
+
+    # DynamoDB API (only the expressions used by the failover journal)
+
+    def get_item(self, **kwargs):
+        """Stand-in of dynamodb.get_item."""
+        self.call('GetItem')
+        with self.lock:
+            item = self.items.get(kwargs['Key']['failover_id']['S'])
+            return {'Item': copy.deepcopy(item)} if item else {}
+
+    def put_item(self, **kwargs):
+        """Stand-in of dynamodb.put_item."""
+        self.call('PutItem')
+        with self.lock:
+            self.items[kwargs['Item']['failover_id']['S']] = (
+                copy.deepcopy(kwargs['Item']))
+        return {}
+
+    def update_item(self, **kwargs):
+        """Stand-in of dynamodb.update_item (ADD of a string set and SET
+           of attributes)."""
+        self.call('UpdateItem')
+        values = kwargs['ExpressionAttributeValues']
+        names = kwargs.get('ExpressionAttributeNames', {})
+        with self.lock:
+            item = self.items.setdefault(
+                kwargs['Key']['failover_id']['S'],
+                copy.deepcopy(kwargs['Key']))
+            if ':s' in values:
+                item['completed_steps'] = {'SS': sorted(
+                    set(item.get('completed_steps', {}).get('SS', [])) |
+                    set(values[':s']['SS']))}
+            if ':c' in values:
+                item[names['#status']] = values[':c']
+            item['updated'] = values[':t']
+        return {}
+
+
+def percentile(values, pct):
+    """Return the (nearest rank) percentile of a list of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def use_backend(backend):
+    """Point pa_failover at a stand-in backend (and forget its spans)."""
+    pa_failover.reset_spans()
+    pa_failover.BOTO_SERVICE_CLIENTS.clear()
+    pa_failover.BOTO_SERVICE_CLIENTS.update(
+        {'ec2': backend, 'ssm': backend, 'dynamodb': backend})
+
+
+def run_failover(backend, journal_table=None):
+    """Run a failover of the primary against a stand-in backend. Returns
+       (result string, duration in ms)."""
+    use_backend(backend)
+    start_time = time.time()
+    try:
+        result = pa_failover.main(
+            'i-primary', verbose=False, debug=False,
+            journal_table=journal_table)
+    except SystemExit as e:
+        result = str(e)
+    return result, (time.time() - start_time) * 1000
+
+
+def benchmark(enis, subnets, runs, seed=0, retries=0, journal_table=None,
+              **backend_kwargs):
+    """Benchmark the failover of a topology. A run that does not fail over
+       completely is retried (up to 'retries' times, as Lambda does) and its
+       duration covers all of its attempts. Returns the results (dict)."""
+    durations = []
+    attempts = []
+    call_counts = collections.Counter()
+    calls_before_first_change = []
+    succeeded = 0
+    rng = random.Random(seed)
+    for _ in range(runs):
+        backend = StandInAwsBackend.from_topology(
+            enis, subnets, rng=rng, **backend_kwargs)
+        duration = 0
+        for attempt in range(1 + retries):
+            result, attempt_duration = run_failover(backend, journal_table)
+            duration += attempt_duration
+            if result.startswith('failed over'):
+                break
+        durations.append(duration)
+        attempts.append(attempt + 1)
+        call_counts.update(backend.count_calls())
+        calls_before_first_change.append(
+            backend.calls_before_first_change())
+        if result.startswith('failed over'):
+            succeeded += 1
+    return {
+        'enis': enis,
+        'subnets': subnets,
+        'runs': runs,
+        'succeeded': succeeded,
+        'p50_ms': percentile(durations, 50),
+        'p95_ms': percentile(durations, 95),
+        'p99_ms': percentile(durations, 99),
+        'max_ms': max(durations),
+        'calls_per_run': dict(
+            (op, float(n) / runs) for op, n in sorted(call_counts.items())),
+        'calls_before_first_change': max(calls_before_first_change),
+        'attempts_per_run': float(sum(attempts)) / runs}
+
+
+def add_firewall(backend, instance_id, state='running', tags=()):
+    """Add a Palo Alto instance to a stand-in backend with Tag
+       (Role:Firewall) and the given extra tags and a single network
+       interface (none once terminated, as EC2 does)."""
+    network_interfaces = []
+    if state != 'terminated':
+        network_interfaces.append({
+            'Attachment': {
+                'DeviceIndex': 0,
+                'InstanceId': instance_id,
+                'Status': 'attached'},
+            'NetworkInterfaceId': 'eni-{0}-0'.format(instance_id),
+            'PrivateIpAddresses': [{
+                'Primary': True, 'PrivateIpAddress': '10.0.9.10'}],
+            'Status': 'in-use',
+            'SubnetId': 'subnet-{0}-0'.format(instance_id),
+            'VpcId': 'vpc-benchmark'})
+    for network_interface in network_interfaces:
+        backend.network_interfaces[
+            network_interface['NetworkInterfaceId']] = network_interface
+    backend.instances[instance_id] = {
+        'InstanceId': instance_id,
+        'NetworkInterfaces': network_interfaces,
+        'State': {'Name': state},
+        'Tags': [{'Key': 'Role', 'Value': 'Firewall'}] + [
+            {'Key': key, 'Value': value} for key, value in tags],
+        'VpcId': 'vpc-benchmark'}
+
+
+def set_up_untagged_instance(backend):
+    """Impair the primary next to a firewall (of another pair) without
+       the Primary tag."""
+    add_firewall(backend, 'i-untagged',
+                 tags=[(pa_failover.PAIR_TAG, 'pair-untagged')])
+    backend.impaired.add('i-primary')
+
+
+def set_up_primary_shutting_down(backend):
+    """Shut the primary down (its instance state)."""
+    backend.instances['i-primary']['State'] = {'Name': 'shutting-down'}
+
+
+def set_up_terminated_standby(backend):
+    """Impair the primary of a pair with a terminated (former) standby
+       next to its standby."""
+    add_firewall(backend, 'i-terminated', state='terminated',
+                 tags=[('Primary', 'false')])
+    backend.impaired.add('i-primary')
+
+
+# (name, set up of the stand-in backend) of the probe edge cases, the probe
+# has to fail over all of them
+PROBE_CHECKS = (
+    ('firewall without Primary tag', set_up_untagged_instance),
+    ('primary shutting down', set_up_primary_shutting_down),
+    ('terminated standby', set_up_terminated_standby))
+
+
+def check_probe(seed=0):
+    """Check that the probe fails over the primary in its edge cases (see
+       'PROBE_CHECKS'). Returns a list of (name, passed, result string)."""
+    checks = []
+    for name, set_up_backend in PROBE_CHECKS:
+        backend = StandInAwsBackend.from_topology(
+            4, 0, rng=random.Random(seed))
+        set_up_backend(backend)
+        use_backend(backend)
+        try:
+            result = pa_failover.probe(
+                verbose=False, debug=False, interval=0.01, threshold=1,
+                duration=1)
+        except Exception as e:  # pylint: disable=broad-except
+            result = 'probe raised {0!r}'.format(e)
+        checks.append((name, result.startswith('failed over'), result))
+    return checks
+
+
+def print_results(results):
+    """Print the benchmark results as a table."""
+    print('{0:>5} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>8}'.format(
+        'enis', 'subnets', 'ok/runs', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms', 'pre-chg'))
+    for r in results:
+        print('{enis:>5} {subnets:>7} {0:>9} {p50_ms:>9.1f} {p95_ms:>9.1f}'
+              ' {p99_ms:>9.1f} {max_ms:>9.1f}'
+              ' {calls_before_first_change:>8}'.format(
+                  '{succeeded}/{runs}'.format(**r), **r))
+        print('      attempts per run: {attempts_per_run:g}'.format(**r))
+        print('      calls per run: {0}'.format(', '.join(
+            '{0} {1:g}'.format(op, n)
+            for op, n in sorted(r['calls_per_run'].items()))))
+
+
+if __name__ == '__main__':
+    """Checks if this script has be run directly (e.g. via command line),
+       if so verifies usage and runs the benchmark"""
+
+    # parse command line arguments
+    parser_description = (
+        'benchmark pa_failover.py against a stand-in EC2 backend')
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument(
+        '-e', '--enis',
+        nargs='+', type=int, default=[4, 8, 16],
+        help='network interfaces per instance to benchmark'
+             ' (at least 4: eth2/eth3 are routed)')
+    parser.add_argument(
+        '-s', '--subnets',
+        nargs='+', type=int, default=[0, 16, 64],
+        help='extra subnets routed via the primary to benchmark')
+    parser.add_argument(
+        '-n', '--runs',
+        type=int, default=20,
+        help='failover runs per topology')
+    parser.add_argument(
+        '-l', '--latency-ms',
+        type=float, default=20,
+        help='latency of each API call')
+    parser.add_argument(
+        '-j', '--jitter-ms',
+        type=float, default=10,
+        help='maximum random extra latency of each API call')
+    parser.add_argument(
+        '-t', '--throttle-rate',
+        type=float, default=0.0,
+        help='probability of an API call being throttled')
+    parser.add_argument(
+        '-r', '--error-rate',
+        type=float, default=0.0,
+        help='probability of an API call failing')
+    parser.add_argument(
+        '--retries',
+        type=int, default=0,
+        help='retries of a run that does not fail over completely')
+    parser.add_argument(
+        '--journal',
+        action='store_true',
+        help='journal the failover progress (resume on retry)')
+    parser.add_argument(
+        '--seed',
+        type=int, default=0,
+        help='random seed')
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='output the results as JSON')
+    parser.add_argument(
+        '--check-probe',
+        action='store_true',
+        help='check the probe edge cases instead')
+    args = parser.parse_args()
+    if args.check_probe:
+        probe_checks = check_probe(args.seed)
+        for check_name, passed, check_result in probe_checks:
+            print('{0:<6} {1}: {2}'.format(
+                'ok' if passed else 'FAILED', check_name, check_result))
+        sys.exit(0 if all(passed for _, passed, _ in probe_checks) else 1)
+    if min(args.enis) < 4:
+        parser.error('-e/--enis must be at least 4 (eth2/eth3 are routed)')
+    # run the benchmark for every topology
+    benchmark_results = []
+    for topology_enis in args.enis:
+        for topology_subnets in args.subnets:
+            benchmark_results.append(benchmark(
+                topology_enis, topology_subnets, args.runs, args.seed,
+                retries=args.retries,
+                journal_table='benchmark-journal' if args.journal else None,
+                latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                throttle_rate=args.throttle_rate,
+                error_rate=args.error_rate))
+    if args.json:
+        json.dump(benchmark_results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print_results(benchmark_results)
@@ -0,0 +1,92 @@
+"""Stacker custom lookup to get a free (non colliding) ALB listener rule priority."""
+
+import logging
+from stacker_utils.clients import get_client
+from stacker_utils.listener_rules import (get_listener_rules, rule_key,
+                                          PriorityAllocator)
+from stacker_utils.lookup_cache import cached_lookup, get_or_fetch
+from stacker_utils.profiler import profiled
+
+TYPE_NAME = 'ALBRulePriority'
+# lookup cache type of the listeners' priority indexes (not lookup results)
+LISTENER_TYPE_NAME = TYPE_NAME + ':listener'
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_conditions(conditions):
+    """Return the rule conditions of field=value[,value...] strings."""
+    parsed = []
+    for condition in conditions:
+        field, _, values = condition.partition('=')
+        parsed.append({'Field': field, 'Values': values.split(',')})
+    return parsed
+
+
+def get_listener(region, listener_arn):
+    """Return the (run-scoped) priority index and rules of a listener.
+
+    Loaded once per run and shared by all the lookups of the listener.
+    """
+    def load():
+        """Load the rules of the listener."""
+        client = get_client('elbv2', region)
+        rules = get_listener_rules(client, listener_arn)
+        LOGGER.debug('found %s rules on listener %s', len(rules), listener_arn)
+        return (PriorityAllocator.from_rules(rules),
+                dict((rule_key(r), int(r['Priority'])) for r in rules))
+    return get_or_fetch((region, LISTENER_TYPE_NAME, listener_arn), load)
+
+
+@profiled
+@cached_lookup(TYPE_NAME)
+def handler(value, provider, **kwargs):  # pylint: disable=W0613
+    """ Lookup a priority for an ALB listener rule by ListenerArn::Conditions.
+
+    Need to specify the listener ARN and the rule's conditions
+    (field=value[,value...] separated by ::)
+
+    Region is obtained from the environment file
+
+    Returns the priority of the listener's rule with the same conditions
+    (so reruns are stable) or else the lowest free priority. Priorities are
+    allocated once per run (so rules in different stacks never collide)
+
+    [in the environment file]:
+      region: us-east-1
+
+    For example:
+
+    [in the stacker yaml (configuration) file]:
+
+      lookups:
+        ALBRulePriority: lookups.alb-rule-priority-lookup.handler
+
+      variables:
+        Rules:
+          - Condition: path-pattern
+            Value: /api/*
+            Priority: ${ALBRulePriority ${output alb::ListenerArn}::path-pattern=/api/*}
+            TargetGroupArn: ${output api::TargetGroupArn}
+    """
+
+    parts = value.split('::')
+    listener_arn = parts[0]
+    if len(parts) < 2:
+        return 'error: missing rule conditions'
+    conditions = parse_conditions(parts[1:])
+
+    allocator, priorities_by_key = get_listener(provider.region, listener_arn)
+    priority = priorities_by_key.get(rule_key({'Conditions': conditions}))
+    if priority is not None:
+        LOGGER.debug('found existing rule with priority %s', priority)
+        return priority
+
+    try:
+        priority = allocator.allocate()[0]
+    except ValueError as e:
+        LOGGER.error('could not allocate a priority: %s', e)
+        return 'error: no free priorities'
+
+    LOGGER.debug('allocated rule priority %s on listener %s',
+                 priority, listener_arn)
+    return priority
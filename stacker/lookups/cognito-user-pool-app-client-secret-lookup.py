@@ -1,11 +1,37 @@
 """Stacker custom lookup to get a Cognito User Pool App Client Secret."""
 
 import logging
-from stacker.session_cache import get_session
+import os
+from stacker_utils.clients import get_client
+from stacker_utils.disk_cache import DiskCache
+from stacker_utils.lookup_cache import cached_lookup
+from stacker_utils.profiler import profiled
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
 
 TYPE_NAME = 'CognitoUserPoolAppClientSecret'
 LOGGER = logging.getLogger(__name__)
+# (optional) encrypted on-disk cache of the secrets (for back-to-back runs)
+CACHE_KEY = os.environ.get('COGNITO_SECRET_CACHE_KEY')
+CACHE_TTL = int(os.environ.get('COGNITO_SECRET_CACHE_TTL', 300))
+CACHE = DiskCache('cognito-secret-cache')
+
+
+def get_cipher():
+    """Return the cipher of the on-disk cache (None if it's disabled)."""
+    if not CACHE_KEY or CACHE_TTL <= 0:
+        return None
+    if Fernet is None:
+        LOGGER.warning('not caching secrets: cryptography is not installed')
+        return None
+    return Fernet(CACHE_KEY.encode())
+
 
+@profiled
+@cached_lookup(TYPE_NAME)
 def handler(value, provider, **kwargs):  # pylint: disable=W0613
     """ Lookup a Cognito User Pool App Client secret by UserPoolId::AppClientId.
 
@@ -13,6 +39,17 @@ def handler(value, provider, **kwargs):  # pylint: disable=W0613
 
     Region is obtained from the environment file
 
+    Results are cached (by region and value) for the whole stacker run
+
+    Throttled (TooManyRequestsException) calls are retried with backoff (by
+    the shared client's standard retry mode), the lookup fails if the user
+    pool client still can't be described
+
+    To also cache the secrets on disk (under ~/.stacker, encrypted) for
+    back-to-back runs, install cryptography and set COGNITO_SECRET_CACHE_KEY
+    to a Fernet key (and optionally COGNITO_SECRET_CACHE_TTL in seconds,
+    default: 300)
+
     [in the environment file]:
       region: us-west-2
 
@@ -31,19 +68,36 @@ def handler(value, provider, **kwargs):  # pylint: disable=W0613
     user_pool_id = value.split('::')[0]
     app_client_id = value.split('::')[1]
 
-    session = get_session(provider.region)
-    cognito_client = session.client('cognito-idp')
+    cipher = get_cipher()
+    cache_key = '{}:{}'.format(provider.region, value)
+    if cipher:
+        token = CACHE.get(cache_key)
+        if token:
+            try:
+                secret = cipher.decrypt(token.encode()).decode()
+            except InvalidToken:
+                LOGGER.debug('ignoring cached secret (encrypted with'
+                             ' another key)')
+            else:
+                LOGGER.debug('found cached user pool app client secret')
+                return secret
+
+    cognito_client = get_client('cognito-idp', provider.region)
     try:
-        desc_user_pool_client_output = cognito_client.describe_user_pool_client(
-                                    ClientId=app_client_id,
-                                    UserPoolId=user_pool_id)
+        desc_user_pool_client_output = (
+            cognito_client.describe_user_pool_client(
+                ClientId=app_client_id, UserPoolId=user_pool_id))
     except Exception as e:
+        # fail the lookup (an error string would be used as the secret)
         LOGGER.error('could not describe user pool client: %s', e)
-        return 'error: could not describe user pool client'
+        raise
 
     secret = desc_user_pool_client_output['UserPoolClient'].get('ClientSecret')
     if secret:
         LOGGER.debug('found user pool app client secret')
+        if cipher:
+            CACHE.set(cache_key, cipher.encrypt(secret.encode()).decode(),
+                      CACHE_TTL)
         return secret
     else:
         LOGGER.debug('did not find user pool app client secret')
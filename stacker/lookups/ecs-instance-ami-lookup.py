@@ -1,37 +1,168 @@
 """Stacker custom lookup for finding AWS recommended ECS EC2 AMI"""
 
 import logging
+import os
 from ast import literal_eval
-from stacker.session_cache import get_session
+from concurrent.futures import ThreadPoolExecutor
+from stacker_utils import profiler
+from stacker_utils.clients import get_client
+from stacker_utils.config_scan import find_lookup_args
+from stacker_utils.disk_cache import DiskCache
+from stacker_utils.lookup_cache import cached_lookup, get_or_fetch
+from stacker_utils.profiler import profiled
 
 TYPE_NAME = 'ecsinstanceami'
+# lookup cache type of the prefetched AMIs (not a lookup result)
+PREFETCH_TYPE_NAME = TYPE_NAME + ':prefetch'
 LOGGER = logging.getLogger(__name__)
+# how long (seconds) to keep the AMIs in the on-disk cache (0 = no caching)
+CACHE_TTL = int(os.environ.get('ECS_INSTANCE_AMI_CACHE_TTL', 86400))
+# ignore (and refresh) the cached AMIs
+CACHE_REFRESH = os.environ.get(
+    'ECS_INSTANCE_AMI_CACHE_REFRESH', 'false').lower() == 'true'
+CACHE = DiskCache('ecs-instance-ami-cache')
+# max number of parameters per get_parameters call
+MAX_PARAMETERS = 10
 
 
+def parse_value(value, default_region):
+    """Return the (region, SSM parameter path, attribute) of a lookup value.
+
+    e.g. us-west-2@/aws/service/ecs/.../recommended::image_name
+    """
+    region = default_region
+    if '@' in value:
+        region, value = value.split('@', 1)
+    path, _, attribute = value.partition('::')
+    return region, path, attribute or 'image_id'
+
+
+def cache_key(region, path):
+    """Return the on-disk cache key of an AMI parameter."""
+    return '{}:{}'.format(region, path)
+
+
+def get_wanted_parameters(config, default_region):
+    """Return the (region, path) of every ecsinstanceami lookup in a config.
+
+    Stack lookups use the stack's region (if any).
+    """
+    if hasattr(config, 'to_primitive'):
+        config = config.to_primitive()
+    wanted = set()
+    stacks = config.get('stacks') or []
+    others = dict((k, v) for k, v in config.items() if k != 'stacks')
+    for arg in find_lookup_args(others, TYPE_NAME):
+        wanted.add(parse_value(arg, default_region)[:2])
+    for stack in stacks:
+        region = stack.get('region') or default_region
+        for arg in find_lookup_args(stack, TYPE_NAME):
+            wanted.add(parse_value(arg, region)[:2])
+    return wanted
+
+
+def fetch_parameters(ssm_client, paths):
+    """Return the parsed AMI records of SSM parameters by path.
+
+    Gets the parameters in batches (of up to 10 parameters per call).
+    """
+    records = {}
+    paths = sorted(paths)
+    for i in range(0, len(paths), MAX_PARAMETERS):
+        get_parameters_output = ssm_client.get_parameters(
+            Names=paths[i:i + MAX_PARAMETERS])
+        for parameter in get_parameters_output['Parameters']:
+            records[parameter['Name']] = literal_eval(parameter['Value'])
+    return records
+
+
+def fetch_and_cache(wanted):
+    """Fetch (concurrently by region, in batches) and cache AMI records.
+
+    Returns the records by (region, path).
+    """
+    paths_by_region = {}
+    for region, path in wanted:
+        paths_by_region.setdefault(region, []).append(path)
+    LOGGER.debug('fetching %s ECS AMI parameters in %s regions',
+                 len(wanted), len(paths_by_region))
+    with ThreadPoolExecutor(max_workers=len(paths_by_region)) as executor:
+        futures = dict(
+            (region, executor.submit(profiler.bind(fetch_parameters),
+                                     get_client('ssm', region), paths))
+            for region, paths in paths_by_region.items())
+    records = {}
+    for region, future in futures.items():
+        for path, record in future.result().items():
+            records[(region, path)] = record
+    # save the cache once (not once per record)
+    CACHE.set_many(((cache_key(region, path), record)
+                    for (region, path), record in records.items()),
+                   CACHE_TTL)
+    return records
+
+
+def prefetch(region, context):
+    """Fetch (and cache) the stale/missing AMIs of every lookup in the config."""
+    config = getattr(context, 'config', None)
+    if config is None:
+        return {}
+    wanted = [(r, p) for r, p in get_wanted_parameters(config, region)
+              if CACHE_REFRESH or CACHE.get(cache_key(r, p)) is None]
+    if not wanted:
+        return {}
+    return fetch_and_cache(wanted)
+
+
+@profiled
+@cached_lookup(TYPE_NAME)
 def handler(value, provider, **kwargs):  # pylint: disable=W0613
     """ Find the AWS recommended AMI for ECS instances
         stored in AWS managed SSM
 
     Need to specify the SSM key value to the lookup.
     (/aws/service/ecs/optimized-ami/amazon-linux/recommended)
+    optionally prefixed with a region (us-west-2@/aws/service/...)
+    and optionally followed by an attribute of the AMI record
+    (::image_id [default], ::image_name, ::os, ...)
+
+    Region is obtained from the environment file (or the stack)
 
-    Region is obtained from the environment file
+    Results are cached (by region and value) for the whole stacker run
+    and on disk (under ~/.stacker) for ECS_INSTANCE_AMI_CACHE_TTL seconds
+    (default: 1 day). Set ECS_INSTANCE_AMI_CACHE_REFRESH=true to refresh them.
+    On a cache miss, the AMIs of all the lookups in the config (in all
+    regions) are fetched concurrently, 10 parameters per call
 
     For example:
 
     configuration file:
         ImageId: ${ecsinstanceami /aws/service/ecs/optimized-ami/amazon-linux/recommended}
+        WestImageId: ${ecsinstanceami us-west-2@/aws/service/ecs/optimized-ami/amazon-linux/recommended}
+        ImageName: ${ecsinstanceami /aws/service/ecs/optimized-ami/amazon-linux-2/recommended::image_name}
 
     environment file:
         region: us-east-1
     """
 
-    session = get_session(provider.region)
-    ssm_client = session.client('ssm')
-    get_parameters_output = ssm_client.get_parameters(Names=[value])
-    parameter_value_dict = literal_eval(get_parameters_output['Parameters'][0]['Value'])
-    image_id = parameter_value_dict['image_id']
+    region, path, attribute = parse_value(value, provider.region)
+    key = cache_key(region, path)
+    record = None if CACHE_REFRESH else CACHE.get(key)
+    if record is None:
+        records = get_or_fetch(
+            (provider.region, PREFETCH_TYPE_NAME, None),
+            lambda: prefetch(provider.region, kwargs.get('context')))
+        record = records.get((region, path))
+    if record is None:
+        record = fetch_and_cache([(region, path)]).get((region, path))
+    if record is None:
+        LOGGER.error('could not find SSM parameter %s in region %s',
+                     path, region)
+        return 'error: parameter not found'
+    if attribute not in record:
+        return 'error: unsupported attribute ({})'.format(attribute)
 
-    LOGGER.debug('found ECS image ID: %s for region: %s', image_id, provider.region)
+    LOGGER.debug('found ECS image %s: %s for region: %s',
+                 attribute, record[attribute], region)
 
-    return image_id
+    return record[attribute]
@@ -1,19 +1,124 @@
 """Stacker custom lookup to get EC2 Instance attributes using a 'Name' tag."""
 
 import logging
-from stacker.session_cache import get_session
+import os
+import re
+from stacker_utils.clients import get_client
+from stacker_utils.config_scan import find_lookup_args
+from stacker_utils.lookup_cache import cached_lookup, get_or_fetch
+from stacker_utils.profiler import profiled
 
 TYPE_NAME = 'EC2AttrByNameTag'
+# lookup cache types of the prefetched instances and of the instance indexes
+# (not lookup results, so they don't share the lookup's cache namespace)
+PREFETCH_TYPE_NAME = TYPE_NAME + ':prefetch'
+INDEX_TYPE_NAME = TYPE_NAME + ':index'
 LOGGER = logging.getLogger(__name__)
+# resolve all the lookups in the config with one (paginated) API call
+PREFETCH = os.environ.get(
+    'EC2_ATTR_BY_NAME_TAG_PREFETCH', 'true').lower() == 'true'
+# max number of values in a describe_instances filter
+MAX_FILTER_VALUES = 200
 
+
+def describe_instances_by_name(ec2_client, name_tag_vals):
+    """Return the running instances with the given 'Name' tags by name."""
+    instances_by_name = dict((name, []) for name in name_tag_vals)
+    paginator = ec2_client.get_paginator('describe_instances')
+    for i in range(0, len(name_tag_vals), MAX_FILTER_VALUES):
+        names = name_tag_vals[i:i + MAX_FILTER_VALUES]
+        pages = paginator.paginate(
+            Filters=[{'Name': 'instance-state-name', 'Values': ['running']},
+                     {'Name': 'tag:Name', 'Values': names}],
+            PaginationConfig={'PageSize': 1000})
+        for page in pages:
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    for tag in instance.get('Tags', []):
+                        if (tag['Key'] == 'Name' and
+                                tag['Value'] in instances_by_name):
+                            instances_by_name[tag['Value']].append(instance)
+    return instances_by_name
+
+
+def flatten(data, prefix=''):
+    """Return a flattened, dotted-path index of an instance description.
+
+    List items are indexed by position and tags by key, e.g.:
+
+      NetworkInterfaces.0.NetworkInterfaceId, SecurityGroups.1.GroupId,
+      BlockDeviceMappings.0.Ebs.VolumeId, Tags.Role
+    """
+    index = {}
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        index[prefix] = data
+        return index
+    for key, value in items:
+        path = '{}.{}'.format(prefix, key) if prefix else str(key)
+        if key == 'Tags' and isinstance(value, list):
+            for tag in value:
+                index['{}.{}'.format(path, tag['Key'])] = tag['Value']
+        else:
+            index.update(flatten(value, path))
+    return index
+
+
+def query(index, attr_path):
+    """Return the value of an attribute path (None if there isn't one).
+
+    A '*' matches any one path element and returns all the matching values
+    comma separated, e.g. SecurityGroups.*.GroupId
+    """
+    if '*' not in attr_path:
+        return index.get(attr_path)
+    path_re = re.compile('^{}$'.format(
+        r'[^.]+'.join(re.escape(part) for part in attr_path.split('*'))))
+    # sort numerically by list position (NetworkInterfaces.10 after .9)
+    matches = sorted(
+        (path for path in index if path_re.match(path)),
+        key=lambda path: [int(p) if p.isdigit() else p
+                          for p in path.split('.')])
+    if not matches:
+        return None
+    return ','.join(str(index[path]) for path in matches)
+
+
+def prefetch(region, context):
+    """Return the instances of every lookup in the config by 'Name' tag."""
+    config = getattr(context, 'config', None)
+    if not PREFETCH or config is None:
+        return {}
+    name_tag_vals = sorted(set(
+        arg.split('::')[0] for arg in find_lookup_args(config, TYPE_NAME)))
+    if not name_tag_vals:
+        return {}
+    LOGGER.debug('prefetching %s instances by name tag', len(name_tag_vals))
+    ec2_client = get_client('ec2', region)
+    return describe_instances_by_name(ec2_client, name_tag_vals)
+
+
+@profiled
+@cached_lookup(TYPE_NAME)
 def handler(value, provider, **kwargs):  # pylint: disable=W0613
     """ Lookup a EC2 Instance's attribute by it's 'Name' tag value.
 
     Need to specify the name tag value and attribute name (same as with
-    the `aws ec2 describe-instances` command.
+    the `aws ec2 describe-instances` command. Any attribute of the instance
+    description can be looked up by its dotted path (e.g. SubnetId, Tags.Role,
+    NetworkInterfaces.0.NetworkInterfaceId, SecurityGroups.*.GroupId)
 
     Region is obtained from the environment file
 
+    Results are cached (by region and value) for the whole stacker run
+
+    Unless disabled (EC2_ATTR_BY_NAME_TAG_PREFETCH=false), the first lookup
+    scans the config and fetches the instances of every EC2AttrByNameTag
+    lookup in it at once; later lookups are resolved from memory
+
     [in the environment file]:
       region: us-east-1
 
@@ -27,33 +132,35 @@ def handler(value, provider, **kwargs):  # pylint: disable=W0613
       variables:
         InstanceId: ${EC2AttrByNameTag ${instance_name_tag}::InstanceID}
         ImageId: ${EC2AttrByNameTag ${instance_name_tag}::ImageId}
+        Role: ${EC2AttrByNameTag ${instance_name_tag}::Tags.Role}
+        VolumeId: ${EC2AttrByNameTag ${instance_name_tag}::BlockDeviceMappings.0.Ebs.VolumeId}
     """
 
     name_tag_val = value.split('::')[0]
     inst_attr = value.split('::')[1]
 
-    session = get_session(provider.region)
-    ec2_client = session.client('ec2')
-    describe_instances_output = ec2_client.describe_instances(
-        Filters=[{'Name': 'instance-state-name', 'Values': ['running']},
-                 {'Name': 'tag:Name', 'Values': [name_tag_val]}])
-    reservations = describe_instances_output['Reservations']
-    if reservations:
-        number_found = len(reservations)
+    instances_by_name = get_or_fetch(
+        (provider.region, PREFETCH_TYPE_NAME, None),
+        lambda: prefetch(provider.region, kwargs.get('context')))
+    if name_tag_val in instances_by_name:
+        LOGGER.debug('using prefetched instances with name tag (%s)',
+                     name_tag_val)
+        instances = instances_by_name[name_tag_val]
+    else:
+        ec2_client = get_client('ec2', provider.region)
+        instances = describe_instances_by_name(
+            ec2_client, [name_tag_val])[name_tag_val]
+    if instances:
+        number_found = len(instances)
         LOGGER.debug('found %s instances', number_found)
         if number_found == 1:
-            instance = reservations[0]['Instances'][0]
-            if inst_attr in ['ImageId',
-                             'InstanceId',
-                             'InstanceType',
-                             'KeyName',
-                             'LaunchTime',
-                             'Platform',
-                             'PrivateIpAddress',
-                             'PublicIpAddress',
-                             'VpcId']:
-                inst_attr_val = instance[inst_attr]
-            else:
+            instance = instances[0]
+            # index the instance once (for all its attribute lookups)
+            index = get_or_fetch(
+                (provider.region, INDEX_TYPE_NAME, instance['InstanceId']),
+                lambda: flatten(instance))
+            inst_attr_val = query(index, inst_attr)
+            if inst_attr_val is None:
                 return ('error: unsupported attribute lookup'
                         ' type ({})'.format(inst_attr))
         else:
@@ -0,0 +1 @@
+"""Empty init for python import traversal."""
@@ -0,0 +1,34 @@
+"""Registry of shared (thread safe) boto3 clients for hooks and lookups."""
+
+import threading
+import botocore.config
+from stacker.session_cache import get_session
+from stacker_utils.profiler import watch
+
+CONFIG = botocore.config.Config(
+    connect_timeout=10,
+    read_timeout=60,
+    # one connection pool shared by all the (parallel) stack builds
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 10})
+CLIENTS = {}
+LOCK = threading.Lock()
+
+
+def get_client(service, region, profile=None):
+    """Return the shared client of a service in a region (and profile).
+
+    Clients are created once per run (from stacker's cached sessions) with
+    a tuned config and shared by every hook and lookup. Using a client is
+    thread safe, creating one isn't (hence the lock).
+    """
+    key = (region, service, profile)
+    try:
+        return CLIENTS[key]
+    except KeyError:
+        pass
+    with LOCK:
+        if key not in CLIENTS:
+            session = get_session(region, profile=profile)
+            CLIENTS[key] = watch(session.client(service, config=CONFIG))
+        return CLIENTS[key]
@@ -0,0 +1,34 @@
+"""Scan a stacker config for the arguments of a lookup."""
+
+import re
+
+
+def walk_strings(data):
+    """Yield every string nested in dicts/lists/tuples."""
+    if isinstance(data, dict):
+        for value in data.values():
+            for string in walk_strings(value):
+                yield string
+    elif isinstance(data, (list, tuple)):
+        for item in data:
+            for string in walk_strings(item):
+                yield string
+    elif isinstance(data, str) or type(data).__name__ == 'unicode':
+        yield data
+
+
+def find_lookup_args(config, type_name):
+    """Return the (literal) arguments of every `type_name` lookup in a config.
+
+    Scans the stack variables, hook args, etc. (anything in the config).
+    Arguments that contain nested lookups (e.g. ${output ...}) can only be
+    resolved at build time and are skipped.
+    """
+    if hasattr(config, 'to_primitive'):
+        config = config.to_primitive()
+    lookup_re = re.compile(r'\$\{%s\s+([^${}]+)\}' % re.escape(type_name))
+    args = set()
+    for string in walk_strings(config):
+        for arg in lookup_re.findall(string):
+            args.add(arg.strip())
+    return sorted(args)
@@ -0,0 +1,83 @@
+"""Persistent (on-disk) JSON cache of expiring entries."""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from stacker_utils import profiler
+
+LOGGER = logging.getLogger(__name__)
+CACHE_DIR = os.path.expanduser(os.environ.get('STACKER_CACHE_DIR',
+                                              '~/.stacker'))
+
+
+class DiskCache(object):
+    """A JSON file of {key: {'value': ..., 'expires': ...}} entries.
+
+    Lives under the stacker cache directory (STACKER_CACHE_DIR, default
+    ~/.stacker). The file is rewritten atomically, so concurrent stacker
+    runs never see a partial file (last writer wins).
+    """
+
+    def __init__(self, name, cache_dir=CACHE_DIR):
+        """Initialize."""
+        self.path = os.path.join(cache_dir, name + '.json')
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        """Return the cache entries (read the file the first time)."""
+        if self.entries is None:
+            try:
+                with open(self.path) as cache_file:
+                    self.entries = json.load(cache_file)
+            except (IOError, OSError, ValueError) as e:
+                if os.path.exists(self.path):
+                    LOGGER.warning('ignoring unreadable cache (%s): %s',
+                                   self.path, e)
+                self.entries = {}
+        return self.entries
+
+    def get(self, key):
+        """Return the value of a key (None if it is missing or expired)."""
+        with self.lock:
+            entry = self.load().get(key)
+        if entry is None or entry['expires'] <= time.time():
+            profiler.count('disk_cache_misses')
+            return None
+        profiler.count('disk_cache_hits')
+        return entry['value']
+
+    def set(self, key, value, ttl):
+        """Set the value of a key for ttl seconds (and save the cache)."""
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items, ttl):
+        """Set the values of (key, value) items for ttl seconds.
+
+        The cache is saved once (not once per key).
+        """
+        items = list(items)
+        if ttl <= 0 or not items:
+            return
+        with self.lock:
+            entries = self.load()
+            expires = time.time() + ttl
+            for key, value in items:
+                entries[key] = {'value': value, 'expires': expires}
+            self.save()
+
+    def save(self):
+        """Atomically write the cache file."""
+        cache_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(self.entries, tmp_file, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            LOGGER.warning('could not save cache (%s): %s', self.path, e)
@@ -0,0 +1,174 @@
+"""Helpers for ALB listener rules (matching, diffing, allocating priorities)."""
+
+import bisect
+import json
+import threading
+
+MIN_PRIORITY = 1
+MAX_PRIORITY = 50000
+
+
+def get_listener_rules(client, listener_arn):
+    """Return the (non default) rules of a listener."""
+    rules = []
+    kwargs = {'ListenerArn': listener_arn, 'PageSize': 400}
+    while True:
+        output = client.describe_rules(**kwargs)
+        rules.extend(rule for rule in output['Rules']
+                     if not rule['IsDefault'])
+        if not output.get('NextMarker'):
+            return rules
+        kwargs['Marker'] = output['NextMarker']
+
+
+def condition_key(condition):
+    """Return a comparable key of a rule condition.
+
+    Conditions can be given with Values and/or a <Field>Config, e.g.
+    {'Field': 'host-header', 'Values': [...]} or
+    {'Field': 'host-header', 'HostHeaderConfig': {'Values': [...]}}
+    """
+    values = condition.get('Values') or []
+    extra = {}
+    for key, config in condition.items():
+        if key.endswith('Config'):
+            values = config.get('Values') or values
+            extra = dict((k, v) for k, v in config.items() if k != 'Values')
+    return json.dumps([condition['Field'],
+                       sorted(json.dumps(v, sort_keys=True) for v in values),
+                       extra], sort_keys=True)
+
+
+def rule_key(rule):
+    """Return a comparable key of a rule (its conditions)."""
+    return tuple(sorted(condition_key(c) for c in rule['Conditions']))
+
+
+def matches(desired, actual):
+    """Return whether the desired settings (a subset) match the actual ones.
+
+    ELB fills in defaults (e.g. ForwardConfig, Order) so only the desired
+    settings are compared.
+    """
+    if isinstance(desired, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and matches(value, actual[key])
+            for key, value in desired.items())
+    if isinstance(desired, list):
+        return (isinstance(actual, list) and len(desired) == len(actual) and
+                all(matches(d, a) for d, a in zip(desired, actual)))
+    return str(desired) == str(actual)
+
+
+def diff_rules(desired_rules, existing_rules, prune):
+    """Return the changes needed to turn the existing into the desired rules.
+
+    Rules are matched by their conditions. Desired rules without a
+    Priority keep the priority of their matching rule or get the lowest
+    free one. Raises a ValueError for priority collisions. Returns a dict
+    of:
+
+      creates: desired rules without a matching rule
+      modifies: (rule arn, desired rule) whose actions differ
+      priorities: (rule arn, priority) whose priority differs
+      deletes: rule arns that aren't desired (only if pruning)
+    """
+    existing_by_key = dict((rule_key(r), r) for r in existing_rules)
+    desired_keys = set(rule_key(r) for r in desired_rules)
+    kept_rules = [r for k, r in existing_by_key.items()
+                  if k in desired_keys or not prune]
+    allocator = PriorityAllocator.from_rules(kept_rules)
+    taken = set(int(r['Priority']) for k, r in existing_by_key.items()
+                if k not in desired_keys and not prune)
+    explicit = set()
+    for desired in desired_rules:
+        if desired.get('Priority'):
+            priority = int(desired['Priority'])
+            if priority in explicit or priority in taken:
+                raise ValueError(
+                    'priority {} is already taken'.format(priority))
+            explicit.add(priority)
+            allocator.release(priority)
+            allocator.reserve(priority)
+    changes = {'creates': [], 'modifies': [], 'priorities': [], 'deletes': []}
+    for desired in desired_rules:
+        existing = existing_by_key.get(rule_key(desired))
+        if not desired.get('Priority'):
+            if existing and int(existing['Priority']) not in explicit:
+                priority = int(existing['Priority'])
+            else:
+                priority = allocator.allocate()[0]
+            desired = dict(desired, Priority=priority)
+        if existing is None:
+            changes['creates'].append(desired)
+            continue
+        if not matches(desired['Actions'], existing['Actions']):
+            changes['modifies'].append((existing['RuleArn'], desired))
+        if str(desired['Priority']) != str(existing['Priority']):
+            changes['priorities'].append(
+                (existing['RuleArn'], int(desired['Priority'])))
+    if prune:
+        changes['deletes'] = [r['RuleArn'] for k, r in existing_by_key.items()
+                              if k not in desired_keys]
+    return changes
+
+
+class PriorityAllocator(object):
+    """Sorted index of the occupied priorities of a listener.
+
+    Assigns free (non colliding) priorities, lowest first. Allocating n
+    priorities is O(n log n) (a bisect into the index and a walk of its
+    gaps). Thread safe.
+    """
+
+    def __init__(self, occupied=(), min_priority=MIN_PRIORITY,
+                 max_priority=MAX_PRIORITY):
+        """Initialize."""
+        self.occupied = sorted(set(int(p) for p in occupied))
+        self.min_priority = min_priority
+        self.max_priority = max_priority
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_rules(cls, rules):
+        """Create an allocator from the (non default) rules of a listener."""
+        return cls(rule['Priority'] for rule in rules)
+
+    def is_free(self, priority):
+        """Return whether a priority is free."""
+        i = bisect.bisect_left(self.occupied, priority)
+        return i == len(self.occupied) or self.occupied[i] != priority
+
+    def reserve(self, priority):
+        """Mark a priority as occupied (ValueError if it already is)."""
+        priority = int(priority)
+        with self.lock:
+            if not self.is_free(priority):
+                raise ValueError(
+                    'priority {} is already taken'.format(priority))
+            bisect.insort(self.occupied, priority)
+
+    def release(self, priority):
+        """Mark a priority as free."""
+        with self.lock:
+            i = bisect.bisect_left(self.occupied, int(priority))
+            if i < len(self.occupied) and self.occupied[i] == int(priority):
+                del self.occupied[i]
+
+    def allocate(self, count=1, start=None):
+        """Return (and reserve) the lowest free priorities (>= start)."""
+        with self.lock:
+            priorities = []
+            candidate = max(start or self.min_priority, self.min_priority)
+            i = bisect.bisect_left(self.occupied, candidate)
+            while len(priorities) < count:
+                if candidate > self.max_priority:
+                    raise ValueError('not enough free priorities'
+                                     ' ({} wanted)'.format(count))
+                if i < len(self.occupied) and self.occupied[i] == candidate:
+                    i += 1
+                else:
+                    priorities.append(candidate)
+                candidate += 1
+            self.occupied = sorted(self.occupied + priorities)
+            return priorities
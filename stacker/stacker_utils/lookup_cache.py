@@ -0,0 +1,89 @@
+"""Run-scoped cache of stacker lookup results."""
+
+import functools
+import logging
+import threading
+from stacker_utils import profiler
+
+LOGGER = logging.getLogger(__name__)
+
+# lookup results by (region, lookup type, value) - live for the stacker run
+CACHE = {}
+# locks of the keys being looked up (so each key is only fetched once)
+KEY_LOCKS = {}
+LOCK = threading.Lock()
+
+
+def is_error(value):
+    """Return whether a lookup result is an error ('error: ...')."""
+    return isinstance(value, str) and value.startswith('error:')
+
+
+def get_or_fetch(key, fetch, cacheable=None):
+    """Return the cached value of a key or fetch (and cache) it.
+
+    Safe under stacker's parallel stack execution: concurrent lookups of
+    the same key wait for the first one to fetch it instead of calling
+    AWS again. A fetch that raises an exception, or whose value isn't
+    cacheable(value) (if given), is not cached.
+
+    Keys are (region, type, value) tuples. Entries that aren't lookup
+    results (e.g. prefetched data) need a type of their own, e.g.
+    TYPE_NAME + ':prefetch', so they can't collide with a lookup value.
+    """
+    try:
+        value = CACHE[key]
+    except KeyError:
+        pass
+    else:
+        LOGGER.debug('lookup cache hit: %s', key)
+        profiler.count('cache_hits')
+        return value
+    with LOCK:
+        key_lock = KEY_LOCKS.setdefault(key, threading.Lock())
+    with key_lock:
+        if key in CACHE:
+            LOGGER.debug('lookup cache hit (coalesced): %s', key)
+            profiler.count('cache_hits')
+            return CACHE[key]
+        LOGGER.debug('lookup cache miss: %s', key)
+        profiler.count('cache_misses')
+        value = fetch()
+        if cacheable is None or cacheable(value):
+            CACHE[key] = value
+    return value
+
+
+def cached_lookup(type_name):
+    """Cache the results of a lookup handler for the whole stacker run.
+
+    Results are keyed by (region, lookup type, value), so each distinct
+    lookup hits AWS at most once per run. Errors ('error: ...' results)
+    aren't cached, so a transient failure is looked up again.
+
+    For example:
+
+      TYPE_NAME = 'EC2AttrByNameTag'
+
+      @cached_lookup(TYPE_NAME)
+      def handler(value, provider, **kwargs):
+          ...
+    """
+    def decorator(handler):
+        """Wrap the lookup handler."""
+        @functools.wraps(handler)
+        def wrapper(value, provider, **kwargs):
+            """Return the cached result of the lookup (or look it up)."""
+            return get_or_fetch(
+                (provider.region, type_name, value),
+                lambda: handler(value, provider=provider, **kwargs),
+                cacheable=lambda result: not is_error(result))
+        return wrapper
+    return decorator
+
+
+def clear():
+    """Forget all the cached lookup results."""
+    with LOCK:
+        CACHE.clear()
+        KEY_LOCKS.clear()
@@ -0,0 +1,157 @@
+"""Profiler of stacker lookups and hooks (wall time, API calls, cache use)."""
+
+import atexit
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+# print a report (sorted by total time) at the end of the run
+PROFILE = os.environ.get('STACKER_PROFILE', 'false').lower() == 'true'
+# export the report and every invocation (as JSON) to this file
+PROFILE_JSON = os.environ.get('STACKER_PROFILE_JSON')
+
+INVOCATIONS = []
+LOCK = threading.Lock()
+LOCAL = threading.local()
+
+
+def current():
+    """Return the record of the invocation running in this thread."""
+    return getattr(LOCAL, 'invocation', None)
+
+
+def count(counter, invocation=None):
+    """Increment a counter of the (current) invocation.
+
+    Thread safe: an invocation's worker threads (see bind) share its
+    counters.
+    """
+    invocation = invocation or current()
+    if invocation is not None:
+        with LOCK:
+            counters = invocation['counters']
+            counters[counter] = counters.get(counter, 0) + 1
+
+
+def watch(client):
+    """Count the API calls made with a boto3 client (returns the client).
+
+    Calls are counted against the invocation running in the calling
+    thread (see bind for worker threads), so clients can be shared.
+    """
+    def on_api_call(model, **kwargs):  # pylint: disable=W0613
+        """Count an API call."""
+        count('api_calls')
+        count('api_calls.{}'.format(model.name))
+
+    client.meta.events.register('before-parameter-build', on_api_call)
+    return client
+
+
+def bind(func):
+    """Bind a function to the current invocation (to run in worker threads).
+
+    e.g. executor.submit(profiler.bind(fetch), ...)
+    """
+    invocation = current()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        """Run the function as part of the bound invocation."""
+        parent = current()
+        LOCAL.invocation = invocation
+        try:
+            return func(*args, **kwargs)
+        finally:
+            LOCAL.invocation = parent
+    return wrapper
+
+
+def profiled(func):
+    """Record the wall time, API calls and cache use of each invocation.
+
+    Decorates any lookup handler or hook function, e.g.:
+
+      @profiled
+      @cached_lookup(TYPE_NAME)
+      def handler(value, provider, **kwargs):
+          ...
+    """
+    name = '{}.{}'.format(func.__module__, func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        """Run (and profile) the function."""
+        invocation = {'name': name, 'counters': {}}
+        if args:
+            invocation['value'] = str(args[0])
+        parent = current()
+        LOCAL.invocation = invocation
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invocation['seconds'] = time.time() - start
+            LOCAL.invocation = parent
+            with LOCK:
+                INVOCATIONS.append(invocation)
+    return wrapper
+
+
+def summarize():
+    """Return the totals by lookup/hook, sorted by total time."""
+    totals = {}
+    with LOCK:
+        invocations = [dict(invocation, counters=dict(invocation['counters']))
+                       for invocation in INVOCATIONS]
+    for invocation in invocations:
+        total = totals.setdefault(invocation['name'], {
+            'name': invocation['name'], 'calls': 0, 'seconds': 0.0,
+            'max_seconds': 0.0, 'counters': {}})
+        total['calls'] += 1
+        total['seconds'] += invocation['seconds']
+        total['max_seconds'] = max(total['max_seconds'],
+                                   invocation['seconds'])
+        for counter, value in invocation['counters'].items():
+            total['counters'][counter] = (
+                total['counters'].get(counter, 0) + value)
+    return sorted(totals.values(), key=lambda t: t['seconds'], reverse=True)
+
+
+def format_report(summary):
+    """Return a (text) report of a summary."""
+    lines = ['{:<60} {:>6} {:>9} {:>9} {:>5} {:>5} {:>6}'.format(
+        'lookup/hook', 'calls', 'total(s)', 'max(s)', 'api', 'hits',
+        'misses')]
+    for total in summary:
+        counters = total['counters']
+        lines.append('{:<60} {:>6} {:>9.3f} {:>9.3f} {:>5} {:>5} {:>6}'.format(
+            total['name'][-60:], total['calls'], total['seconds'],
+            total['max_seconds'], counters.get('api_calls', 0),
+            counters.get('cache_hits', 0), counters.get('cache_misses', 0)))
+    return '\n'.join(lines)
+
+
+def report():
+    """Print and/or export the run's profile (if enabled)."""
+    if not INVOCATIONS or not (PROFILE or PROFILE_JSON):
+        return
+    summary = summarize()
+    if PROFILE:
+        sys.stderr.write(format_report(summary) + '\n')
+    if PROFILE_JSON:
+        try:
+            with open(PROFILE_JSON, 'w') as json_file:
+                json.dump({'summary': summary, 'invocations': INVOCATIONS},
+                          json_file, indent=2, sort_keys=True)
+        except (IOError, OSError) as e:
+            LOGGER.warning('could not export profile (%s): %s',
+                           PROFILE_JSON, e)
+
+
+atexit.register(report)
@@ -0,0 +1,59 @@
+"""Waiter that polls many resources until they're ready (in one loop)."""
+
+import heapq
+import logging
+import random
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def wait_for_all(keys, check, timeout, delay=5, max_delay=60, factor=2,
+                 on_ready=None):
+    """Poll check(key) for many keys until they're ready (or the deadline).
+
+    One scheduler polls all the keys, each with its own exponential
+    backoff (delay * factor**n, up to max_delay, with jitter), instead of
+    N sequential waits. A key is ready when check returns a truthy value,
+    which is passed to on_ready(key, value) right away (e.g. to start
+    processing it while the others are still being polled). A key whose
+    check raises an exception is given up on.
+
+    Returns the {key: value} of every key (None if it wasn't ready in
+    time).
+    """
+    deadline = time.time() + timeout
+    results = dict((key, None) for key in keys)
+    # (next poll time, order, key, delay) - order keeps keys comparable
+    schedule = [(time.time(), i, key, delay) for i, key in enumerate(keys)]
+    heapq.heapify(schedule)
+    while schedule:
+        poll_time, i, key, key_delay = heapq.heappop(schedule)
+        time.sleep(max(0, poll_time - time.time()))
+        try:
+            value = check(key)
+        except Exception as e:  # pylint: disable=broad-except
+            LOGGER.warning('giving up waiting for %s: %s', key, e)
+            continue
+        if value:
+            results[key] = value
+            if on_ready:
+                on_ready(key, value)
+            continue
+        next_poll_time = time.time() + key_delay * random.uniform(0.8, 1.2)
+        if next_poll_time > deadline:
+            LOGGER.warning('timed out waiting for %s', key)
+            continue
+        LOGGER.debug('%s not ready, polling again in %.1fs', key, key_delay)
+        heapq.heappush(schedule, (next_poll_time, i, key,
+                                  min(key_delay * factor, max_delay)))
+    return results
+
+
+def wait_for(check, timeout, delay=5, max_delay=60, factor=2, name='it'):
+    """Poll check() until it's ready (or the deadline) and return its value.
+
+    The name (of what's waited for) is only used in log messages.
+    """
+    return wait_for_all([name], lambda key: check(), timeout, delay=delay,
+                        max_delay=max_delay, factor=factor)[name]
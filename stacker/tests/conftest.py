@@ -0,0 +1,10 @@
+"""Make the stacker_utils package and the pa_failover Lambda importable."""
+
+import os
+import sys
+
+STACKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (STACKER_DIR, os.path.join(STACKER_DIR, 'lambda')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
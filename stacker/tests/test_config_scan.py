@@ -0,0 +1,36 @@
+"""Tests of the lookup argument scan (stacker_utils.config_scan)."""
+
+from stacker_utils.config_scan import find_lookup_args
+
+
+class Config(object):
+    """Stand-in of a stacker config (a schematics model)."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_primitive(self):
+        return self.data
+
+
+def test_find_lookup_args_in_nested_config():
+    config = Config({
+        'stacks': [
+            {'variables': {
+                'Ami': '${EC2AttrByNameTag web::ImageId}',
+                'Ids': ['${EC2AttrByNameTag  app::InstanceId }',
+                        '${EC2AttrByNameTag web::ImageId}']}}],
+        'pre_build': [
+            {'args': {'x': 'a ${EC2AttrByNameTag db::PrivateIp} b'}}],
+    })
+    assert find_lookup_args(config, 'EC2AttrByNameTag') == [
+        'app::InstanceId', 'db::PrivateIp', 'web::ImageId']
+
+
+def test_find_lookup_args_skips_nested_lookups_and_other_types():
+    config = {'a': '${EC2AttrByNameTag ${output stack::Name}::ImageId}',
+              'b': '${ecsinstanceami /aws/service/ecs::image_id}',
+              'c': 42}
+    assert find_lookup_args(config, 'EC2AttrByNameTag') == []
+    assert find_lookup_args(config, 'ecsinstanceami') == [
+        '/aws/service/ecs::image_id']
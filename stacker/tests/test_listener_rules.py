@@ -0,0 +1,122 @@
+"""Tests of the ALB listener rule helpers (stacker_utils.listener_rules)."""
+
+import threading
+
+import pytest
+
+from stacker_utils.listener_rules import (PriorityAllocator, condition_key,
+                                          diff_rules, matches, rule_key)
+
+
+def rule(priority, path, target='tg', arn=None):
+    """Return an (existing or desired) path-pattern forwarding rule."""
+    return {'RuleArn': arn or 'arn:rule' + path,
+            'Priority': priority,
+            'Conditions': [{'Field': 'path-pattern', 'Values': [path]}],
+            'Actions': [{'Type': 'forward', 'TargetGroupArn': target}]}
+
+
+def desired(path, target='tg', priority=None):
+    """Return a desired rule (without an ARN)."""
+    desired_rule = rule(priority, path, target)
+    del desired_rule['RuleArn']
+    if priority is None:
+        del desired_rule['Priority']
+    return desired_rule
+
+
+def test_condition_key_ignores_value_order_and_config_form():
+    assert (condition_key({'Field': 'host-header', 'Values': ['b', 'a']}) ==
+            condition_key({'Field': 'host-header',
+                           'HostHeaderConfig': {'Values': ['a', 'b']}}))
+
+
+def test_rule_key_ignores_condition_order():
+    conditions = [{'Field': 'path-pattern', 'Values': ['/a']},
+                  {'Field': 'host-header', 'Values': ['x']}]
+    assert (rule_key({'Conditions': conditions}) ==
+            rule_key({'Conditions': conditions[::-1]}))
+
+
+def test_allocate_lowest_free_priorities():
+    allocator = PriorityAllocator([1, 2, 4, 7])
+    assert allocator.allocate(3) == [3, 5, 6]
+    assert allocator.allocate(start=6) == [8]
+    assert not allocator.is_free(5)
+
+
+def test_allocate_fails_when_full():
+    allocator = PriorityAllocator([1, 2], max_priority=3)
+    with pytest.raises(ValueError):
+        allocator.allocate(2)
+
+
+def test_reserve_and_release():
+    allocator = PriorityAllocator([5])
+    with pytest.raises(ValueError):
+        allocator.reserve(5)
+    allocator.release(5)
+    allocator.reserve('5')
+    assert allocator.occupied == [5]
+
+
+def test_concurrent_allocations_never_collide():
+    allocator = PriorityAllocator(range(1, 100, 2))
+    allocated = []
+
+    def allocate():
+        for _ in range(50):
+            allocated.extend(allocator.allocate())
+
+    threads = [threading.Thread(target=allocate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(allocated)) == len(allocated) == 200
+
+
+def test_matches_compares_the_desired_subset_only():
+    assert matches({'Type': 'forward', 'Order': 1},
+                   {'Type': 'forward', 'Order': '1', 'ForwardConfig': {}})
+    assert not matches({'Type': 'forward'}, {'Type': 'redirect'})
+    assert not matches([{'Type': 'forward'}], [])
+
+
+def test_diff_rules_is_a_noop_when_in_sync():
+    existing = [rule('1', '/a'), rule('2', '/b')]
+    changes = diff_rules([desired('/a'), desired('/b', priority=2)],
+                         existing, prune=True)
+    assert changes == {
+        'creates': [], 'modifies': [], 'priorities': [], 'deletes': []}
+
+
+def test_diff_rules_creates_with_the_lowest_free_priority():
+    changes = diff_rules([desired('/a'), desired('/new')],
+                         [rule('1', '/a'), rule('2', '/b')], prune=False)
+    assert [(r['Priority'], r['Conditions'][0]['Values'])
+            for r in changes['creates']] == [(3, ['/new'])]
+    assert changes['deletes'] == []
+
+
+def test_diff_rules_prune_frees_the_deleted_priorities():
+    changes = diff_rules([desired('/a'), desired('/new')],
+                         [rule('1', '/a'), rule('2', '/b')], prune=True)
+    assert changes['creates'][0]['Priority'] == 2
+    assert changes['deletes'] == ['arn:rule/b']
+
+
+def test_diff_rules_modifies_actions_and_moves_priorities():
+    changes = diff_rules([desired('/a', target='tg2', priority=5)],
+                         [rule('1', '/a')], prune=False)
+    assert [arn for arn, _ in changes['modifies']] == ['arn:rule/a']
+    assert changes['priorities'] == [('arn:rule/a', 5)]
+
+
+def test_diff_rules_rejects_priority_collisions():
+    with pytest.raises(ValueError):
+        diff_rules([desired('/a', priority=2)],
+                   [rule('2', '/b')], prune=False)
+    with pytest.raises(ValueError):
+        diff_rules([desired('/a', priority=3), desired('/b', priority=3)],
+                   [], prune=False)
@@ -0,0 +1,84 @@
+"""Tests of the lookup cache and the EC2AttrByNameTag instance index."""
+
+import importlib.util
+import os
+import threading
+import time
+
+import pytest
+
+from stacker_utils import lookup_cache
+
+LOOKUPS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lookups')
+
+
+class Provider(object):
+    """Stand-in of a stacker provider."""
+    region = 'us-east-1'
+
+
+@pytest.fixture(autouse=True)
+def clear_lookup_cache():
+    lookup_cache.clear()
+    yield
+    lookup_cache.clear()
+
+
+def load_lookup(name):
+    """Import a lookup module (their file names aren't identifiers)."""
+    pytest.importorskip('stacker.session_cache')
+    spec = importlib.util.spec_from_file_location(
+        name.replace('-', '_'), os.path.join(LOOKUPS_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_cached_lookup_fetches_each_value_once():
+    calls = []
+
+    @lookup_cache.cached_lookup('Test')
+    def handler(value, provider, **kwargs):
+        calls.append(value)
+        time.sleep(0.05)
+        return value.upper()
+
+    threads = [threading.Thread(target=handler, args=('a', Provider()))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert handler('a', Provider()) == 'A'
+    assert calls == ['a']
+
+
+def test_cached_lookup_does_not_cache_errors_or_exceptions():
+    calls = []
+
+    @lookup_cache.cached_lookup('Test')
+    def handler(value, provider, **kwargs):
+        calls.append(value)
+        if value == 'raise':
+            raise RuntimeError('boom')
+        return 'error: transient'
+
+    for _ in range(2):
+        assert handler('error', Provider()) == 'error: transient'
+        with pytest.raises(RuntimeError):
+            handler('raise', Provider())
+    assert calls == ['error', 'raise'] * 2
+
+
+def test_flatten_and_query_instance_attributes():
+    lookup = load_lookup('instance-attribute-by-name-tag-lookup')
+    index = lookup.flatten({
+        'InstanceId': 'i-1',
+        'SecurityGroups': [{'GroupId': 'sg-%d' % n} for n in range(11)],
+        'Tags': [{'Key': 'Role', 'Value': 'web'}]})
+    assert lookup.query(index, 'Tags.Role') == 'web'
+    assert lookup.query(index, 'SecurityGroups.10.GroupId') == 'sg-10'
+    assert lookup.query(index, 'SecurityGroups.*.GroupId') == ','.join(
+        'sg-%d' % n for n in range(11))
+    assert lookup.query(index, 'Platform') is None
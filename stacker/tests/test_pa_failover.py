@@ -0,0 +1,222 @@
+"""Tests of the pa_failover planner, pairing and AWS call retries (run
+   against the in-process stand-in of pa_failover_benchmark.py)."""
+
+import json
+
+import botocore.exceptions
+import pytest
+
+import pa_failover
+from pa_failover_benchmark import StandInAwsBackend, add_firewall, use_backend
+
+
+@pytest.fixture
+def backend():
+    """A primary/standby pair (4 ENIs each, 4 extra routed subnets)."""
+    backend = StandInAwsBackend.from_topology(4, 4)
+    use_backend(backend)
+    pa_failover.set_up(False, False, False)
+    pa_failover.set_deadline(None)
+    return backend
+
+
+def tag(backend, instance_id, key, value):
+    """Tag an instance of the stand-in backend."""
+    backend.instances[instance_id]['Tags'].append(
+        {'Key': key, 'Value': value})
+
+
+def get_tags(backend, instance_id):
+    """Return the tags of an instance of the stand-in backend (dict)."""
+    return dict((t['Key'], t['Value'])
+                for t in backend.instances[instance_id]['Tags'])
+
+
+def routes_targeting(backend, prefix):
+    """Return the (route table ID, destination) of the routes targeting
+       network interfaces whose ID starts with prefix."""
+    return sorted(
+        (route_table_id, route['DestinationCidrBlock'])
+        for route_table_id, route_table in backend.route_tables.items()
+        for route in route_table['Routes']
+        if route.get('NetworkInterfaceId', '').startswith(prefix))
+
+
+def plan_failover():
+    """Plan the failover of the primary (i-primary)."""
+    failed, standby = pa_failover.Ec2Instance.from_failover_pair('i-primary')
+    return pa_failover.FailoverPlan.from_instances(failed, standby)
+
+
+def test_plan_moves_every_route_of_the_failed_instance(backend):
+    backend.route_tables['rtb-app-0']['Routes'].append({
+        'DestinationCidrBlock': '192.168.0.0/16',
+        'NetworkInterfaceId': 'eni-i-primary-3', 'State': 'active'})
+    plan = plan_failover()
+    assert sorted(
+        (r['route_table_id'], r['destination']['DestinationCidrBlock'])
+        for r in plan.route_replacements) == routes_targeting(
+            backend, 'eni-i-primary-')
+    # every route moves to the standby ENI of the same device index
+    for route_replacement in plan.route_replacements:
+        route = [r for r in backend.route_tables[
+            route_replacement['route_table_id']]['Routes']
+            if r.get('DestinationCidrBlock') ==
+            route_replacement['destination']['DestinationCidrBlock']][0]
+        assert (route['NetworkInterfaceId'].split('-')[-1] ==
+                route_replacement['net_int_id'].split('-')[-1])
+        assert route_replacement['net_int_id'].startswith('eni-i-standby-')
+
+
+def test_plan_moves_the_eips_and_swaps_the_tags(backend):
+    plan = plan_failover()
+    # 2 EIPs on every ENI of the primary but eth0
+    assert len(plan.eip_moves) == 6
+    assert all(m['net_int_id'].startswith('eni-i-standby-')
+               for m in plan.eip_moves)
+    assert sorted((u['instance_id'], u['tag'], u['val'])
+                  for u in plan.tag_updates) == [
+        ('i-primary', 'FailbackPending', 'true'),
+        ('i-primary', 'Primary', 'false'),
+        ('i-standby', 'Primary', 'true')]
+
+
+def test_plan_survives_a_serialization_round_trip(backend):
+    plan = plan_failover()
+    loaded = pa_failover.FailoverPlan.from_dict(
+        json.loads(json.dumps(plan.to_dict())))
+    assert loaded.to_dict() == plan.to_dict()
+    assert loaded.verify()
+
+
+def test_verify_detects_moved_and_new_routes(backend):
+    plan = plan_failover()
+    routes = backend.route_tables['rtb-app-0']['Routes']
+    routes[1]['NetworkInterfaceId'] = 'eni-elsewhere'
+    assert not plan.verify()
+    routes[1]['NetworkInterfaceId'] = 'eni-i-primary-2'
+    assert plan.verify()
+    routes.append({'DestinationCidrBlock': '172.16.0.0/12',
+                   'NetworkInterfaceId': 'eni-i-primary-2'})
+    assert not plan.verify()
+
+
+def test_verify_detects_moved_eips(backend):
+    plan = plan_failover()
+    backend.associate_address(
+        AllocationId='eipalloc-1-0', NetworkInterfaceId='eni-i-standby-1',
+        PrivateIpAddress='10.1.1.10')
+    assert not plan.verify()
+
+
+def test_standby_is_looked_up_within_the_pair(backend):
+    tag(backend, 'i-primary', pa_failover.PAIR_TAG, 'pair-a')
+    tag(backend, 'i-standby', pa_failover.PAIR_TAG, 'pair-a')
+    add_firewall(backend, 'i-other', tags=[
+        ('Primary', 'false'), (pa_failover.PAIR_TAG, 'pair-b')])
+    failed, standby = pa_failover.Ec2Instance.from_failover_pair('i-primary')
+    assert (failed.id, standby.id) == ('i-primary', 'i-standby')
+    pairs = pa_failover.get_firewall_pairs(
+        pa_failover.get_firewall_descriptions())
+    assert dict((pair_id, sorted(d['InstanceId'] for d in descriptions))
+                for pair_id, descriptions in pairs.items()) == {
+        'pair-a': ['i-primary', 'i-standby'], 'pair-b': ['i-other']}
+
+
+def test_pairs_default_to_the_vpc_and_leave_departed_standbys_out(backend):
+    add_firewall(backend, 'i-gone', state='terminated',
+                 tags=[('Primary', 'false')])
+    pairs = pa_failover.get_firewall_pairs(
+        pa_failover.get_firewall_descriptions())
+    assert list(pairs) == ['vpc-benchmark']
+    assert sorted(d['InstanceId'] for d in pairs['vpc-benchmark']) == [
+        'i-primary', 'i-standby']
+
+
+def test_failover_moves_the_traffic_and_swaps_the_tags(backend):
+    result = pa_failover.main('i-primary', verbose=False, debug=False)
+    assert result.startswith('failed over')
+    assert routes_targeting(backend, 'eni-i-primary-') == []
+    assert get_tags(backend, 'i-primary')['Primary'] == 'false'
+    assert get_tags(backend, 'i-standby')['Primary'] == 'true'
+    # a rerun (e.g. a duplicate alarm) does not fail back
+    assert pa_failover.main(
+        'i-primary', verbose=False, debug=False).startswith('not failing')
+
+
+def test_route_table_index_falls_back_to_the_main_route_table():
+    index = pa_failover.RouteTableIndex('vpc-1', [
+        {'RouteTableId': 'rtb-main', 'Associations': [{'Main': True}],
+         'Routes': []},
+        {'RouteTableId': 'rtb-a',
+         'Associations': [{'Main': False, 'SubnetId': 'subnet-a'}],
+         'Routes': [{'DestinationPrefixListId': 'pl-1',
+                     'NetworkInterfaceId': 'eni-1'},
+                    {'DestinationCidrBlock': '10.0.0.0/8',
+                     'GatewayId': 'local'}]}])
+    assert index.route_table_id('subnet-a') == 'rtb-a'
+    assert index.route_table_id('subnet-b') == 'rtb-main'
+    assert index.routes_targeting(['eni-1']) == [{
+        'route_table_id': 'rtb-a',
+        'destination': {'DestinationPrefixListId': 'pl-1'},
+        'net_int_id': 'eni-1'}]
+
+
+def failing(codes):
+    """Return an AWS call raising ClientErrors of the given codes (in turn)
+       and then returning 'ok', and the list of its calls."""
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= len(codes):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': codes[len(calls) - 1], 'Message': ''}},
+                'Test')
+        return 'ok'
+    return call, calls
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(pa_failover, 'RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(pa_failover, 'RETRY_MAX_DELAY', 0.001)
+    pa_failover.reset_spans()
+    pa_failover.set_deadline(None)
+    yield
+    pa_failover.set_deadline(None)
+
+
+def test_aws_call_retries_throttling(fast_retries):
+    call, calls = failing(['RequestLimitExceeded', 'InternalError'])
+    assert pa_failover.aws_call('test:Call', call) == 'ok'
+    assert len(calls) == 3
+    assert pa_failover.SPANS[-1]['attempts'] == 3
+
+
+def test_aws_call_raises_fatal_errors_right_away(fast_retries):
+    call, calls = failing(['AccessDenied'])
+    with pytest.raises(botocore.exceptions.ClientError):
+        pa_failover.aws_call('test:Call', call)
+    assert len(calls) == 1
+
+
+def test_aws_call_stops_retrying_at_the_max_attempts(fast_retries,
+                                                     monkeypatch):
+    monkeypatch.setattr(pa_failover, 'RETRY_MAX_ATTEMPTS', 3)
+    call, calls = failing(['Throttling'] * 5)
+    with pytest.raises(botocore.exceptions.ClientError):
+        pa_failover.aws_call('test:Call', call)
+    assert len(calls) == 3
+
+
+def test_aws_call_stops_retrying_at_the_deadline(fast_retries):
+    pa_failover.set_deadline(0)
+    call, calls = failing(['Throttling'] * 5)
+    with pytest.raises(botocore.exceptions.ClientError):
+        pa_failover.aws_call('test:Call', call)
+    assert len(calls) == 1
+
+
+def test_boto_clients_make_a_single_attempt():
+    assert pa_failover.BOTO_CONFIG.retries['total_max_attempts'] == 1
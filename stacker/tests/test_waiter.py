@@ -0,0 +1,47 @@
+"""Tests of the multiplexed waiter (stacker_utils.waiter)."""
+
+from stacker_utils.waiter import wait_for, wait_for_all
+
+
+def ready_after(polls_needed):
+    """Return a check (and its poll counts) ready after n polls of a key."""
+    polls = {}
+
+    def check(key):
+        polls[key] = polls.get(key, 0) + 1
+        if polls[key] >= polls_needed[key]:
+            return 'ready-' + key
+        return None
+    return check, polls
+
+
+def test_wait_for_all_returns_every_value_and_calls_on_ready():
+    check, polls = ready_after({'a': 1, 'b': 3})
+    ready = []
+    results = wait_for_all(['a', 'b'], check, timeout=5, delay=0.01,
+                           on_ready=lambda key, value: ready.append(key))
+    assert results == {'a': 'ready-a', 'b': 'ready-b'}
+    assert polls == {'a': 1, 'b': 3}
+    assert ready == ['a', 'b']
+
+
+def test_wait_for_all_gives_up_on_timeout_and_errors():
+    def check(key):
+        if key == 'broken':
+            raise RuntimeError('boom')
+        return None
+    results = wait_for_all(['never', 'broken'], check, timeout=0.1,
+                           delay=0.02, max_delay=0.02)
+    assert results == {'never': None, 'broken': None}
+
+
+def test_wait_for_all_backs_off_per_key():
+    check, polls = ready_after({'slow': 100})
+    wait_for_all(['slow'], check, timeout=0.35, delay=0.05, factor=2)
+    # polls at ~0, 0.05, 0.15 and 0.35 (not every 0.05 s)
+    assert 3 <= polls['slow'] <= 4
+
+
+def test_wait_for_returns_the_value():
+    check, _ = ready_after({'it': 2})
+    assert wait_for(lambda: check('it'), timeout=5, delay=0.01) == 'ready-it'
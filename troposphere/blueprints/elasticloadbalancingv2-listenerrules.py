@@ -20,7 +20,9 @@ class ListenerRules(Blueprint):
             'description': 'List of rules to add to a ALB listener. List'
                            ' should be a list of dicts with the keys:'
                            ' Condition, Value, Priority, TargetGroupArn'
-                           ' (Condition: host-header or path-pattern)',
+                           ' (Condition: host-header or path-pattern)'
+                           ' (Priority: e.g. from the ALBRulePriority'
+                           ' lookup)',
             'default': [
                 {'Condition':'host-header', 'Value':'www.host.com',
                  'Priority': 1, 'TargetGroupArn':'arn::targetgroup1'},
@@ -35,6 +37,14 @@ class ListenerRules(Blueprint):
         template = self.template
         variables = self.get_variables()
 
+        # fail fast (at render time) on colliding priorities
+        priorities = set()
+        for rule in variables['Rules']:
+            if str(rule['Priority']) in priorities:
+                raise ValueError('Duplicate listener rule priority: {}'.format(
+                    rule['Priority']))
+            priorities.add(str(rule['Priority']))
+
         for rule in variables['Rules']:
             listenerrule = template.add_resource(
                 elasticloadbalancingv2.ListenerRule(